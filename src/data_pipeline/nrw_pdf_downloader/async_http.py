@@ -0,0 +1,148 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+# concurrent requests allowed per host; the geoportal hosts behave very differently under load
+DEFAULT_HOST_LIMITS = {"www.o-sp.de": 8,
+                       "gisdata.krzn.de": 4}
+# limit for all other (mostly municipal) hosts
+DEFAULT_HOST_LIMIT = 2
+# upper bound for the number of worker threads doing the blocking I/O
+MAX_WORKERS = 64
+
+
+def get_host(url: str) -> str:
+    """ Return the lower-cased host (netloc) of url."""
+    return urlparse(url).netloc.lower()
+
+
+class HostPool:
+    """ Keeps one pooled keep-alive session and one concurrency limit per host.
+
+    Every host gets its own requests.Session whose connection pool is sized to the host limit, so connections are
+    reused across requests instead of being opened for every file. The asyncio semaphores bounding the number of
+    requests in flight per host are created lazily inside the running event loop.
+
+    Args:
+        host_limits: dict mapping host to the maximum number of concurrent requests, merged over DEFAULT_HOST_LIMITS
+        default_limit: limit used for hosts not listed in host_limits
+    """
+
+    def __init__(self,
+                 host_limits: dict = None,
+                 default_limit: int = DEFAULT_HOST_LIMIT):
+        self.host_limits = {**DEFAULT_HOST_LIMITS, **(host_limits or {})}
+        self.default_limit = default_limit
+        self._sessions = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, host: str) -> int:
+        """ Return the concurrency limit for host."""
+        return self.host_limits.get(host, self.default_limit)
+
+    def session_for(self, host: str) -> requests.Session:
+        """ Return the (shared) session for host, creating it on first use."""
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.limit_for(host))
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def semaphore_for(self, host: str) -> asyncio.Semaphore:
+        """ Return the semaphore bounding the requests in flight for host."""
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limit_for(host))
+        return self._semaphores[host]
+
+    def close(self):
+        """ Close all sessions and their pooled connections."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+        self._semaphores = {}
+
+    def reset_semaphores(self):
+        """ Drop the semaphores, which are bound to the event loop they were first used in."""
+        self._semaphores = {}
+
+
+def run_coroutine(coroutine):
+    """ Run coroutine to completion, also when called from a running event loop (e.g. a Jupyter notebook)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # a loop is already running in this thread, so run the coroutine in a fresh loop in a helper thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+async def _map_per_host_async(func, jobs, pool, max_workers, progress_bar):
+    """ Schedule all jobs on a thread pool, bounded by the per-host semaphores of pool."""
+    loop = asyncio.get_running_loop()
+    pool.reset_semaphores()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        async def run_job(url, args):
+            host = get_host(url)
+            async with pool.semaphore_for(host):
+                result = await loop.run_in_executor(executor, func, pool.session_for(host), *args)
+            if progress_bar is not None:
+                progress_bar.update(1)
+            return result
+
+        return await asyncio.gather(*(run_job(url, args) for url, args in jobs))
+
+
+def map_per_host(func,
+                 jobs: list,
+                 host_limits: dict = None,
+                 default_limit: int = DEFAULT_HOST_LIMIT,
+                 max_workers: int = None,
+                 pool: HostPool = None,
+                 show_progress: bool = True) -> list:
+    """ Apply a blocking request function to many urls concurrently, limited per host.
+
+    The function is called as func(session, *args) in a worker thread, where session is the pooled session of the
+    host of the job url. At most host_limits[host] calls run at the same time for each host, so slow or fragile
+    hosts are not overloaded while fast hosts are used to their capacity.
+
+    Args:
+        func: blocking function taking a requests.Session followed by the job arguments
+        jobs: list of (url, args) tuples, where args is a tuple of arguments passed to func
+        host_limits: dict mapping host to the maximum number of concurrent requests
+        default_limit: limit used for hosts not listed in host_limits
+        max_workers: number of worker threads; defaults to the sum of the limits of all hosts, capped at MAX_WORKERS
+        pool: existing HostPool to reuse; if None, a new pool is created and closed afterwards
+        show_progress: whether to show a tqdm progress bar
+
+    Returns:
+        list: results of func in the order of jobs
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = HostPool(host_limits=host_limits, default_limit=default_limit)
+
+    if max_workers is None:
+        hosts = {get_host(url) for url, _ in jobs}
+        max_workers = min(MAX_WORKERS, max(1, sum(pool.limit_for(host) for host in hosts)))
+
+    progress_bar = tqdm(total=len(jobs)) if show_progress else None
+    try:
+        return run_coroutine(_map_per_host_async(func, jobs, pool, max_workers, progress_bar))
+    finally:
+        if progress_bar is not None:
+            progress_bar.close()
+        if own_pool:
+            pool.close()
@@ -0,0 +1,84 @@
+import threading
+
+PDF_MAGIC = b"%PDF"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+HTML_MARKERS = (b"<!doctype html", b"<html", b"<head", b"<body", b"<?xml")
+# the PDF header may be preceded by some garbage, readers accept it within the first 1024 bytes
+SNIFF_LENGTH = 1024
+# number of consecutive PDFs after which a host is trusted to always serve PDFs
+TRUST_AFTER = 20
+
+
+def sniff_content_type(first_bytes: bytes) -> str:
+    """ Classify the first bytes of a response body.
+
+    Args:
+        first_bytes: beginning of the response body
+
+    Returns:
+        str: 'pdf', 'png', 'html' or 'unknown'
+    """
+    head = first_bytes[:SNIFF_LENGTH]
+    if PDF_MAGIC in head:
+        return "pdf"
+    if head.startswith(PNG_MAGIC):
+        return "png"
+    if head.lstrip().lower().startswith(HTML_MARKERS):
+        return "html"
+    return "unknown"
+
+
+def is_downloadable_content(content_type: str | None, first_bytes: bytes) -> bool:
+    """ Decide from the response headers and the first bytes whether the response is a downloadable document.
+
+    The magic bytes take precedence, as some hosts send wrong Content-Type headers. If the content cannot be
+    classified, the Content-Type header is used like in is_downloadable.
+
+    Args:
+        content_type: value of the Content-Type header, may be None
+        first_bytes: beginning of the response body
+
+    Returns:
+        bool: whether the response should be saved
+    """
+    kind = sniff_content_type(first_bytes)
+    if kind in ("pdf", "png"):
+        return True
+    if kind == "html":
+        return False
+    content_type = (content_type or "").lower()
+    return not ('text' in content_type or 'html' in content_type)
+
+
+class TrustedHostCache:
+    """ Remembers the hosts that always serve PDFs.
+
+    A host becomes trusted once it served trust_after PDFs in a row. Downloads from trusted hosts skip the
+    downloadability check entirely. A single response that is not a PDF resets the count of the host.
+
+    Args:
+        trust_after: number of consecutive PDFs after which a host is trusted
+    """
+
+    def __init__(self, trust_after: int = TRUST_AFTER):
+        self.trust_after = trust_after
+        self._pdf_counts = {}
+        self._lock = threading.Lock()
+
+    def is_trusted(self, host: str) -> bool:
+        """ Whether host served at least trust_after PDFs in a row."""
+        with self._lock:
+            return self._pdf_counts.get(host, 0) >= self.trust_after
+
+    def record(self, host: str, kind: str):
+        """ Record the sniffed content kind of a response from host."""
+        with self._lock:
+            if kind == "pdf":
+                self._pdf_counts[host] = self._pdf_counts.get(host, 0) + 1
+            else:
+                self._pdf_counts[host] = 0
+
+    def trusted_hosts(self) -> list:
+        """ Return the list of trusted hosts."""
+        with self._lock:
+            return [host for host, count in self._pdf_counts.items() if count >= self.trust_after]
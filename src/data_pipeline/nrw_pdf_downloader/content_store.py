@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+
+# name of the content-addressed store, created inside the pdf output folder
+CONTENT_STORE_FOLDER = "content_store"
+
+
+class ContentStore:
+    """ Content-addressed store holding every distinct PDF once, named <sha256>.pdf.
+
+    The same PDF is often linked under several objectids. Storing it by the SHA-256 hash of its content means
+    duplicates cost the disk space and the text extraction of one file. The objectid -> hash mapping is kept in the
+    DownloadManifest of the output folder. The store is a flat folder, so pdf_parser_from_folder can be applied to
+    it directly to parse every unique document once.
+
+    Args:
+        root: folder of the store, created if it does not exist
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def for_folder(cls, output_folder: str) -> "ContentStore":
+        """ Open the store inside the pdf output folder."""
+        return cls(os.path.join(output_folder, CONTENT_STORE_FOLDER))
+
+    def path_for(self, sha256: str) -> str:
+        """ Return the path of the document with hash sha256."""
+        return os.path.join(self.root, sha256 + ".pdf")
+
+    def contains(self, sha256: str) -> bool:
+        """ Whether the document with hash sha256 is stored."""
+        return sha256 is not None and os.path.exists(self.path_for(sha256))
+
+    def add(self, file_path: str, sha256: str) -> str:
+        """ Move a completely written file with hash sha256 into the store.
+
+        If the document is already stored, the file is removed instead, so every document is kept exactly once.
+
+        Returns:
+            str: path of the stored document
+        """
+        stored_path = self.path_for(sha256)
+        if os.path.exists(stored_path):
+            os.remove(file_path)
+        else:
+            os.replace(file_path, stored_path)
+        return stored_path
+
+
+def expand_to_objectids(document_df: pd.DataFrame,
+                        hash_mapping_df: pd.DataFrame,
+                        filename_column: str = "filename") -> pd.DataFrame:
+    """ Fan out results computed once per unique document to all objectids linking to it.
+
+    Stages like pdf_parser_from_folder, the keyword searches or the knowledge agent can run on the content store,
+    i.e. once per <sha256>.pdf. This function maps their results back to one row per objectid with the filename
+    <objectid>.pdf, so the downstream joins on the filename keep working.
+
+    Args:
+        document_df: df with one row per stored document and the filename <sha256>.pdf in filename_column
+        hash_mapping_df: df with columns objectid and sha256, e.g. from DownloadManifest.hash_mapping()
+        filename_column: name of the filename column in document_df
+
+    Returns:
+        pd.DataFrame: document_df with one row per objectid and the filename replaced by <objectid>.pdf
+    """
+    document_df = document_df.copy()
+    document_df["sha256"] = document_df[filename_column].str.replace(r'\.pdf$', '', regex=True)
+
+    expanded_df = hash_mapping_df[["objectid", "sha256"]].merge(document_df, on="sha256", how="inner")
+    expanded_df[filename_column] = expanded_df["objectid"].astype(str) + ".pdf"
+
+    return expanded_df.drop(columns=["objectid", "sha256"])
@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+# name of the manifest database, stored in the pdf output folder
+MANIFEST_FILE_NAME = "download_manifest.sqlite"
+
+MANIFEST_COLUMNS = ["objectid", "url", "size", "sha256", "etag", "last_modified", "status", "updated_at"]
+
+
+class DownloadManifest:
+    """ Persistent record of the PDFs downloaded into one output folder.
+
+    The manifest is a SQLite database with one row per objectid, holding the url, size, SHA-256 hash, the ETag and
+    Last-Modified validators sent by the server and the download status. It allows reruns of the downloader to skip
+    completed files and to revalidate them with conditional requests. All methods are thread-safe, so one manifest
+    can be shared by concurrent downloads.
+
+    Args:
+        path: path to the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    objectid TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    size INTEGER,
+                    sha256 TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )""")
+
+    @classmethod
+    def for_folder(cls, output_folder: str) -> "DownloadManifest":
+        """ Open the manifest stored in output_folder."""
+        return cls(os.path.join(output_folder, MANIFEST_FILE_NAME))
+
+    def get(self, object_id: str) -> dict | None:
+        """ Return the manifest entry of object_id as dict, or None if it was never recorded."""
+        with self._lock:
+            row = self._connection.execute(f"SELECT {', '.join(MANIFEST_COLUMNS)} FROM downloads WHERE objectid = ?",
+                                           (object_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(MANIFEST_COLUMNS, row))
+
+    def record(self,
+               object_id: str,
+               url: str,
+               status: str,
+               size: int = None,
+               sha256: str = None,
+               etag: str = None,
+               last_modified: str = None):
+        """ Insert or replace the manifest entry of object_id."""
+        entry = (object_id, url, size, sha256, etag, last_modified, status, datetime.now().isoformat())
+        with self._lock, self._connection:
+            self._connection.execute(f"INSERT OR REPLACE INTO downloads ({', '.join(MANIFEST_COLUMNS)}) "
+                                     f"VALUES ({', '.join('?' * len(MANIFEST_COLUMNS))})", entry)
+
+    def touch(self, object_id: str):
+        """ Update the timestamp of an entry that was revalidated without changes."""
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE downloads SET updated_at = ? WHERE objectid = ?",
+                                     (datetime.now().isoformat(), object_id))
+
+    def to_df(self) -> pd.DataFrame:
+        """ Return the whole manifest as pd.DataFrame."""
+        with self._lock:
+            return pd.read_sql_query(f"SELECT {', '.join(MANIFEST_COLUMNS)} FROM downloads", self._connection)
+
+    def hash_mapping(self) -> pd.DataFrame:
+        """ Return the objectid -> sha256 mapping of all downloaded PDFs as pd.DataFrame."""
+        with self._lock:
+            return pd.read_sql_query("SELECT objectid, sha256 FROM downloads WHERE status = 'downloaded'",
+                                     self._connection)
+
+    def close(self):
+        """ Close the database connection."""
+        with self._lock:
+            self._connection.close()
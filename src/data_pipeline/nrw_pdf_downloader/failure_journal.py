@@ -0,0 +1,127 @@
+import csv
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+# name of the failure journal, stored in the pdf output folder
+JOURNAL_FILE_NAME = "failure_journal.csv"
+
+JOURNAL_COLUMNS = ["timestamp", "objectid", "scanurl", "host", "reason", "http_status", "attempt", "transient"]
+
+# HTTP status codes worth retrying later
+TRANSIENT_HTTP_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class FailureJournal:
+    """ Append-only CSV journal of failed downloads.
+
+    Every failed attempt is appended as one row with the reason, the HTTP status (if any), the number of the attempt
+    for this objectid and whether the failure is transient, i.e. worth retrying. Rows are never rewritten, so the
+    journal keeps the full history across runs. All methods are thread-safe.
+
+    Args:
+        path: path to the CSV file, created with a header if it does not exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._attempts = defaultdict(int)
+
+        if os.path.exists(path):
+            for object_id in read_failure_journal(path)["objectid"]:
+                self._attempts[object_id] += 1
+        else:
+            with open(path, 'w', newline='') as journal_file:
+                csv.writer(journal_file).writerow(JOURNAL_COLUMNS)
+
+    @classmethod
+    def for_folder(cls, output_folder: str) -> "FailureJournal":
+        """ Open the journal stored in output_folder."""
+        return cls(os.path.join(output_folder, JOURNAL_FILE_NAME))
+
+    def attempts(self, object_id: str) -> int:
+        """ Return the number of failed attempts recorded for object_id."""
+        with self._lock:
+            return self._attempts[object_id]
+
+    def record(self,
+               object_id: str,
+               link: str,
+               host: str,
+               reason: str,
+               http_status: int = None,
+               transient: bool = False) -> int:
+        """ Append a failed attempt to the journal.
+
+        Returns:
+            int: number of this attempt for object_id
+        """
+        with self._lock:
+            self._attempts[object_id] += 1
+            attempt = self._attempts[object_id]
+            with open(self.path, 'a', newline='') as journal_file:
+                csv.writer(journal_file).writerow([datetime.now().isoformat(), object_id, link, host, reason,
+                                                   http_status, attempt, transient])
+        return attempt
+
+
+def read_failure_journal(path: str) -> pd.DataFrame:
+    """ Read the failure journal at path as pd.DataFrame with one row per failed attempt."""
+    return pd.read_csv(path, dtype={"objectid": str, "http_status": "Int64"})
+
+
+def latest_failures(journal_df: pd.DataFrame) -> pd.DataFrame:
+    """ Return the last recorded failure per objectid and link from a journal df."""
+    return journal_df.drop_duplicates(["objectid", "scanurl"], keep="last").reset_index(drop=True)
+
+
+class RetryScheduler:
+    """ Exponential backoff per host for retrying transient download failures in later passes.
+
+    Hosts with transient failures in a pass are delayed before the next pass: by base_delay after the first pass
+    they failed in, doubled for every further pass, capped at max_delay. Hosts without failures are not delayed.
+    Within a pass, the delay only holds back the first requests to a host.
+
+    Args:
+        base_delay: delay in seconds after the first pass a host failed in
+        max_delay: maximum delay in seconds
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 300.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._failed_passes = defaultdict(int)
+        self._failed_in_pass = set()
+        self._next_request_at = {}
+        self._lock = threading.Lock()
+
+    def record_failure(self, host: str):
+        """ Record a transient failure on host in the current pass."""
+        with self._lock:
+            self._failed_in_pass.add(host)
+
+    def next_pass(self):
+        """ Start a new pass and push back the hosts that failed in the previous one."""
+        with self._lock:
+            now = time.monotonic()
+            for host in self._failed_in_pass:
+                self._failed_passes[host] += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (self._failed_passes[host] - 1))
+                self._next_request_at[host] = now + delay
+            self._failed_in_pass = set()
+
+    def delay_for(self, host: str) -> float:
+        """ Return the number of seconds until the next request to host may be sent."""
+        with self._lock:
+            return max(0.0, self._next_request_at.get(host, 0.0) - time.monotonic())
+
+    def wait(self, host: str):
+        """ Block until the next request to host may be sent."""
+        delay = self.delay_for(host)
+        if delay > 0:
+            time.sleep(delay)
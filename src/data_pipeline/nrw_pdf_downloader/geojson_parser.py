@@ -1,10 +1,27 @@
+import html
+import importlib.util
 import re
 
-import geopandas as gpd
 import pandas as pd
+import pyogrio
 import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
+from loguru import logger
+
+from data_pipeline.nrw_pdf_downloader.async_http import map_per_host
+from data_pipeline.nrw_pdf_downloader.http_cache import HttpCache
+
+# attribute columns of the BP geojson used by the link pipeline, see cleaning_download_links
+LINK_COLUMNS = ["objectid", "kommune", "planid", "datum", "scanurl"]
+
+# timeout in seconds for fetching a landing page
+LANDING_PAGE_TIMEOUT = 30
+
+# href of every <a> tag, in document order
+_ANCHOR_HREF_PATTERN = re.compile(r'''<a\b[^>]*?\shref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
+# prefixes of the download links per landing page host
+DOWNLOAD_LINK_PREFIXES = {"https://www.o-sp.de/": ("https://www.o-sp.de/download/", "/download/"),
+                          "https://gisdata.krzn.de/": ("https://gisdata.krzn.de/files/bplan",)}
 
 
 def _matches_url_pattern(input_string: str):
@@ -14,7 +31,9 @@ def _matches_url_pattern(input_string: str):
     return re.match(pattern, input_string)
 
 
-def parse_non_downloadable_links(gdf: "pd.DataFrame") -> "pd.DataFrame":
+def parse_non_downloadable_links(gdf: "pd.DataFrame",
+                                 host_limits: dict = None,
+                                 http_cache: HttpCache = None) -> "pd.DataFrame":
     """ Parse non-downloadable links from gdf.
 
     This function parses the links from the scanurl column of the gdf. It iterates over all rows and checks if the url
@@ -23,12 +42,17 @@ def parse_non_downloadable_links(gdf: "pd.DataFrame") -> "pd.DataFrame":
     
     
     If the url matches the pattern, the html of the page is
-    downloaded and parsed with beautiful soup. All links that start with 
+    downloaded and all links that start with 
     https://www.o-sp.de/download/ are extracted
-    and written to a dataframe.
+    and written to a dataframe. The landing pages are fetched concurrently with pooled connections and a
+    concurrency limit per host. Rows whose landing page cannot be fetched are kept unchanged.
+    The expanded rows are collected first and the result frame is built once, so the runtime is linear in the
+    number of rows.
 
     Args:
         gdf: (geo)dataframe with scanurl column and objectid column
+        host_limits: maximum number of concurrent requests per host, see async_http.map_per_host
+        http_cache: on-disk cache to get the landing pages through; if None, every page is downloaded
 
     Returns:
         pd.DataFrame: dataframe with all links that start with https://www.o-sp.de/download/ or https://gisdata.krzn.de/
@@ -37,77 +61,128 @@ def parse_non_downloadable_links(gdf: "pd.DataFrame") -> "pd.DataFrame":
     # convert objectid to string
     gdf["objectid"] = gdf["objectid"].astype(str)
 
-    for df_index, row in tqdm(gdf.iterrows(), total=len(gdf)):
-        # get content for url
-        url = row["scanurl"]
-        if not _matches_url_pattern(url):
+    # fetch the links of all landing pages concurrently
+    landing_page_urls = [url for url in gdf["scanurl"].dropna().unique() if _matches_url_pattern(url)]
+    links_per_url = _get_links_concurrently(landing_page_urls, host_limits=host_limits, http_cache=http_cache)
+
+    # collect the positions of the rows to keep and of the rows to expand, then build the result frame once
+    keep_positions = []
+    expanded_positions = []
+    expanded_urls = []
+    expanded_ids = []
+    for position, (object_id, url) in enumerate(zip(gdf["objectid"], gdf["scanurl"])):
+        links = links_per_url.get(url)
+        if links is None:
+            keep_positions.append(position)
             continue
-        links = _get_links(url)
 
-        # iterate over all links
-        for index, link in enumerate(links):
-            gdf = _parse_link(gdf, index, link, row)
+        # one new row per link, the objectid is extended with the index of the link
+        for index, href in enumerate(links):
+            expanded_positions.append(position)
+            expanded_urls.append(href)
+            expanded_ids.append(f"{object_id}_{index}")
+
+    # the expanded rows copy all information of their original row
+    expanded_gdf = gdf.iloc[expanded_positions].copy()
+    expanded_gdf["scanurl"] = expanded_urls
+    expanded_gdf["objectid"] = expanded_ids
 
-        # remove the old row
-        gdf = gdf.drop(index=df_index)
+    # the original rows of expanded links are removed
+    gdf = pd.concat([gdf.iloc[keep_positions], expanded_gdf], ignore_index=True)
 
     # sort by objectid
     gdf = gdf.sort_values(by=["objectid"])
     return gdf
 
 
-def _get_links(url):
-    """ Get all links from url that start with https://www.o-sp.de/ or  https://gisdata.krzn.de/files/bplan"""
-    r = requests.get(url, allow_redirects=True)
-    # get content
-    content = r.content
-    # open in beautiful soup
-    soup = BeautifulSoup(content, 'html.parser')
-
-    links = []  # Default value is an empty list
-
-    if "https://www.o-sp.de/" in url:
-        # get all links that start with https://www.o-sp.de/download/
-        links = soup.find_all('a', href=lambda value: value and
-                                                      (value.startswith(
-                                                          "https://www.o-sp.de/download/") or value.startswith(
-                                                          "/download/")))
-    elif "https://gisdata.krzn.de/" in url:
-        # get all links that start with https://www.o-sp.de/download/
-        links = soup.find_all('a', href=lambda value: value and
-                                                      (value.startswith(
-                                                          "https://gisdata.krzn.de/files/bplan")))
+def _extract_download_links(page: str, url: str) -> list:
+    """ Extract the hrefs of all <a> tags in page that start with one of the download prefixes of the url host.
+
+    Internal links to https://www.o-sp.de/download/ are completed to full urls.
+    """
+    prefixes = next((prefixes for host_url, prefixes in DOWNLOAD_LINK_PREFIXES.items() if host_url in url), ())
+
+    links = []
+    for match in _ANCHOR_HREF_PATTERN.finditer(page):
+        href = html.unescape(next(group for group in match.groups() if group is not None))
+        if href.startswith(prefixes):
+            links.append(_complete_link(href))
 
     return links
 
 
-def _parse_link(gdf, index, link, row):
-    """ Parse link and add the new url's to gdf """
-    # get href
-    href = link.get('href')
+def _complete_link(href: str) -> str:
+    """ Complete internal o-sp.de download links to full urls."""
     # if internal link
     if href.startswith("/download/"):
         # get full url
         href = "https://www.o-sp.de" + href
+    return href
 
-    # create a new row with the information of the old row
-    new_row = row.copy()
 
-    # add the link to the new row
-    new_row["scanurl"] = href
+def _get_links(url, session=None, http_cache=None):
+    """ Get all links from url that start with https://www.o-sp.de/ or  https://gisdata.krzn.de/files/bplan"""
+    if http_cache is not None:
+        with http_cache.get(url, session=session, timeout=LANDING_PAGE_TIMEOUT) as r:
+            return _extract_download_links(r.text, url)
 
-    # add the index to the objectid
-    new_row["objectid"] = f"{row['objectid']}_{index}"
+    requester = session if session is not None else requests
+    r = requester.get(url, allow_redirects=True, timeout=LANDING_PAGE_TIMEOUT)
+    r.raise_for_status()
 
-    # concat the new row to the matches using concatenate
-    gdf = pd.concat([gdf, new_row.to_frame().T], ignore_index=True)
+    return _extract_download_links(r.text, url)
 
-    return gdf
+
+def _get_links_or_none(session, url, http_cache=None):
+    """ Get the links of url, or None if the landing page cannot be fetched."""
+    try:
+        return _get_links(url, session=session, http_cache=http_cache)
+    except requests.RequestException as e:
+        logger.warning(f"Could not fetch landing page {url}: {e}")
+        return None
+
+
+def _get_links_concurrently(urls: list,
+                            host_limits: dict = None,
+                            http_cache: HttpCache = None) -> dict:
+    """ Fetch the landing pages concurrently and return a dict mapping each url to its links (None if failed)."""
+    links = map_per_host(_get_links_or_none, [(url, (url, http_cache)) for url in urls], host_limits=host_limits)
+
+    return dict(zip(urls, links))
+
+
+def read_link_table(file_path: str,
+                    columns: list = LINK_COLUMNS) -> pd.DataFrame:
+    """ Read the attribute table of the BP geojson or csv without geometries.
+
+    Only the given columns are read and the geometries are skipped, which takes a fraction of the time and memory of
+    gpd.read_file on the statewide NRW_BP.geojson. If pyarrow is installed, the geojson is read through Arrow.
+
+    Args:
+        file_path: path to a geojson or csv file
+        columns: columns to read; if None, all attribute columns are read
+
+    Returns:
+        pd.DataFrame: attribute table of the file
+    """
+    if file_path.endswith(".geojson"):
+        return pyogrio.read_dataframe(file_path,
+                                      columns=columns,
+                                      read_geometry=False,
+                                      use_arrow=importlib.util.find_spec("pyarrow") is not None)
+    elif file_path.endswith(".csv"):
+        usecols = None if columns is None else (lambda column: column in columns)
+        return pd.read_csv(file_path, usecols=usecols)
+    else:
+        raise ValueError("File format not supported. Please use geojson or csv.")
 
 
 def parse_geojson(file_path,
                   output_path,
-                  sample_n=None) -> 'pd.DataFrame':
+                  sample_n=None,
+                  host_limits=None,
+                  http_cache=None,
+                  columns=LINK_COLUMNS) -> 'pd.DataFrame':
     """ Parse geojson file from file_path and write it to output_path.
 
     This function parses the geojson file from file_path and writes it to output_path.
@@ -120,22 +195,21 @@ def parse_geojson(file_path,
         file_path: path to geojson file
         output_path: path to output file
         sample_n: number of rows to sample
+        host_limits: maximum number of concurrent landing page requests per host
+        http_cache: HttpCache to get the landing pages through, e.g. HttpCache(cache_dir, offline=True) to
+            parse from cached pages only
+        columns: columns to read from file_path, see read_link_table. The geometries are never read.
 
     Returns:
         pd.DataFrame: dataframe with all links and sub-links
     """
-    if file_path.endswith(".geojson"):
-        gdf = gpd.read_file(file_path)
-    elif file_path.endswith(".csv"):
-        gdf = pd.read_csv(file_path)
-    else:
-        raise ValueError("File format not supported. Please use geojson or csv.")
+    gdf = read_link_table(file_path, columns=columns)
 
     if sample_n is not None:
         gdf = gdf.sample(sample_n, random_state=912)
         gdf = gdf.reset_index()
 
-    df = parse_non_downloadable_links(gdf)
+    df = parse_non_downloadable_links(gdf, host_limits=host_limits, http_cache=http_cache)
 
     df.to_csv(output_path)
 
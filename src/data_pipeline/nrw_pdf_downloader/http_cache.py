@@ -0,0 +1,219 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# default upper bound of the cache size in bytes
+DEFAULT_MAX_BYTES = 1024 ** 3
+# size of the chunks in which bodies are streamed into and out of the cache
+CACHE_CHUNK_SIZE = 1024 * 1024
+# name of the index database inside the cache folder
+CACHE_INDEX_FILE_NAME = "index.sqlite"
+
+_CACHED_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class CacheMiss(requests.RequestException):
+    """ Raised in offline mode if a url is not in the cache."""
+
+
+class CachedResponse:
+    """ Response served from the cache, with the subset of the requests.Response interface used in this package.
+
+    The body is read lazily from the cache file, so large bodies are never held in memory unless .content or .text
+    is accessed. not_modified tells whether the server confirmed the cached body with 304 Not Modified, so callers
+    that keep a copy of the body can skip writing it again.
+    """
+
+    def __init__(self, url: str, body_path: str, headers: dict, from_cache: bool, not_modified: bool = False):
+        self.url = url
+        self.status_code = 200
+        self.headers = CaseInsensitiveDict({key: value for key, value in headers.items() if value is not None})
+        self.from_cache = from_cache
+        self.not_modified = not_modified
+        # keep the file open, so eviction by another thread cannot remove the body while it is read
+        self._file = open(body_path, 'rb')
+
+    def iter_content(self, chunk_size: int = CACHE_CHUNK_SIZE):
+        """ Iterate over the body in chunks of chunk_size bytes."""
+        self._file.seek(0)
+        while chunk := self._file.read(chunk_size):
+            yield chunk
+
+    @property
+    def content(self) -> bytes:
+        self._file.seek(0)
+        return self._file.read()
+
+    @property
+    def text(self) -> str:
+        encoding = get_encoding_from_headers(self.headers) or "utf-8"
+        return self.content.decode(encoding, errors="replace")
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class HttpCache:
+    """ Size-bounded on-disk cache of HTTP responses with revalidation and least-recently-used eviction.
+
+    Bodies are stored as files in cache_dir together with their ETag and Last-Modified validators. A cached url is
+    revalidated with a conditional request and served from disk if the server answers 304 Not Modified. Once the
+    cache exceeds max_bytes, the least recently used entries are evicted. In offline mode no requests are sent at
+    all: cached urls are served from disk and all others raise CacheMiss.
+
+    Args:
+        cache_dir: folder of the cache, created if it does not exist
+        max_bytes: upper bound of the total size of the cached bodies
+        offline: whether to serve from the cache only
+    """
+
+    def __init__(self,
+                 cache_dir: str,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 offline: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(cache_dir, CACHE_INDEX_FILE_NAME), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    last_access REAL NOT NULL
+                )""")
+
+    def _body_path(self, file_name: str) -> str:
+        return os.path.join(self.cache_dir, file_name)
+
+    def _lookup(self, url: str) -> dict | None:
+        """ Return the index entry of url, or None if it is not cached."""
+        with self._lock:
+            row = self._connection.execute("SELECT file_name, content_type, etag, last_modified FROM responses "
+                                           "WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self._body_path(row[0])):
+            return None
+        return dict(zip(["file_name"] + _CACHED_HEADERS, row))
+
+    def _touch(self, url: str):
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url))
+
+    def _serve(self, url: str, entry: dict, not_modified: bool = False) -> CachedResponse:
+        self._touch(url)
+        headers = {key: entry[key] for key in _CACHED_HEADERS}
+        return CachedResponse(url, self._body_path(entry["file_name"]), headers, from_cache=True,
+                              not_modified=not_modified)
+
+    def _store(self, url: str, response: requests.Response) -> CachedResponse:
+        """ Stream the body of response into the cache and evict old entries if the cache is too large."""
+        file_name = hashlib.sha256(url.encode()).hexdigest()
+        tmp_path = self._body_path(f"{file_name}.{uuid.uuid4().hex}.part")
+        size = 0
+        try:
+            with open(tmp_path, 'xb') as body_file:
+                for chunk in response.iter_content(chunk_size=CACHE_CHUNK_SIZE):
+                    body_file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, self._body_path(file_name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        headers = {key: response.headers.get(key) for key in _CACHED_HEADERS}
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (url, file_name, size, headers["Content-Type"], headers["ETag"],
+                                      headers["Last-Modified"], time.time()))
+        served_response = CachedResponse(url, self._body_path(file_name), headers, from_cache=False)
+        self._evict(keep_url=url)
+
+        return served_response
+
+    def _evict(self, keep_url: str):
+        """ Remove the least recently used entries until the cache fits into max_bytes."""
+        with self._lock, self._connection:
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size <= self.max_bytes:
+                return
+            entries = self._connection.execute("SELECT url, file_name, size FROM responses WHERE url != ? "
+                                               "ORDER BY last_access", (keep_url,)).fetchall()
+            for url, file_name, size in entries:
+                if total_size <= self.max_bytes:
+                    break
+                self._connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+                if os.path.exists(self._body_path(file_name)):
+                    os.remove(self._body_path(file_name))
+                total_size -= size
+
+    def size(self) -> int:
+        """ Return the total size of the cached bodies in bytes."""
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self,
+            url: str,
+            session: requests.Session = None,
+            timeout: float | tuple = None) -> CachedResponse:
+        """ Get url through the cache.
+
+        Args:
+            url: url to get
+            session: session to send the request with; if None, a new connection is opened
+            timeout: timeout of the request in seconds, or a (connect, read) tuple
+
+        Returns:
+            CachedResponse: response with status 200, served from disk. Its not_modified is True if the server
+                answered the revalidation with 304.
+
+        Raises:
+            CacheMiss: in offline mode, if url is not cached
+            requests.HTTPError: if the server answers with an error status
+        """
+        entry = self._lookup(url)
+        if self.offline:
+            if entry is None:
+                raise CacheMiss(f"{url} is not cached and the cache is offline")
+            return self._serve(url, entry)
+
+        headers = {}
+        if entry is not None and entry["ETag"]:
+            headers["If-None-Match"] = entry["ETag"]
+        if entry is not None and entry["Last-Modified"]:
+            headers["If-Modified-Since"] = entry["Last-Modified"]
+
+        requester = session if session is not None else requests
+        with requester.get(url, headers=headers, allow_redirects=True, stream=True, timeout=timeout) as response:
+            if response.status_code == 304 and entry is not None:
+                return self._serve(url, entry, not_modified=True)
+            response.raise_for_status()
+            return self._store(url, response)
+
+    def close(self):
+        """ Close the index database."""
+        with self._lock:
+            self._connection.close()
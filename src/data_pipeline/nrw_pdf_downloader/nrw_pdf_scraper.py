@@ -1,25 +1,70 @@
+import hashlib
+import itertools
 import os
+import uuid
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 import requests
+from loguru import logger
 from tqdm import tqdm
 
+from data_pipeline.nrw_pdf_downloader.async_http import DEFAULT_HOST_LIMIT
+from data_pipeline.nrw_pdf_downloader.async_http import get_host
+from data_pipeline.nrw_pdf_downloader.async_http import map_per_host
+from data_pipeline.nrw_pdf_downloader.content_sniffing import TrustedHostCache
+from data_pipeline.nrw_pdf_downloader.content_sniffing import is_downloadable_content
+from data_pipeline.nrw_pdf_downloader.content_sniffing import sniff_content_type
+from data_pipeline.nrw_pdf_downloader.content_store import ContentStore
+from data_pipeline.nrw_pdf_downloader.download_manifest import DownloadManifest
+from data_pipeline.nrw_pdf_downloader.failure_journal import JOURNAL_FILE_NAME
+from data_pipeline.nrw_pdf_downloader.failure_journal import TRANSIENT_HTTP_STATUS
+from data_pipeline.nrw_pdf_downloader.failure_journal import FailureJournal
+from data_pipeline.nrw_pdf_downloader.failure_journal import RetryScheduler
+from data_pipeline.nrw_pdf_downloader.failure_journal import latest_failures
+from data_pipeline.nrw_pdf_downloader.failure_journal import read_failure_journal
+from data_pipeline.nrw_pdf_downloader.http_cache import HttpCache
+
+# size of the chunks in which downloads are streamed to disk
+CHUNK_SIZE = 1024 * 1024
+# suffix of the temporary files that are renamed to <objectid>.pdf once complete
+PARTIAL_SUFFIX = ".part"
+# timeout in seconds of the HEAD request in is_downloadable
+HEAD_TIMEOUT = 3
+# (connect, read) timeout in seconds of a PDF download, the read timeout applies to every chunk of the body
+DOWNLOAD_TIMEOUT = (10, 60)
+# format of the datum column in the BP geojson
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
 
 def parse_date(date_string):
     if isinstance(date_string, str):
         try:
-            return datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S')
+            return datetime.strptime(date_string, DATE_FORMAT)
         except ValueError:
             return np.nan
 
 
-def is_downloadable(url):
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """ Parse a column of date strings in DATE_FORMAT at once, like parse_date does for a single value.
+
+    Values that are not valid dates become NaT. Columns that are already datetimes, as read from a geojson by
+    pyogrio or geopandas, are returned timezone-naive.
+    """
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        return dates.dt.tz_localize(None)
+    if pd.api.types.is_datetime64_dtype(dates):
+        return dates
+    return pd.to_datetime(dates, format=DATE_FORMAT, errors='coerce')
+
+
+def is_downloadable(url, session=None):
     """
     Does the url contain a downloadable resource?
     """
-    h = requests.head(url, allow_redirects=True, timeout=3)
+    requester = session if session is not None else requests
+    h = requester.head(url, allow_redirects=True, timeout=HEAD_TIMEOUT)
     header = h.headers
     content_type = header.get('content-type')
     if 'text' in content_type.lower() or 'html' in content_type.lower():
@@ -33,7 +78,7 @@ def filtering_useful_data(data: pd.DataFrame):
     """
 
     # Parse date column into date format
-    data["datum"] = data["datum"].apply(parse_date)
+    data["datum"] = parse_dates(data["datum"])
 
     # Define the start date for filtering
     start_date = pd.to_datetime('2011-12-31')
@@ -45,74 +90,421 @@ def filtering_useful_data(data: pd.DataFrame):
     return filtered_data
 
 
+def _write_chunks_to_file(chunks,
+                          file_path: str):
+    """ Write the chunks of a response body to a new file and hash them on the way.
+
+    Returns:
+        size (int): number of bytes written
+        sha256 (str): hex digest of the SHA-256 hash of the written file
+    """
+    file_hash = hashlib.sha256()
+    size = 0
+    with open(file_path, 'xb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+            file_hash.update(chunk)
+            size += len(chunk)
+
+    return size, file_hash.hexdigest()
+
+
+def _write_chunks_atomically(chunks,
+                             file_path: str,
+                             content_store: ContentStore = None):
+    """ Stream the chunks of a response body to file_path.
+
+    The body is written to a temporary file in the same folder, which is renamed to file_path only once the
+    download is complete. Memory use is bounded by the chunk size and file_path never holds a truncated file.
+    If a content_store is given, the file is moved into the store instead and file_path is ignored.
+
+    Returns:
+        size (int): number of bytes written
+        sha256 (str): hex digest of the SHA-256 hash of the written file
+    """
+    folder = content_store.root if content_store is not None else os.path.dirname(file_path)
+    tmp_path = os.path.join(folder, f"{os.path.basename(file_path)}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+    try:
+        size, sha256 = _write_chunks_to_file(chunks, tmp_path)
+        if content_store is not None:
+            content_store.add(tmp_path, sha256)
+        else:
+            os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return size, sha256
+
+
+def _remove_partial_downloads(folder: str):
+    """ Remove temporary files left behind by an interrupted run."""
+    for file in os.listdir(folder):
+        if file.endswith(PARTIAL_SUFFIX):
+            os.remove(os.path.join(folder, file))
+
+
+def _conditional_headers(entry: dict) -> dict:
+    """ Build the headers of a conditional request from the validators of a manifest entry."""
+    headers = {}
+    if entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def _sniff_chunks(chunks,
+                  response: requests.Response,
+                  host: str,
+                  trusted_hosts: TrustedHostCache = None):
+    """ Decide from the headers and the first chunk of a streamed response whether it is downloadable.
+
+    Returns:
+        chunks: iterator over all chunks, including the first one that was already read
+        downloadable (bool): whether the response should be saved
+    """
+    if trusted_hosts is not None and trusted_hosts.is_trusted(host):
+        return chunks, True
+
+    first_chunk = next(chunks, b"")
+    if trusted_hosts is not None:
+        trusted_hosts.record(host, sniff_content_type(first_chunk))
+    downloadable = is_downloadable_content(response.headers.get('content-type'), first_chunk)
+
+    return itertools.chain([first_chunk], chunks), downloadable
+
+
+def _failure(object_id: str,
+             link: str,
+             reason: str,
+             http_status: int = None,
+             transient: bool = False) -> dict:
+    """ Build the result dict of a failed download."""
+    return {"objectid": object_id, "scanurl": link, "status": "failed", "reason": reason,
+            "http_status": http_status, "transient": transient}
+
+
+def _success(object_id: str,
+             link: str,
+             status: str,
+             http_status: int = None) -> dict:
+    """ Build the result dict of a successful (or skipped) download."""
+    return {"objectid": object_id, "scanurl": link, "status": status, "reason": None,
+            "http_status": http_status, "transient": False}
+
+
+def _download_pdf(link: str,
+                  object_id: str,
+                  output_folder: str,
+                  session: requests.Session = None,
+                  manifest: DownloadManifest = None,
+                  revalidate: bool = False,
+                  sniff: bool = False,
+                  trusted_hosts: TrustedHostCache = None,
+                  content_store: ContentStore = None,
+                  journal: FailureJournal = None,
+                  retry_scheduler: RetryScheduler = None,
+                  http_cache: HttpCache = None) -> dict:
+    """ Download one PDF, see download_pdfs, and return the outcome as dict.
+
+    Returns:
+        dict: with the keys objectid, scanurl, status ('downloaded', 'unchanged', 'skipped' or 'failed'), reason,
+            http_status and transient (whether a failure is worth retrying)
+    """
+    requester = session if session is not None else requests
+    host = get_host(link)
+
+    # Define the pdf path
+    pdf_name = object_id + (".pdf")
+    pdf_path = os.path.join(output_folder, pdf_name)
+
+    # Check if the PDF was already downloaded completely from this link
+    entry = manifest.get(object_id) if manifest is not None else None
+    completed = (entry is not None and entry["status"] == "downloaded" and entry["url"] == link
+                 and (content_store.contains(entry["sha256"]) if content_store is not None
+                      else os.path.exists(pdf_path)))
+    headers = _conditional_headers(entry) if completed else {}
+    if completed and not (revalidate and headers):
+        return _success(object_id, link, status="skipped")
+
+    if retry_scheduler is not None:
+        retry_scheduler.wait(host)
+
+    # an offline cache cannot answer HEAD requests, so the cached responses are sniffed instead
+    sniff = sniff or (http_cache is not None and http_cache.offline)
+
+    try:
+        # Check if the link contains downloadable content, known files were checked before and sniffed responses
+        # are checked once the body starts streaming
+        downloadable = completed or sniff or is_downloadable(link, session=session)
+        if not downloadable:
+            result = _failure(object_id, link, reason="not_downloadable")
+        else:
+            # Connect to link, the body is only read while writing it to disk. The cache revalidates on its own.
+            if http_cache is not None:
+                response = http_cache.get(link, session=session, timeout=DOWNLOAD_TIMEOUT)
+            else:
+                response = requester.get(link, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+            with response:
+
+                if completed and (response.status_code == 304 or getattr(response, "not_modified", False)):
+                    # Unchanged on the server, keep the file. The cache confirms its copy with 304 as well.
+                    manifest.touch(object_id)
+                    result = _success(object_id, link, status="unchanged", http_status=304)
+
+                elif response.status_code == 200:
+                    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                    if sniff:
+                        chunks, downloadable = _sniff_chunks(chunks, response, host, trusted_hosts)
+
+                    if downloadable:
+                        # Stream the PDF content to a file
+                        size, sha256 = _write_chunks_atomically(chunks, pdf_path, content_store=content_store)
+                        # print(f"Downloaded: {pdf_name}")
+                        if manifest is not None:
+                            manifest.record(object_id, link, status="downloaded", size=size, sha256=sha256,
+                                            etag=response.headers.get("ETag"),
+                                            last_modified=response.headers.get("Last-Modified"))
+                        result = _success(object_id, link, status="downloaded", http_status=200)
+                    else:
+                        result = _failure(object_id, link, reason="not_downloadable", http_status=200)
+
+                else:
+                    result = _failure(object_id, link, reason="http_error", http_status=response.status_code,
+                                      transient=response.status_code in TRANSIENT_HTTP_STATUS)
+
+    except requests.HTTPError as e:
+        http_status = e.response.status_code if e.response is not None else None
+        result = _failure(object_id, link, reason="http_error", http_status=http_status,
+                          transient=http_status in TRANSIENT_HTTP_STATUS)
+    except requests.Timeout:
+        result = _failure(object_id, link, reason="timeout", transient=True)
+    except requests.ConnectionError:
+        result = _failure(object_id, link, reason="connection_error", transient=True)
+    except Exception as e:
+        result = _failure(object_id, link, reason=type(e).__name__)
+
+    if result["status"] == "failed":
+        if manifest is not None and not completed:
+            manifest.record(object_id, link, status="error")
+        if journal is not None:
+            journal.record(object_id, link, host=host, reason=result["reason"], http_status=result["http_status"],
+                           transient=result["transient"])
+        if retry_scheduler is not None and result["transient"]:
+            retry_scheduler.record_failure(host)
+
+    return result
+
+
 def download_pdfs(link: str,
                   object_id: str,
-                  output_folder: str):
+                  output_folder: str,
+                  **download_kwargs):
     """ This function takes as input a link and downloads the PDFs to the output folder.
 
+    The PDF is streamed to a temporary file in chunks and atomically renamed to <object_id>.pdf once complete.
     It also returns the links and ids that failed to download.
 
+    If a manifest is given, PDFs that were completely downloaded from the same link before are not fetched again.
+    With revalidate=True they are instead revalidated with a conditional request (If-None-Match/If-Modified-Since)
+    and only downloaded again if they changed on the server. Entries without ETag and Last-Modified cannot be
+    revalidated and are skipped.
+
+    By default a HEAD request checks whether the link is downloadable before the GET request. With sniff=True,
+    only the GET request is sent and the decision is taken from its Content-Type header and the first bytes of the
+    body (PDF or PNG signature vs. HTML). Hosts in trusted_hosts skip the check entirely.
+
+    If a content_store is given, the PDF is saved as <sha256>.pdf in the store instead of <object_id>.pdf, so
+    duplicates linked under several objectids are stored once. The hash is recorded in the manifest.
+
+    Failures are appended to the journal, if given, with their reason, HTTP status and attempt number. A
+    retry_scheduler delays requests to hosts that failed with transient errors in the previous pass.
+
     Args:
         link (str): Link to the PDF
         object_id (str): ID of the BP
         output_folder (str): Path to the folder where the PDFs will be saved
+        **download_kwargs: Optional keyword arguments:
+            session (requests.Session): Session to reuse pooled connections. If None, a new connection is opened.
+            manifest (DownloadManifest): Manifest of the output folder; if None, every PDF is downloaded
+            revalidate (bool): Whether to revalidate completed PDFs with a conditional request
+            sniff (bool): Whether to decide downloadability from the GET response instead of a HEAD request
+            trusted_hosts (TrustedHostCache): Only used if sniff. Cache of the hosts that always serve PDFs
+            content_store (ContentStore): Store to deduplicate PDFs by content hash; requires a manifest
+            journal (FailureJournal): Journal to record failed downloads in
+            retry_scheduler (RetryScheduler): Backoff per host before retrying transient failures
+            http_cache (HttpCache): Cache to get the PDFs through, e.g. to run offline from cached responses
 
     Returns:
         error_links (list): List of links that failed to download
         error_ids (list): List of ids that failed to download
     """
-    error_links = []
-    error_ids = []
-    try:
-        # Check if the link contains downloadable content
-        if is_downloadable(link):
-            # Connect to link
-            response = requests.get(link)
-
-            if response.status_code == 200:
-                # Define the pdf path
-                pdf_name = object_id + (".pdf")
-                pdf_path = os.path.join(output_folder, pdf_name)
-
-                # Save the PDF content to a file
-                with open(pdf_path, 'wb') as pdf_file:
-                    pdf_file.write(response.content)
-                # print(f"Downloaded: {pdf_name}")
-        else:
-            # print(f"Failed to download: {link}")
+    result = _download_pdf(link=link, object_id=object_id, output_folder=output_folder, **download_kwargs)
 
-            # If we get an error, append id and link to lists
-            error_links.append(link)
-            error_ids.append(object_id)
+    if result["status"] == "failed":
+        return [link], [object_id]
+    return [], []
 
-    except:
-        # If we get an error, append id and link to lists
-        error_links.append(link)
-        error_ids.append(object_id)
 
-    return error_links, error_ids
+def _download_pdf_with_session(session: requests.Session,
+                               link: str,
+                               object_id: str,
+                               download_kwargs: dict):
+    """ Adapter for map_per_host, which passes the pooled session of the host first."""
+    return _download_pdf(link=link, object_id=object_id, session=session, **download_kwargs)
+
+
+def run_concurrent_downloads(input_df: pd.DataFrame,
+                             output_folder: str,
+                             host_limits: dict = None,
+                             default_host_limit: int = DEFAULT_HOST_LIMIT,
+                             **download_kwargs) -> list:
+    """ Downloads all PDFs of input_df concurrently with pooled keep-alive connections.
+
+    The downloads are scheduled on an asyncio event loop. Every host gets its own connection pool and at most
+    host_limits[host] downloads run at the same time per host.
+
+    Args:
+        input_df (pd.DataFrame): DataFrame that contains the links to the PDFs, with the columns
+            "scanurl" and "objectid"
+        output_folder (str): Path to the folder where the PDFs will be saved
+        host_limits (dict): Maximum number of concurrent downloads per host, e.g. {"www.o-sp.de": 8}
+        default_host_limit (int): Maximum number of concurrent downloads for hosts not in host_limits
+        **download_kwargs: Further keyword arguments passed to download_pdfs, e.g. manifest or sniff
+
+    Returns:
+        list: one dict per row of input_df with the keys objectid, scanurl, status, reason, http_status and
+            transient
+    """
+    download_kwargs = {"output_folder": output_folder, **download_kwargs}
+    jobs = [(row["scanurl"], (row["scanurl"], str(row["objectid"]), download_kwargs))
+            for _, row in input_df.iterrows()]
+
+    return map_per_host(_download_pdf_with_session,
+                        jobs,
+                        host_limits=host_limits,
+                        default_limit=default_host_limit)
+
+
+def _run_download_pass(input_df: pd.DataFrame,
+                       output_folder: str,
+                       concurrent: bool,
+                       host_limits: dict,
+                       default_host_limit: int,
+                       download_kwargs: dict) -> list:
+    """ Download all rows of input_df once, one after another or concurrently, and return the result dicts."""
+    if concurrent:
+        return run_concurrent_downloads(input_df,
+                                        output_folder=output_folder,
+                                        host_limits=host_limits,
+                                        default_host_limit=default_host_limit,
+                                        **download_kwargs)
+
+    # Iterate over rows of the dataframe
+    results = []
+    for index, row in tqdm(input_df.iterrows(), total=len(input_df)):
+        results.append(_download_pdf(link=row["scanurl"],  # Get the link from the df
+                                     object_id=str(row["objectid"]),  # Get the ID of the BP
+                                     output_folder=output_folder,
+                                     **download_kwargs))
+    return results
+
+
+def _download_with_retries(input_df: pd.DataFrame,
+                           output_folder: str,
+                           concurrent: bool,
+                           host_limits: dict,
+                           default_host_limit: int,
+                           max_retries: int,
+                           download_kwargs: dict) -> list:
+    """ Download all rows of input_df and retry transient failures in up to max_retries later passes.
+
+    Returns:
+        list: the final result dict per row of input_df
+    """
+    results = _run_download_pass(input_df, output_folder, concurrent, host_limits, default_host_limit,
+                                 download_kwargs)
+    results_by_id = {result["objectid"]: result for result in results}
+
+    for retry_pass in range(1, max_retries + 1):
+        transient_ids = [result["objectid"] for result in results if result["transient"]]
+        if not transient_ids:
+            break
+
+        logger.info(f"Retry pass {retry_pass}: retrying {len(transient_ids)} transient failures")
+        if download_kwargs.get("retry_scheduler") is not None:
+            download_kwargs["retry_scheduler"].next_pass()
+        retry_df = input_df[input_df["objectid"].astype(str).isin(transient_ids)]
+        results = _run_download_pass(retry_df, output_folder, concurrent, host_limits, default_host_limit,
+                                     download_kwargs)
+        results_by_id.update({result["objectid"]: result for result in results})
+
+    return list(results_by_id.values())
 
 
 def run_pdf_downloader(input_df: pd.DataFrame,
                        output_folder="../../data/NRW/pdfs",
-                       sample_n: int = None):
+                       sample_n: int = None,
+                       concurrent: bool = False,
+                       host_limits: dict = None,
+                       default_host_limit: int = DEFAULT_HOST_LIMIT,
+                       resume: bool = True,
+                       revalidate: bool = False,
+                       sniff: bool = False,
+                       deduplicate: bool = False,
+                       max_retries: int = 2,
+                       retry_base_delay: float = 1.0,
+                       filter_data: bool = True,
+                       http_cache: HttpCache = None):
     """
     This function takes as input a dataframe with the links to the PDFs and downloads them to the output folder.
 
+    With resume=True, every download is recorded in a SQLite manifest in the output folder (url, size, hash, ETag,
+    Last-Modified and status). Reruns skip the PDFs that were already downloaded completely, or, with
+    revalidate=True, revalidate them with conditional requests and only download the ones that changed.
+
+    By default the PDFs are downloaded one after another. With concurrent=True, the downloads run concurrently on
+    an asyncio event loop with pooled keep-alive connections and a concurrency limit per host
+    (see run_concurrent_downloads).
+
+    Every failed attempt is appended to failure_journal.csv in the output folder (reason, HTTP status, attempt).
+    Transient failures (timeouts, connection errors, HTTP 429 and 5xx) are retried in up to max_retries later
+    passes, with an exponential backoff per host. The links that still failed are written to error_links.csv.
+    Failures of earlier runs can be retried with retry_failed_downloads.
 
     Args:
         input_df (pd.DataFrame): DataFrame that contains the links to the PDFs, with the columns
             "scanurl" and "objectid"
         output_folder (str): Path to the folder where the PDFs will be saved
         sample_n (int): Number of rows to sample from the input_df. If None, all rows are used.
+        concurrent (bool): Whether to download the PDFs concurrently
+        host_limits (dict): Only used if concurrent. Maximum number of concurrent downloads per host,
+            overrides the defaults for www.o-sp.de and gisdata.krzn.de
+        default_host_limit (int): Only used if concurrent. Maximum number of concurrent downloads for all
+            other hosts
+        resume (bool): Whether to keep a download manifest and skip completed PDFs
+        revalidate (bool): Only used if resume. Whether to revalidate completed PDFs with a conditional request
+        sniff (bool): Whether to skip the HEAD request and decide downloadability from the GET response, see
+            download_pdfs. Hosts that served only PDFs so far are not checked at all.
+        deduplicate (bool): Only used if resume. Whether to save the PDFs once per content hash as <sha256>.pdf in
+            the content_store subfolder instead of <objectid>.pdf. The objectid -> hash mapping is available via
+            DownloadManifest.hash_mapping() and results per unique document can be mapped back to the objectids
+            with content_store.expand_to_objectids.
+        max_retries (int): Number of later passes retrying transient failures
+        retry_base_delay (float): Backoff in seconds after the first transient failure on a host, doubled with
+            every further failure on the same host
+        filter_data (bool): Whether to keep only the BP from 2012 to 2022, see filtering_useful_data
+        http_cache (HttpCache): Cache to get the PDFs through. With an offline cache, the downloader runs from
+            the cached responses only. The cache keeps a second copy of every PDF besides the output folder, so its
+            max_bytes has to hold the whole crawl, or the PDFs evict each other and are downloaded again; for
+            plain reruns, resume and revalidate are enough.
 
     """
-
-    # Make empty lists that append links that didn't scrape
-    error_links = []
-    error_ids = []
-
-    input_df = filtering_useful_data(input_df)
+    if filter_data:
+        input_df = filtering_useful_data(input_df)
 
     if sample_n:
         input_df = input_df.sample(n=sample_n, random_state=912)
@@ -120,14 +512,71 @@ def run_pdf_downloader(input_df: pd.DataFrame,
     # Check if the output folder exists, if not creates it
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
+    _remove_partial_downloads(output_folder)
+
+    manifest = DownloadManifest.for_folder(output_folder) if resume else None
+    content_store = None
+    if resume and deduplicate:
+        content_store = ContentStore.for_folder(output_folder)
+        _remove_partial_downloads(content_store.root)
+
+    download_kwargs = {"manifest": manifest,
+                       "revalidate": revalidate,
+                       "sniff": sniff,
+                       "trusted_hosts": TrustedHostCache() if sniff else None,
+                       "content_store": content_store,
+                       "journal": FailureJournal.for_folder(output_folder),
+                       "retry_scheduler": RetryScheduler(base_delay=retry_base_delay),
+                       "http_cache": http_cache}
+
+    results = _download_with_retries(input_df,
+                                     output_folder=output_folder,
+                                     concurrent=concurrent,
+                                     host_limits=host_limits,
+                                     default_host_limit=default_host_limit,
+                                     max_retries=max_retries,
+                                     download_kwargs=download_kwargs)
+
+    if manifest is not None:
+        manifest.close()
+
+    # Make lists of the links that didn't scrape
+    failed_results = [result for result in results if result["status"] == "failed"]
+    errors_df = pd.DataFrame.from_dict({'objectid': [result["objectid"] for result in failed_results],
+                                        'scanurl': [result["scanurl"] for result in failed_results]})
 
-    # Iterate over rows of the dataframe
-    for index, row in tqdm(input_df.iterrows(), total=len(input_df)):
-        error_links, error_ids = download_pdfs(link=row["scanurl"],  # Get the link from the df
-                                               object_id=str(row["objectid"]),  # Get the ID of the BP
-                                               output_folder=output_folder)
+    errors_df.to_csv(output_folder + "/error_links.csv", index=False)
 
-    errors_df = pd.DataFrame.from_dict({'objectid': error_ids,
-                                        'scanurl': error_links})
 
-    errors_df.to_csv(output_folder + "/error_links.csv", index=False)
+def retry_failed_downloads(output_folder: str,
+                           max_attempts: int = 5,
+                           **downloader_kwargs):
+    """ Retry the transient failures recorded in the failure journal of output_folder.
+
+    Only links whose last recorded failure is transient, that were not downloaded since and that failed fewer than
+    max_attempts times are retried, so a few hundred flaky links can be recovered without crawling everything again.
+
+    Args:
+        output_folder (str): Path to the folder with the PDFs and the failure journal
+        max_attempts (int): Links that failed this often are not retried anymore
+        **downloader_kwargs: Further keyword arguments passed to run_pdf_downloader, e.g. concurrent
+    """
+    journal_path = os.path.join(output_folder, JOURNAL_FILE_NAME)
+    if not os.path.exists(journal_path):
+        logger.info("No failure journal found, nothing to retry.")
+        return
+
+    failures_df = latest_failures(read_failure_journal(journal_path))
+    failures_df = failures_df[failures_df["transient"] & (failures_df["attempt"] < max_attempts)]
+
+    # drop links that were downloaded since, e.g. by a later full run
+    manifest = DownloadManifest.for_folder(output_folder)
+    downloaded_ids = set(manifest.hash_mapping()["objectid"])
+    manifest.close()
+    failures_df = failures_df[~failures_df["objectid"].isin(downloaded_ids)]
+
+    logger.info(f"Retrying {len(failures_df)} failed downloads")
+    run_pdf_downloader(failures_df[["objectid", "scanurl"]],
+                       output_folder=output_folder,
+                       filter_data=False,
+                       **downloader_kwargs)
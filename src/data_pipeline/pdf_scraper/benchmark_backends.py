@@ -0,0 +1,89 @@
+import argparse
+import os
+import random
+import re
+import time
+
+import pandas as pd
+from loguru import logger
+from rapidfuzz import fuzz
+
+from data_pipeline.pdf_scraper.extraction_backends import get_backend
+
+
+def _normalize_whitespace(text: str | None) -> str:
+    return re.sub(r'\s+', ' ', text or "").strip()
+
+
+def benchmark_backends(folder_path: str,
+                       backend_names: list = ("pypdf", "tika"),
+                       sample_size: int = None,
+                       reference: str = "tika") -> pd.DataFrame:
+    """ Compare the extraction backends on the pdfs of a folder in terms of speed and text agreement.
+
+    Every pdf is parsed by every backend. The agreement is the rapidfuzz ratio (0-100) of the whitespace-normalized
+    text of a backend and the text of the reference backend.
+
+    Args:
+        folder_path: folder with the pdfs, e.g. the BPlan pdf folder
+        backend_names: names of the backends to compare, see extraction_backends.get_backend
+        sample_size: number of randomly sampled pdfs; if None, all pdfs are used
+        reference: name of the backend whose text the others are compared to, must be in backend_names
+
+    Returns:
+        pd.DataFrame: one row per pdf and backend with the columns filename, backend, seconds, n_chars, error
+            and agreement
+    """
+    pdf_files = sorted(file for file in os.listdir(folder_path) if file.lower().endswith('.pdf'))
+    if sample_size is not None:
+        pdf_files = random.sample(pdf_files, min(sample_size, len(pdf_files)))
+
+    results = []
+    for backend_name in backend_names:
+        backend = get_backend(backend_name)
+        for pdf_file in pdf_files:
+            start = time.perf_counter()
+            try:
+                content, error = backend.extract(os.path.join(folder_path, pdf_file))["content"], None
+            except Exception as e:
+                content, error = None, type(e).__name__
+            results.append({"filename": pdf_file,
+                            "backend": backend_name,
+                            "seconds": time.perf_counter() - start,
+                            "content": _normalize_whitespace(content),
+                            "error": error})
+
+    results_df = pd.DataFrame(results)
+    results_df["n_chars"] = results_df["content"].str.len()
+
+    reference_texts = results_df[results_df["backend"] == reference].set_index("filename")["content"]
+    results_df["agreement"] = [fuzz.ratio(content, reference_texts[filename])
+                               for filename, content in zip(results_df["filename"], results_df["content"])]
+
+    return results_df.drop(columns="content")
+
+
+def summarize_benchmark(results_df: pd.DataFrame) -> pd.DataFrame:
+    """ Aggregate the benchmark results per backend: pdfs per second, failures and median text agreement."""
+    summary_df = results_df.groupby("backend").agg(n_files=("filename", "count"),
+                                                   total_seconds=("seconds", "sum"),
+                                                   n_errors=("error", "count"),
+                                                   median_agreement=("agreement", "median"))
+    summary_df["files_per_second"] = summary_df["n_files"] / summary_df["total_seconds"]
+
+    return summary_df
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Benchmark the pdf text extraction backends.")
+    argument_parser.add_argument("folder_path", help="folder with the pdfs to benchmark on")
+    argument_parser.add_argument("--backends", nargs="+", default=["pypdf", "tika"])
+    argument_parser.add_argument("--sample-size", type=int, default=None)
+    argument_parser.add_argument("--output-path", default=None, help="csv to write the per-file results to")
+    args = argument_parser.parse_args()
+
+    benchmark_df = benchmark_backends(args.folder_path, backend_names=args.backends, sample_size=args.sample_size,
+                                      reference=args.backends[-1])
+    if args.output_path is not None:
+        benchmark_df.to_csv(args.output_path, index=False)
+    logger.info(f"Benchmark results:\n{summarize_benchmark(benchmark_df)}")
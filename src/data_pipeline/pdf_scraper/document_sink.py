@@ -0,0 +1,149 @@
+import glob
+import json
+import os
+import uuid
+
+import pandas as pd
+
+# number of documents buffered before they are written as one row group of a parquet sink
+DEFAULT_ROW_GROUP_SIZE = 500
+
+DOCUMENT_COLUMNS = ["filename", "content", "page_offsets", "metadata"]
+
+
+class JsonlSink:
+    """ Append-only JSON Lines file with one parsed document per line.
+
+    Every document is written and flushed as soon as it is parsed, so a crash loses at most the line that was being
+    written. A truncated last line left by a crash is removed when the sink is opened again.
+
+    Args:
+        path: path to the .jsonl file, created if it does not exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        _remove_truncated_last_line(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def written_filenames(self) -> set:
+        """ Return the filenames of the documents in the sink."""
+        with open(self.path, encoding='utf-8') as jsonl_file:
+            return {json.loads(line)["filename"] for line in jsonl_file if line.strip()}
+
+    def write(self, document: dict):
+        """ Append a document with filename, content, page_offsets and metadata."""
+        self._file.write(json.dumps(document, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParquetSink:
+    """ Folder of parquet files, each holding one row group of parsed documents.
+
+    Documents are buffered and written as a new part file once row_group_size documents are collected, so memory
+    stays bounded by one row group. Part files are written under a temporary name and renamed when complete, so a
+    crash loses at most the buffered documents. The metadata dicts are stored as JSON strings. Requires pyarrow.
+
+    Args:
+        path: folder of the part files, created if it does not exist
+        row_group_size: number of documents per part file
+    """
+
+    def __init__(self, path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self._buffer = []
+        os.makedirs(path, exist_ok=True)
+
+    def _part_paths(self) -> list:
+        return sorted(glob.glob(os.path.join(self.path, "part-*.parquet")))
+
+    def written_filenames(self) -> set:
+        """ Return the filenames of the documents in the sink, including the buffered ones."""
+        filenames = {document["filename"] for document in self._buffer}
+        for part_path in self._part_paths():
+            filenames.update(pd.read_parquet(part_path, columns=["filename"])["filename"])
+        return filenames
+
+    def write(self, document: dict):
+        """ Buffer a document with filename, content, page_offsets and metadata and flush the buffer once it is full."""
+        self._buffer.append(document)
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered documents as a new part file."""
+        if not self._buffer:
+            return
+        part_df = pd.DataFrame(self._buffer, columns=DOCUMENT_COLUMNS)
+        part_df["metadata"] = part_df["metadata"].map(json.dumps)
+
+        part_name = f"part-{len(self._part_paths()):05d}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(self.path, f".{part_name}.part")
+        part_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(self.path, part_name))
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _remove_truncated_last_line(path: str, block_size: int = 64 * 1024):
+    """ Cut a JSON Lines file after its last complete line, reading it backwards from the end."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as jsonl_file:
+        end = jsonl_file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            block_start = max(0, position - block_size)
+            jsonl_file.seek(block_start)
+            block = jsonl_file.read(position - block_start)
+            if position == end and block.endswith(b"\n"):
+                return
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                jsonl_file.truncate(block_start + newline + 1)
+                return
+            position = block_start
+        jsonl_file.truncate(0)
+
+
+def open_document_sink(output_path: str,
+                       row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+    """ Open the sink for output_path, a .jsonl file or a .parquet folder."""
+    if output_path.endswith(".jsonl"):
+        return JsonlSink(output_path)
+    elif output_path.endswith(".parquet"):
+        return ParquetSink(output_path, row_group_size=row_group_size)
+    else:
+        raise ValueError("Output format not supported. Please use .jsonl or .parquet.")
+
+
+def read_documents(output_path: str) -> pd.DataFrame:
+    """ Read the documents written to a .jsonl file or .parquet folder as df with the DOCUMENT_COLUMNS."""
+    if output_path.endswith(".jsonl"):
+        with open(output_path, encoding='utf-8') as jsonl_file:
+            documents = [json.loads(line) for line in jsonl_file if line.strip()]
+        return pd.DataFrame(documents, columns=DOCUMENT_COLUMNS)
+    elif output_path.endswith(".parquet"):
+        documents_df = pd.read_parquet(output_path)
+        documents_df["metadata"] = documents_df["metadata"].map(json.loads)
+        return documents_df[DOCUMENT_COLUMNS]
+    else:
+        raise ValueError("Output format not supported. Please use .jsonl or .parquet.")
@@ -0,0 +1,245 @@
+from functools import partial
+
+import pypdf
+from pypdf.errors import PyPdfError
+from tika import parser
+from tika import tika
+
+from data_pipeline.pdf_scraper.page_index import join_pages
+from data_pipeline.pdf_scraper.page_index import xhtml_to_pages
+from data_pipeline.pdf_scraper.pdf_triage import FAST
+from data_pipeline.pdf_scraper.pdf_triage import REJECT
+from data_pipeline.pdf_scraper.pdf_triage import triage_file
+
+# timeout in seconds of a single Tika request
+TIKA_TIMEOUT = 200
+# timeout in seconds of the request for the version of a Tika server
+VERSION_TIMEOUT = 30
+# output format of the Tika backends that split the text into pages, part of their version, so their texts are
+# cached apart from Tika's plain text
+TIKA_OUTPUT_FORMAT = "xhtml-pages"
+# pdfs with fewer extracted characters per page are most likely scans and are left to the fallback backend
+MIN_CHARS_PER_PAGE = 50
+
+
+class UnsupportedDocument(Exception):
+    """ Raised by a backend that cannot extract the text of a document."""
+
+
+class RejectedDocument(Exception):
+    """ Raised for files that the triage rejected, e.g. HTML error pages or truncated pdfs."""
+
+
+def tika_server_version(server_endpoint: str = None) -> str:
+    """ Return the version of the Tika server at server_endpoint, e.g. '2.6.0'.
+
+    If server_endpoint is None, the default server of the tika package is asked and started if necessary.
+    """
+    status, version = tika.callServer('get', server_endpoint or tika.ServerEndpoint, '/version', None,
+                                      {'Accept': 'text/plain'}, requestOptions={'timeout': VERSION_TIMEOUT})
+    if status != 200:
+        raise RuntimeError(f"Tika server {server_endpoint or tika.ServerEndpoint} did not answer the version request, "
+                           f"status {status}")
+    # the server answers e.g. 'Apache Tika 2.6.0'
+    return version.strip().split()[-1]
+
+
+def tika_backend_version(server_version: str, pages: bool) -> str:
+    """ Return the version of a Tika backend, e.g. 'tika-2.6.0' or 'tika-2.6.0-xhtml-pages' if it splits pages."""
+    return f"tika-{server_version}-{TIKA_OUTPUT_FORMAT}" if pages else f"tika-{server_version}"
+
+
+class TikaBackend:
+    """ Extracts text and metadata by sending the file to a Tika server.
+
+    Handles every format Tika knows, including scanned pdfs and pngs if the server has OCR enabled. By default the
+    content is Tika's plain text and the page offsets are None, as the plain text does not mark the pages. With
+    pages, the text is requested as XHTML instead and rebuilt from its page elements, joined by
+    page_index.PAGE_SEPARATOR. That text has the same words as the plain text but differs in its whitespace.
+
+    The version, which is part of the extraction cache key, is that of the server doing the parsing rather than of
+    the tika package. It is requested from server_endpoint once, when it is first needed.
+
+    Args:
+        timeout: timeout in seconds of a single request
+        server_endpoint: url of the Tika server the files are sent to if extract is called without one. If None,
+            the default server of the tika package is used and started if necessary.
+        pages: whether to split the text into pages, see above
+    """
+
+    def __init__(self,
+                 timeout: float = TIKA_TIMEOUT,
+                 server_endpoint: str = None,
+                 pages: bool = False):
+        self.timeout = timeout
+        self.server_endpoint = server_endpoint
+        self.pages = pages
+        self.name = "tika-pages" if pages else "tika"
+        self._version = None
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = tika_backend_version(tika_server_version(self.server_endpoint), self.pages)
+        return self._version
+
+    def extract(self, pdf_path: str, server_endpoint: str = None) -> dict:
+        """ Return a dict with the content, page offsets and metadata of the file at pdf_path.
+
+        Args:
+            pdf_path: path to the file
+            server_endpoint: url of the Tika server, by default the server_endpoint of the backend
+        """
+        parsed = parser.from_file(pdf_path,
+                                  serverEndpoint=server_endpoint or self.server_endpoint or tika.ServerEndpoint,
+                                  xmlContent=self.pages,
+                                  requestOptions={'timeout': self.timeout})
+        if self.pages and parsed["content"] is not None:
+            content, page_offsets = join_pages(xhtml_to_pages(parsed["content"]))
+        else:
+            content, page_offsets = parsed["content"], None
+
+        return {
+            "content": content,
+            "page_offsets": page_offsets,
+            "metadata": parsed["metadata"]
+        }
+
+
+class PypdfBackend:
+    """ Extracts the text layer of pdfs in-process with pypdf, without a round trip to a Tika server.
+
+    Files that are not pdfs, encrypted pdfs and pdfs without a usable text layer, i.e. fewer than
+    min_chars_per_page characters per page, raise UnsupportedDocument.
+
+    Args:
+        min_chars_per_page: minimum number of extracted characters per page
+    """
+    name = "pypdf"
+
+    def __init__(self, min_chars_per_page: int = MIN_CHARS_PER_PAGE):
+        self.min_chars_per_page = min_chars_per_page
+        self.version = f"pypdf-{pypdf.__version__}"
+
+    def extract(self, pdf_path: str, server_endpoint: str = None) -> dict:
+        """ Return a dict with the content, page offsets and metadata of the pdf at pdf_path.
+
+        server_endpoint is ignored.
+        """
+        if not pdf_path.lower().endswith('.pdf'):
+            raise UnsupportedDocument(f"{pdf_path} is not a pdf")
+        try:
+            reader = pypdf.PdfReader(pdf_path)
+            if reader.is_encrypted:
+                raise UnsupportedDocument(f"{pdf_path} is encrypted")
+            pages = [page.extract_text() or "" for page in reader.pages]
+            document_info = reader.metadata or {}
+        except PyPdfError as e:
+            raise UnsupportedDocument(f"{pdf_path} could not be read by pypdf: {e}") from e
+
+        content, page_offsets = join_pages(pages)
+        if len(content.strip()) < self.min_chars_per_page * max(len(pages), 1):
+            raise UnsupportedDocument(f"{pdf_path} has no usable text layer")
+
+        # metadata with the keys Tika uses for the same information
+        metadata = {"Content-Type": "application/pdf",
+                    "xmpTPg:NPages": str(len(pages)),
+                    "X-Parsed-By": self.version}
+        for key, value in document_info.items():
+            metadata[f"pdf:docinfo:{key.lstrip('/').lower()}"] = str(value)
+
+        return {
+            "content": content,
+            "page_offsets": page_offsets,
+            "metadata": metadata
+        }
+
+
+class FallbackBackend:
+    """ Tries the backends in order and returns the result of the first that can handle the document.
+
+    Any exception of a backend, not only UnsupportedDocument, leads to the next backend. The exception of the last
+    backend is raised.
+
+    Args:
+        backends: backends to try, e.g. [PypdfBackend(), TikaBackend()]
+    """
+
+    def __init__(self, backends: list):
+        self.backends = backends
+        self.name = "+".join(backend.name for backend in backends)
+
+    @property
+    def version(self) -> str:
+        return "+".join(backend.version for backend in self.backends)
+
+    def extract(self, pdf_path: str, server_endpoint: str = None) -> dict:
+        """ Return a dict with the content, page offsets and metadata of the file from the first suitable backend."""
+        for backend in self.backends[:-1]:
+            try:
+                return backend.extract(pdf_path, server_endpoint)
+            except Exception:
+                continue
+        return self.backends[-1].extract(pdf_path, server_endpoint)
+
+
+class TriageBackend:
+    """ Routes every file by pdf_triage.triage_file to the fast or the full backend, or rejects it.
+
+    Rejected files raise RejectedDocument without being sent anywhere. Files routed to the fast backend that it
+    cannot handle after all are passed on to the full backend. Like in FallbackBackend, any exception of the fast
+    backend counts, as pypdf raises e.g. KeyError or RecursionError on malformed pdfs.
+
+    Args:
+        fast_backend: backend for pdfs with a text layer, e.g. PypdfBackend()
+        full_backend: backend for scans, images and pdfs pypdf cannot open, e.g. TikaBackend()
+    """
+    name = "triage"
+
+    def __init__(self, fast_backend, full_backend):
+        self.fast_backend = fast_backend
+        self.full_backend = full_backend
+
+    @property
+    def version(self) -> str:
+        return f"triage+{self.fast_backend.version}+{self.full_backend.version}"
+
+    def extract(self, pdf_path: str, server_endpoint: str = None) -> dict:
+        """ Return a dict with the content, page offsets and metadata of the file from the backend of its route."""
+        triage = triage_file(pdf_path)
+        if triage["route"] == REJECT:
+            raise RejectedDocument(f"{pdf_path} rejected by triage: {triage['reason']}")
+
+        if triage["route"] == FAST:
+            try:
+                return self.fast_backend.extract(pdf_path, server_endpoint)
+            except Exception:
+                pass
+        return self.full_backend.extract(pdf_path, server_endpoint)
+
+
+def get_backend(name: str,
+                tika_pool=None,
+                server_endpoint: str = None):
+    """ Return the backend for a name like 'tika', 'pypdf' or 'pypdf+tika', the latter falling back to Tika.
+
+    'tika-pages' is Tika with the text split into pages, see TikaBackend. 'triage' triages every file first and routes it to pypdf or Tika, or rejects it, see TriageBackend.
+
+    Args:
+        name: names of the backends, joined by '+' in the order they are tried, or 'triage'
+        tika_pool: started TikaServerPool to send the files to instead of the server of the tika package
+        server_endpoint: url of the Tika server, see TikaBackend; ignored if tika_pool is given
+    """
+    tika_backend = tika_pool.backend if tika_pool is not None else partial(TikaBackend, server_endpoint=server_endpoint)
+    backends = {"tika": tika_backend, "tika-pages": partial(tika_backend, pages=True), "pypdf": PypdfBackend}
+    if name == "triage":
+        return TriageBackend(PypdfBackend(), backends["tika"]())
+
+    names = name.split("+")
+    unknown = [backend_name for backend_name in names if backend_name not in backends]
+    if unknown:
+        raise ValueError(f"Unknown extraction backend {unknown}. Please use one of {list(backends)} or 'triage'.")
+
+    if len(names) == 1:
+        return backends[name]()
+    return FallbackBackend([backends[backend_name]() for backend_name in names])
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+# size of the chunks in which pdfs are read for hashing
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: str) -> str:
+    """ Return the SHA-256 hash of the content of file_path."""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ExtractionCache:
+    """ Persistent cache of extracted pdf texts, keyed by the content hash of the pdf and the extractor version.
+
+    The cache is a SQLite database with the content and metadata of every successfully parsed pdf. As the key is the
+    SHA-256 hash of the file, renamed or copied pdfs are served from the cache as well, while a modified pdf or a new
+    extractor version (e.g. an update of the Tika server) leads to a new extraction. All methods are thread-safe.
+
+    Args:
+        path: path to the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS extractions (
+                    sha256 TEXT NOT NULL,
+                    extractor TEXT NOT NULL,
+                    content TEXT,
+                    metadata TEXT NOT NULL,
+                    extracted_at TEXT NOT NULL,
+                    page_offsets TEXT,
+                    PRIMARY KEY (sha256, extractor)
+                )""")
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(extractions)")]
+            if "page_offsets" not in columns:
+                self._connection.execute("ALTER TABLE extractions ADD COLUMN page_offsets TEXT")
+
+    def get(self, sha256: str, extractor: str) -> dict | None:
+        """ Return the cached extraction as dict with content, page_offsets and metadata, or None if not cached.
+
+        page_offsets is None for entries cached before page offsets were extracted and for backends that do not
+        split pages.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT content, page_offsets, metadata FROM extractions "
+                                           "WHERE sha256 = ? AND extractor = ?", (sha256, extractor)).fetchone()
+        if row is None:
+            return None
+        return {"content": row[0],
+                "page_offsets": json.loads(row[1]) if row[1] is not None else None,
+                "metadata": json.loads(row[2])}
+
+    def put(self,
+            sha256: str,
+            extractor: str,
+            content: str | None,
+            metadata: dict,
+            page_offsets: list = None):
+        """ Insert or replace the extraction of the pdf with hash sha256."""
+        entry = (sha256, extractor, content, json.dumps(metadata), datetime.now().isoformat(),
+                 json.dumps(page_offsets) if page_offsets is not None else None)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO extractions "
+                                     "(sha256, extractor, content, metadata, extracted_at, page_offsets) "
+                                     "VALUES (?, ?, ?, ?, ?, ?)", entry)
+
+    def close(self):
+        """ Close the database connection."""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,106 @@
+import bisect
+import html
+import json
+import re
+
+# separator between the pages in the content of a document
+PAGE_SEPARATOR = "\n\n"
+# suffix of the page index stored next to a text file
+PAGE_INDEX_SUFFIX = ".pages.json"
+
+_XHTML_PAGE_START = re.compile(r'<div class="page">', re.IGNORECASE)
+_XHTML_LINE_END = re.compile(r'</p>|<br\s*/?>|</h\d>|</li>|</tr>', re.IGNORECASE)
+_XHTML_TAG = re.compile(r'<[^>]+>')
+_XHTML_BODY = re.compile(r'<body[^>]*>(.*)</body>', re.IGNORECASE | re.DOTALL)
+
+
+def join_pages(pages: list) -> tuple:
+    """ Join the texts of the pages of a document.
+
+    Returns:
+        tuple: content of the document and the page offsets, i.e. the position in the content where each page starts
+    """
+    page_offsets = []
+    position = 0
+    for page in pages:
+        page_offsets.append(position)
+        position += len(page) + len(PAGE_SEPARATOR)
+
+    return PAGE_SEPARATOR.join(pages), page_offsets
+
+
+def split_pages(content: str, page_offsets: list) -> list:
+    """ Split the content of a document into the texts of its pages."""
+    return [get_page(content, page_offsets, page_number) for page_number in range(1, len(page_offsets) + 1)]
+
+
+def get_page(content: str, page_offsets: list, page_number: int) -> str:
+    """ Return the text of page page_number (starting at 1) of a document."""
+    start = page_offsets[page_number - 1]
+    if page_number < len(page_offsets):
+        return content[start:page_offsets[page_number] - len(PAGE_SEPARATOR)]
+    return content[start:]
+
+
+def page_number_at(page_offsets: list, position: int) -> int:
+    """ Return the number of the page (starting at 1) that contains position, e.g. the index of a keyword hit."""
+    return max(bisect.bisect_right(page_offsets, position), 1)
+
+
+def xhtml_to_pages(xhtml: str) -> list:
+    """ Convert the XHTML output of Tika to the texts of the pages, split at its <div class="page"> elements.
+
+    Documents without page elements, e.g. images, are returned as a single page.
+    """
+    body_match = _XHTML_BODY.search(xhtml)
+    body = body_match.group(1) if body_match else xhtml
+
+    page_chunks = _XHTML_PAGE_START.split(body)
+    if len(page_chunks) > 1:
+        # the first chunk is everything before the first page
+        page_chunks = page_chunks[1:]
+
+    return [_xhtml_to_text(page_chunk) for page_chunk in page_chunks]
+
+
+def _xhtml_to_text(xhtml: str) -> str:
+    text = _XHTML_LINE_END.sub("\n", xhtml)
+    text = _XHTML_TAG.sub("", text)
+    return html.unescape(text).strip()
+
+
+def write_text_with_page_index(txt_path: str, content: str, page_offsets: list):
+    """ Write the content of a document to txt_path and its page index next to it.
+
+    The page index holds the byte offsets of the pages in the UTF-8 encoded file, so read_page can load single pages
+    without reading the whole text.
+    """
+    encoded_pages = [page.encode('utf-8') for page in split_pages(content, page_offsets)]
+    encoded_separator = PAGE_SEPARATOR.encode('utf-8')
+
+    byte_offsets = []
+    position = 0
+    for encoded_page in encoded_pages:
+        byte_offsets.append([position, len(encoded_page)])
+        position += len(encoded_page) + len(encoded_separator)
+
+    with open(txt_path, 'wb') as txt_file:
+        txt_file.write(encoded_separator.join(encoded_pages))
+    with open(txt_path + PAGE_INDEX_SUFFIX, 'w') as index_file:
+        json.dump(byte_offsets, index_file)
+
+
+def read_page(txt_path: str, page_number: int) -> str:
+    """ Read page page_number (starting at 1) from a text file written by write_text_with_page_index."""
+    with open(txt_path + PAGE_INDEX_SUFFIX) as index_file:
+        start, length = json.load(index_file)[page_number - 1]
+
+    with open(txt_path, 'rb') as txt_file:
+        txt_file.seek(start)
+        return txt_file.read(length).decode('utf-8')
+
+
+def count_pages(txt_path: str) -> int:
+    """ Return the number of pages of a text file written by write_text_with_page_index."""
+    with open(txt_path + PAGE_INDEX_SUFFIX) as index_file:
+        return len(json.load(index_file))
@@ -0,0 +1,111 @@
+import os
+
+import pandas as pd
+import pypdf
+
+from data_pipeline.nrw_pdf_downloader.content_sniffing import SNIFF_LENGTH
+from data_pipeline.nrw_pdf_downloader.content_sniffing import sniff_content_type
+
+# the %%EOF marker of a complete pdf is within the last bytes of the file
+EOF_SEARCH_LENGTH = 2048
+# number of leading pages checked for fonts, a text layer on none of them means the pdf is a scan
+TEXT_LAYER_PAGES = 10
+
+# routes of the triage
+FAST = "fast"
+TIKA = "tika"
+REJECT = "reject"
+
+TRIAGE_COLUMNS = ["filename", "kind", "has_eof", "n_pages", "has_text_layer", "route", "reason"]
+
+
+def _has_text_layer(reader: pypdf.PdfReader) -> bool:
+    """ Whether any of the leading pages uses a font, i.e. has text that can be extracted without OCR."""
+    for page in reader.pages[:TEXT_LAYER_PAGES]:
+        resources = page.get("/Resources")
+        if resources is not None and "/Font" in resources.get_object():
+            return True
+    return False
+
+
+def triage_file(file_path: str) -> dict:
+    """ Decide cheaply, without extracting any text, how a downloaded file should be parsed.
+
+    Only the magic bytes, the end of the file and the page tree are read. Files are routed to
+    - 'fast': pdfs with a text layer, for the in-process backend
+    - 'tika': scanned pdfs without a text layer, pdfs pypdf cannot open and pngs, for Tika and its OCR
+    - 'reject': empty files, HTML error pages, other non-pdfs and truncated pdfs, which would not yield any text
+
+    Args:
+        file_path: path to the file
+
+    Returns:
+        dict: the TRIAGE_COLUMNS of the file
+    """
+    result = {"filename": os.path.basename(file_path), "kind": None, "has_eof": None, "n_pages": None,
+              "has_text_layer": None, "route": REJECT, "reason": None}
+
+    size = os.path.getsize(file_path)
+    if size == 0:
+        result["reason"] = "empty"
+        return result
+
+    with open(file_path, 'rb') as file:
+        head = file.read(SNIFF_LENGTH)
+        file.seek(max(0, size - EOF_SEARCH_LENGTH))
+        tail = file.read()
+
+    result["kind"] = sniff_content_type(head)
+    if result["kind"] == "png":
+        result.update(route=TIKA, reason="image")
+        return result
+    if result["kind"] != "pdf":
+        result["reason"] = result["kind"] if result["kind"] == "html" else "not_a_pdf"
+        return result
+
+    result["has_eof"] = b"%%EOF" in tail
+    if not result["has_eof"]:
+        result["reason"] = "truncated"
+        return result
+
+    try:
+        reader = pypdf.PdfReader(file_path)
+        if reader.is_encrypted:
+            result.update(route=TIKA, reason="encrypted")
+            return result
+        result["n_pages"] = len(reader.pages)
+        result["has_text_layer"] = _has_text_layer(reader)
+    except Exception:
+        result.update(route=TIKA, reason="unreadable_by_pypdf")
+        return result
+
+    if result["n_pages"] == 0:
+        result["reason"] = "no_pages"
+    elif result["has_text_layer"]:
+        result.update(route=FAST, reason="text_layer")
+    else:
+        result.update(route=TIKA, reason="scan")
+
+    return result
+
+
+def triage_folder(folder_path: str,
+                  reject_list_path: str = None) -> pd.DataFrame:
+    """ Triage all pdf and png files of a folder, see triage_file.
+
+    Args:
+        folder_path: folder with the downloaded files
+        reject_list_path: if given, the rejected files are written to this csv
+
+    Returns:
+        pd.DataFrame: one row per file with the TRIAGE_COLUMNS
+    """
+    files = sorted(file for file in os.listdir(folder_path)
+                   if file.lower().endswith('.pdf') or file.lower().endswith('.png'))
+    triage_df = pd.DataFrame([triage_file(os.path.join(folder_path, file)) for file in files],
+                             columns=TRIAGE_COLUMNS)
+
+    if reject_list_path is not None:
+        triage_df[triage_df["route"] == REJECT].to_csv(reject_list_path, index=False)
+
+    return triage_df
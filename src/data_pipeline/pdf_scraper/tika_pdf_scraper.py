@@ -1,51 +1,178 @@
+import itertools
 import os
 import pandas as pd
 import random
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 from loguru import logger
-from tika import parser
+from tika import tika
 
+from data_pipeline.pdf_scraper.document_sink import DEFAULT_ROW_GROUP_SIZE
+from data_pipeline.pdf_scraper.document_sink import open_document_sink
+from data_pipeline.pdf_scraper.extraction_backends import get_backend
+from data_pipeline.pdf_scraper.extraction_cache import ExtractionCache
+from data_pipeline.pdf_scraper.extraction_cache import file_sha256
 
-def pdf_parser_from_path(pdf_path: str) -> dict:
+# number of pdfs that are sent to the Tika servers at the same time
+DEFAULT_N_WORKERS = 4
+# every file is sent to Tika. 'triage' reads pdfs with a text layer in-process by pypdf and rejects files without
+# any extractable text, like HTML error pages, without parsing, see pdf_triage, but its texts differ from Tika's
+DEFAULT_BACKEND = "tika"
+
+
+def pdf_parser_from_path(pdf_path: str,
+                         server_endpoint: str = None,
+                         backend=DEFAULT_BACKEND) -> dict:
     """Parse pdf and extract content and metadata
 
     Args:
         pdf_path: path as string
+        server_endpoint: url of the Tika server, e.g. 'http://localhost:9998'. If None, the default server of the
+            tika package is used and started if necessary.
+        backend: extraction backend or its name, see extraction_backends.get_backend. 'tika', the default, sends
+            every file to Tika. 'pypdf+tika' only sends the files that pypdf cannot handle and 'triage' decides per
+            file before parsing; with both, pdfs with a text layer get pypdf's text instead of Tika's.
 
     Returns:
-        parsed: dictionary containing content and metadata
+        parsed: dictionary containing content, page_offsets and metadata. page_offsets are the positions in the
+            content where the pages start, see page_index.get_page, or None if the backend does not split pages,
+            like 'tika'; use 'tika-pages' to get them from Tika
     """
-    # try parsing with extended timeout, extract and store relevant info
+    if isinstance(backend, str):
+        backend = get_backend(backend)
+
+    # try parsing, extract and store relevant info
     try:
-        parsed = parser.from_file(pdf_path,
-                                  requestOptions={'timeout': 200})
-        return {
-            "content": parsed["content"],
-            "metadata": parsed["metadata"]
-        }
+        return backend.extract(pdf_path, server_endpoint)
     # store error message if unsuccessful
     except Exception as e:
         logger.info(f"An error occurred: {e}")
         return {
             "content": f"Error parsing PDF: {e}",
+            "page_offsets": None,
             "metadata": None
         }
 
 
-def pdf_parser_from_folder(folder_path: str,
-                           sample_size: int =None) -> pd.DataFrame:
-    """Apply pdf_parser_from_path function to full folder
+def _iter_parsed_files_concurrently(pdf_paths: list,
+                                   n_workers: int,
+                                   server_endpoints: list,
+                                   backend):
+    """ Parse the pdfs with n_workers requests in flight, spread round-robin over the server endpoints.
 
-    Args:
-        folder_path: full input folder path as string
+    At most two pdfs per worker are submitted ahead, so finished results never pile up in memory.
 
-    Returns:
-        df: df containing filename, content and metadata per pdf
+    Yields:
+        tuple: index of the pdf in pdf_paths and its parsed info, in completion order
+    """
+    endpoints = itertools.cycle(server_endpoints)
+    jobs = iter(enumerate(pdf_paths))
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = {}
+        for index, pdf_path in itertools.islice(jobs, 2 * n_workers):
+            pending[executor.submit(pdf_parser_from_path, pdf_path, next(endpoints), backend)] = index
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                logger.info(f"Parsed file: {os.path.basename(pdf_paths[index])}")
+                yield index, future.result()
+
+                for next_index, pdf_path in itertools.islice(jobs, 1):
+                    pending[executor.submit(pdf_parser_from_path, pdf_path, next(endpoints), backend)] = next_index
+
+
+def _iter_parsed_files(pdf_paths: list,
+                       n_workers: int,
+                       server_endpoints: list,
+                       backend):
+    """ Parse the pdfs one after another or with a pool of n_workers threads.
+
+    Yields:
+        tuple: index of the pdf in pdf_paths and its parsed info
+    """
+    if n_workers > 1 and len(pdf_paths) > 1:
+        # the tika package starts the default server on the first request, so it is not sent concurrently
+        logger.info(f"Parsing file: {os.path.basename(pdf_paths[0])}")
+        yield 0, pdf_parser_from_path(pdf_paths[0], server_endpoints[0], backend)
+        for index, parsed_info in _iter_parsed_files_concurrently(pdf_paths[1:], n_workers, server_endpoints,
+                                                                  backend):
+            yield index + 1, parsed_info
+    else:
+        # iterate over all files in folder
+        for index, pdf_path in enumerate(pdf_paths):
+            logger.info(f"Parsing file: {os.path.basename(pdf_path)}")
+            yield index, pdf_parser_from_path(pdf_path, server_endpoints[0], backend)
+
+
+def _iter_parsed_files_with_cache(pdf_paths: list,
+                                  n_workers: int,
+                                  server_endpoints: list,
+                                  backend,
+                                  cache: ExtractionCache):
+    """ Serve unchanged pdfs from the cache, parse only the new or modified ones and add them to the cache.
+
+    Yields:
+        tuple: index of the pdf in pdf_paths and its parsed info, the cached pdfs first
+    """
+    hashes = [file_sha256(pdf_path) for pdf_path in pdf_paths]
+
+    missing = []
+    for index, sha256 in enumerate(hashes):
+        parsed_info = cache.get(sha256, backend.version)
+        if parsed_info is None:
+            missing.append(index)
+        else:
+            yield index, parsed_info
+    logger.info(f"{len(pdf_paths) - len(missing)} files served from the extraction cache, {len(missing)} to parse.")
+
+    missing_paths = [pdf_paths[index] for index in missing]
+    for missing_index, parsed_info in _iter_parsed_files(missing_paths, n_workers, server_endpoints, backend):
+        index = missing[missing_index]
+        # errors are not cached, so failed files are parsed again in the next run
+        if parsed_info["metadata"] is not None:
+            cache.put(hashes[index], backend.version, parsed_info["content"], parsed_info["metadata"],
+                      page_offsets=parsed_info["page_offsets"])
+        yield index, parsed_info
+
+
+def _iter_documents(pdf_paths: list,
+                    n_workers: int,
+                    server_endpoints: list,
+                    backend,
+                    cache_path: str = None):
+    """ Parse the pdfs, through the extraction cache if cache_path is given.
+
+    Yields:
+        tuple: index of the pdf in pdf_paths and its parsed info, in completion order
     """
+    server_endpoints = server_endpoints or [tika.ServerEndpoint]
+    if isinstance(backend, str):
+        # the servers are expected to run the same Tika version, the first one is asked for it
+        backend = get_backend(backend, server_endpoint=server_endpoints[0])
+
+    if cache_path is None:
+        yield from _iter_parsed_files(pdf_paths, n_workers, server_endpoints, backend)
+        return
+
+    cache = ExtractionCache(cache_path)
+    try:
+        yield from _iter_parsed_files_with_cache(pdf_paths, n_workers, server_endpoints, backend, cache)
+    finally:
+        cache.close()
+
+
+def _list_pdf_files(folder_path: str,
+                    sample_size: int = None) -> list:
+    """ Return the names of the pdf and png files in folder_path, or a random sample of sample_size of them."""
     # get all filenames
     pdf_files = [file for file in os.listdir(folder_path)
                  if file.lower().endswith('.pdf') or file.lower().endswith('.png')]
-    
+
     # if a sample_size is specified, get random sample of specified size
     if sample_size is not None:
         # only if enough samples are available
@@ -55,21 +182,48 @@ def pdf_parser_from_folder(folder_path: str,
         else:
             raise ValueError(f"Sample of {sample_size} larger than folder contents of {len(pdf_files)}")
 
-    # define empty df to store parsed result
-    parsed_data = []
+    return pdf_files
+
+
+def pdf_parser_from_folder(folder_path: str,
+                           sample_size: int =None,
+                           n_workers: int = DEFAULT_N_WORKERS,
+                           server_endpoints: list = None,
+                           cache_path: str = None,
+                           backend=DEFAULT_BACKEND) -> pd.DataFrame:
+    """Apply pdf_parser_from_path function to full folder
+
+    The pdfs are parsed by a pool of n_workers threads, so the server never idles while Python waits for a
+    response. The rows of the result are in the order of the files, regardless of the order in which they finish.
+
+    Args:
+        folder_path: full input folder path as string
+        sample_size: number of randomly sampled files to parse; if None, all files are parsed
+        n_workers: number of pdfs parsed at the same time, 1 parses them one after another
+        server_endpoints: urls of the Tika servers to spread the requests over, e.g. several local instances.
+            If None, the default server of the tika package is used.
+        cache_path: path to the SQLite extraction cache. If given, pdfs that were parsed before by the same
+            backend versions are served from the cache and only new or modified pdfs are parsed.
+        backend: extraction backend or its name, see pdf_parser_from_path. Pass
+            get_backend("tika", tika_pool=pool) to use the servers of a tika_server_pool.TikaServerPool.
+
+    Returns:
+        df: df containing filename, content, page_offsets and metadata per pdf
+    """
+    pdf_files = _list_pdf_files(folder_path, sample_size)
+    pdf_paths = [os.path.join(folder_path, pdf_file) for pdf_file in pdf_files]
 
-    # iterate over all files in folder
-    for pdf_file in pdf_files:
-        logger.info(f"Parsing file: {pdf_file}")
-        pdf_path = os.path.join(folder_path, pdf_file)
+    # collect in completion order and put each result back at the position of its file
+    parsed_infos = [None] * len(pdf_paths)
+    for index, parsed_info in _iter_documents(pdf_paths, n_workers, server_endpoints, backend, cache_path):
+        parsed_infos[index] = parsed_info
 
-        # apply parser function
-        parsed_info = pdf_parser_from_path(pdf_path)
-        parsed_data.append({
-            "filename": pdf_file,
-            "content": parsed_info["content"],
-            "metadata": parsed_info["metadata"]
-        })
+    # store parsed result per file
+    parsed_data = [{"filename": pdf_file,
+                    "content": parsed_info["content"],
+                    "page_offsets": parsed_info["page_offsets"],
+                    "metadata": parsed_info["metadata"]}
+                   for pdf_file, parsed_info in zip(pdf_files, parsed_infos)]
 
     logger.info("Parsing done.")
     # save as df and convert 'content' to string
@@ -77,3 +231,51 @@ def pdf_parser_from_folder(folder_path: str,
 
     return df
 
+
+def pdf_parser_to_file(folder_path: str,
+                       output_path: str,
+                       n_workers: int = DEFAULT_N_WORKERS,
+                       server_endpoints: list = None,
+                       cache_path: str = None,
+                       backend=DEFAULT_BACKEND,
+                       row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> int:
+    """Parse the pdfs of a folder and stream the results to a file instead of collecting them in a df
+
+    Every document is written to the sink as soon as it is parsed, so the memory stays flat regardless of the
+    number of pdfs. Files that are already in the sink are skipped, so after a crash the same call resumes where it
+    stopped. Files that could not be parsed, e.g. because of a Tika timeout, are not written, so the next call tries
+    them again. Read the result with document_sink.read_documents.
+
+    Args:
+        folder_path: full input folder path as string
+        output_path: path of a .jsonl file, flushed after every document, or of a .parquet folder, flushed every
+            row_group_size documents
+        n_workers: number of pdfs parsed at the same time, see pdf_parser_from_folder
+        server_endpoints: urls of the Tika servers, see pdf_parser_from_folder
+        cache_path: path to the SQLite extraction cache, see pdf_parser_from_folder
+        backend: extraction backend or its name, see pdf_parser_from_folder
+        row_group_size: number of documents per part file of a parquet sink
+
+    Returns:
+        int: number of documents written in this run
+    """
+    n_written = 0
+    with open_document_sink(output_path, row_group_size=row_group_size) as sink:
+        written_filenames = sink.written_filenames()
+        pdf_files = [pdf_file for pdf_file in _list_pdf_files(folder_path) if pdf_file not in written_filenames]
+        logger.info(f"{len(written_filenames)} files already in {output_path}, {len(pdf_files)} to parse.")
+
+        pdf_paths = [os.path.join(folder_path, pdf_file) for pdf_file in pdf_files]
+        for index, parsed_info in _iter_documents(pdf_paths, n_workers, server_endpoints, backend, cache_path):
+            # failed files have no metadata, see pdf_parser_from_path
+            if parsed_info["metadata"] is None:
+                continue
+            sink.write({"filename": pdf_files[index],
+                        "content": parsed_info["content"],
+                        "page_offsets": parsed_info["page_offsets"],
+                        "metadata": parsed_info["metadata"]})
+            n_written += 1
+
+    logger.info(f"Parsing done, {len(pdf_files) - n_written} files could not be parsed.")
+
+    return n_written
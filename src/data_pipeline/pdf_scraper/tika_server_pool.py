@@ -0,0 +1,413 @@
+import csv
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pypdf
+import requests
+from loguru import logger
+from tika import tika
+
+from data_pipeline.pdf_scraper.extraction_backends import tika_backend_version
+from data_pipeline.pdf_scraper.page_index import PAGE_SEPARATOR
+from data_pipeline.pdf_scraper.page_index import join_pages
+from data_pipeline.pdf_scraper.page_index import xhtml_to_pages
+
+# first port of the local Tika servers, the following servers use the next ports
+DEFAULT_BASE_PORT = 9998
+DEFAULT_JAVA_ARGS = ("-Xmx2g",)
+# seconds to wait for a started server to answer
+STARTUP_TIMEOUT = 120
+HEALTH_CHECK_TIMEOUT = 5
+# seconds between the health checks of the idle servers
+HEALTH_CHECK_INTERVAL = 30
+# timeout of a file: MIN_TIMEOUT plus SECONDS_PER_MB and SECONDS_PER_PAGE, capped at MAX_TIMEOUT
+MIN_TIMEOUT = 30
+SECONDS_PER_MB = 10
+SECONDS_PER_PAGE = 2
+MAX_TIMEOUT = 1800
+
+QUARANTINE_COLUMNS = ["timestamp", "path", "reason"]
+# metadata key of the texts of the embedded documents of a file split into pages, see _parse_rmeta
+EMBEDDED_CONTENT_KEY = "X-TIKA:embedded_content"
+
+
+class TikaExtractionError(Exception):
+    """ Raised if a file could not be parsed by any server of the pool."""
+
+
+def count_pdf_pages(pdf_path: str) -> int | None:
+    """ Return the number of pages of a pdf, or None if it cannot be read."""
+    try:
+        return len(pypdf.PdfReader(pdf_path).pages)
+    except Exception:
+        return None
+
+
+def adaptive_timeout(pdf_path: str,
+                     min_timeout: float = MIN_TIMEOUT,
+                     max_timeout: float = MAX_TIMEOUT) -> float:
+    """ Return the Tika timeout of a file in seconds, growing with its size and number of pages."""
+    size_mb = os.path.getsize(pdf_path) / 1024 ** 2
+    n_pages = count_pdf_pages(pdf_path) if pdf_path.lower().endswith('.pdf') else None
+
+    timeout = min_timeout + SECONDS_PER_MB * size_mb + SECONDS_PER_PAGE * (n_pages or 0)
+    return min(timeout, max_timeout)
+
+
+class QuarantineList:
+    """ Files that repeatedly failed or hung the Tika servers and are not sent to them again.
+
+    The list is kept in memory and, if path is given, appended to a CSV file that is read again on the next run.
+    All methods are thread-safe.
+
+    Args:
+        path: path to the CSV file, created with a header if it does not exist
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reasons = {}
+
+        if path is None:
+            return
+        if os.path.exists(path):
+            with open(path, newline='') as quarantine_file:
+                for row in csv.DictReader(quarantine_file):
+                    self._reasons[row["path"]] = row["reason"]
+        else:
+            with open(path, 'w', newline='') as quarantine_file:
+                csv.writer(quarantine_file).writerow(QUARANTINE_COLUMNS)
+
+    def contains(self, pdf_path: str) -> bool:
+        with self._lock:
+            return pdf_path in self._reasons
+
+    def add(self, pdf_path: str, reason: str):
+        """ Quarantine pdf_path because of reason."""
+        with self._lock:
+            self._reasons[pdf_path] = reason
+            if self.path is not None:
+                with open(self.path, 'a', newline='') as quarantine_file:
+                    csv.writer(quarantine_file).writerow([datetime.now().isoformat(), pdf_path, reason])
+
+    def to_dict(self) -> dict:
+        """ Return the quarantined paths with their reasons."""
+        with self._lock:
+            return dict(self._reasons)
+
+
+class _TikaServer:
+    """ State of one server process of the pool."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.process = None
+        self.generation = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+
+class TikaServerPool:
+    """ Starts and supervises local Tika server processes and spreads the files over them.
+
+    Every server is warmed with a small request after startup. A request that times out restarts its server, as the
+    JVM is most likely stuck on the file; a connection error restarts it if it fails the health check. A file is
+    tried on up to max_attempts servers and quarantined afterwards, so a pathological pdf cannot stall the run. While
+    the pool is running, a background thread checks the idle servers every health_check_interval seconds and
+    restarts those that do not answer, so a server that died or hung between files is not only noticed when the next
+    file times out. The timeout of each file grows with its size and number of pages, see adaptive_timeout. The requests are sent
+    directly, so the tika package never starts servers of its own.
+
+    Use it as a context manager and pass get_backend("pypdf+tika", tika_pool=pool) or pool.backend() as backend
+    to pdf_parser_from_folder.
+
+    Args:
+        n_servers: number of server processes
+        base_port: port of the first server, the following servers use the next ports
+        host: host the servers listen on
+        jar_path: path to the tika-server jar, downloaded by the tika package if it does not exist
+        java_path: java executable
+        java_args: arguments of the JVM, e.g. the heap size
+        max_attempts: number of servers a file is tried on before it is quarantined
+        quarantine_path: CSV file of the quarantined files; if None, the quarantine is kept in memory only
+        min_timeout: timeout of the smallest files in seconds
+        max_timeout: upper bound of the timeout in seconds
+        log_dir: folder of the server logs
+        health_check_interval: seconds between the health checks of the idle servers, None for no periodic checks
+    """
+
+    def __init__(self,
+                 n_servers: int = 2,
+                 base_port: int = DEFAULT_BASE_PORT,
+                 host: str = "127.0.0.1",
+                 jar_path: str = None,
+                 java_path: str = "java",
+                 java_args: tuple = DEFAULT_JAVA_ARGS,
+                 max_attempts: int = 2,
+                 quarantine_path: str = None,
+                 min_timeout: float = MIN_TIMEOUT,
+                 max_timeout: float = MAX_TIMEOUT,
+                 log_dir: str = None,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL):
+        self.host = host
+        self.jar_path = jar_path or os.path.join(tika.TikaJarPath, 'tika-server.jar')
+        self.java_path = java_path
+        self.java_args = java_args
+        self.max_attempts = max_attempts
+        self.quarantine = QuarantineList(quarantine_path)
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.log_dir = log_dir or tempfile.gettempdir()
+        self.health_check_interval = health_check_interval
+
+        self._servers = [_TikaServer(base_port + i) for i in range(n_servers)]
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._stopped = threading.Event()
+        self._health_thread = None
+
+    def endpoint(self, server: _TikaServer) -> str:
+        return f"http://{self.host}:{server.port}"
+
+    @property
+    def endpoints(self) -> list:
+        return [self.endpoint(server) for server in self._servers]
+
+    def _server_command(self, port: int) -> list:
+        return [self.java_path, *self.java_args, "-jar", self.jar_path, "--host", self.host, "--port", str(port)]
+
+    def _launch(self, server: _TikaServer):
+        """ Start the process of server and block until it answers."""
+        log_path = os.path.join(self.log_dir, f"tika-server-{server.port}.log")
+        with open(log_path, 'ab') as log_file:
+            server.process = subprocess.Popen(self._server_command(server.port), stdout=log_file,
+                                              stderr=subprocess.STDOUT)
+        server.generation += 1
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not self.is_healthy(server):
+            if server.process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"Tika server on port {server.port} did not start, see {log_path}")
+            time.sleep(0.5)
+
+        # the first parse loads the parsers, so it is done before real files are sent
+        self._session.put(self.endpoint(server) + "/tika", data=b"warm up", headers={"Content-Type": "text/plain"},
+                          timeout=STARTUP_TIMEOUT)
+        logger.info(f"Tika server running on {self.endpoint(server)}")
+
+    def _terminate(self, server: _TikaServer):
+        if server.process is None:
+            return
+        server.process.terminate()
+        try:
+            server.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.process.kill()
+            server.process.wait()
+        server.process = None
+
+    def is_healthy(self, server: _TikaServer) -> bool:
+        """ Whether server answers a version request in time."""
+        try:
+            response = self._session.get(self.endpoint(server) + "/version", timeout=HEALTH_CHECK_TIMEOUT)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def server_version(self) -> str:
+        """ Return the version of the Tika servers of the pool, e.g. '2.6.0'. All servers run the same jar."""
+        response = self._session.get(self.endpoint(self._servers[0]) + "/version", timeout=HEALTH_CHECK_TIMEOUT)
+        response.raise_for_status()
+        # the server answers e.g. 'Apache Tika 2.6.0'
+        return response.text.strip().split()[-1]
+
+    def restart(self, server: _TikaServer, generation: int):
+        """ Restart server, unless it was already restarted since generation."""
+        with server.lock:
+            if server.generation != generation:
+                return
+            logger.warning(f"Restarting Tika server on port {server.port}")
+            self._terminate(server)
+            self._launch(server)
+
+    def _ensure_jar(self):
+        if not os.path.isfile(self.jar_path):
+            tika.getRemoteJar(tika.TikaServerJar, self.jar_path)
+
+    def check_health(self):
+        """ Restart the idle servers that do not answer a version request.
+
+        Busy servers are left to the timeouts of their requests, as a long parse is not a reason to restart them.
+        """
+        for server in self._servers:
+            generation = server.generation
+            if server.in_flight > 0 or self.is_healthy(server):
+                continue
+            try:
+                self.restart(server, generation)
+            except RuntimeError as e:
+                logger.error(f"Tika server on port {server.port} could not be restarted: {e}")
+
+    def _check_health_periodically(self):
+        while not self._stopped.wait(self.health_check_interval):
+            self.check_health()
+
+    def start(self):
+        """ Download the jar if necessary, start all servers and wait until they are warm."""
+        self._ensure_jar()
+        for server in self._servers:
+            with server.lock:
+                self._launch(server)
+
+        if self.health_check_interval is not None:
+            self._stopped.clear()
+            self._health_thread = threading.Thread(target=self._check_health_periodically, daemon=True)
+            self._health_thread.start()
+
+    def stop(self):
+        """ Stop the health checks and terminate all servers."""
+        self._stopped.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+        for server in self._servers:
+            with server.lock:
+                self._terminate(server)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _acquire(self) -> _TikaServer:
+        """ Return the server with the fewest requests in flight."""
+        with self._lock:
+            server = min(self._servers, key=lambda candidate: candidate.in_flight)
+            server.in_flight += 1
+            return server
+
+    def _release(self, server: _TikaServer):
+        with self._lock:
+            server.in_flight -= 1
+
+    def _request(self, server: _TikaServer, pdf_path: str, timeout: float, pages: bool) -> requests.Response:
+        with open(pdf_path, 'rb') as pdf_file:
+            return self._session.put(self.endpoint(server) + ("/rmeta/xml" if pages else "/rmeta/text"),
+                                     data=pdf_file,
+                                     headers={"Accept": "application/json"},
+                                     timeout=timeout)
+
+    def extract(self, pdf_path: str, pages: bool = False) -> dict:
+        """ Return a dict with the content, page offsets and metadata of the file at pdf_path.
+
+        With pages, the text is split into pages like by TikaBackend, otherwise the page offsets are None.
+
+        Raises:
+            TikaExtractionError: if the file is quarantined or could not be parsed
+        """
+        if self.quarantine.contains(pdf_path):
+            raise TikaExtractionError(f"{pdf_path} is quarantined")
+
+        timeout = adaptive_timeout(pdf_path, min_timeout=self.min_timeout, max_timeout=self.max_timeout)
+        reason = None
+        for _ in range(self.max_attempts):
+            server = self._acquire()
+            generation = server.generation
+            try:
+                response = self._request(server, pdf_path, timeout, pages)
+            except requests.Timeout:
+                reason = "timeout"
+                self.restart(server, generation)
+                continue
+            except requests.ConnectionError:
+                reason = "connection_error"
+                if not self.is_healthy(server):
+                    self.restart(server, generation)
+                continue
+            finally:
+                self._release(server)
+
+            if response.status_code == 200:
+                return _parse_rmeta(response.json(), pages)
+            # the server rejected the file itself, another server would do the same
+            reason = f"http_{response.status_code}"
+            break
+
+        self.quarantine.add(pdf_path, reason)
+        raise TikaExtractionError(f"{pdf_path} could not be parsed by Tika: {reason}")
+
+    def backend(self, pages: bool = False) -> "ManagedTikaBackend":
+        """ Return an extraction backend that sends the files to this pool, see ManagedTikaBackend."""
+        return ManagedTikaBackend(self, pages)
+
+
+def _parse_rmeta(documents: list, pages: bool = False) -> dict:
+    """ Merge the /rmeta response of the main document and its embedded documents like tika.parser.from_file.
+
+    With pages, the contents are XHTML and only the main document, the first one, is split into pages, so the page
+    numbers are those of the file. The texts of the embedded documents, e.g. attachments, are kept in the metadata
+    under EMBEDDED_CONTENT_KEY instead.
+    """
+    contents = []
+    metadata = {}
+    for document in documents:
+        if document.get("X-TIKA:content"):
+            contents.append(document["X-TIKA:content"])
+        for key, value in document.items():
+            if key == "X-TIKA:content":
+                continue
+            if key in metadata:
+                if not isinstance(metadata[key], list):
+                    metadata[key] = [metadata[key]]
+                metadata[key].append(value)
+            else:
+                metadata[key] = value
+
+    if pages and documents:
+        main_content = documents[0].get("X-TIKA:content")
+        content, page_offsets = join_pages(xhtml_to_pages(main_content)) if main_content else (None, [])
+        embedded_contents = [PAGE_SEPARATOR.join(xhtml_to_pages(document["X-TIKA:content"]))
+                             for document in documents[1:] if document.get("X-TIKA:content")]
+        if embedded_contents:
+            metadata[EMBEDDED_CONTENT_KEY] = embedded_contents
+    else:
+        content, page_offsets = "".join(contents) or None, None
+    return {
+        "content": content,
+        "page_offsets": page_offsets,
+        "metadata": metadata
+    }
+
+
+class ManagedTikaBackend:
+    """ Extraction backend that sends the files to a TikaServerPool instead of the server of the tika package.
+
+    Its version is that of the servers of the pool, requested once when it is first needed.
+
+    Args:
+        pool: started TikaServerPool
+        pages: whether to split the text into pages, see TikaBackend
+    """
+
+    def __init__(self, pool: TikaServerPool, pages: bool = False):
+        self.pool = pool
+        self.pages = pages
+        self.name = "tika-pages" if pages else "tika"
+        self._version = None
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = tika_backend_version(self.pool.server_version(), self.pages)
+        return self._version
+
+    def extract(self, pdf_path: str, server_endpoint: str = None) -> dict:
+        """ Return a dict with the content, page offsets and metadata of the file. server_endpoint is ignored."""
+        return self.pool.extract(pdf_path, self.pages)
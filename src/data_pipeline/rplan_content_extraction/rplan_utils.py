@@ -4,10 +4,12 @@ import re
 import geopandas as gpd
 import pandas as pd
 
+from data_pipeline.pdf_scraper.page_index import write_text_with_page_index
 from data_pipeline.pdf_scraper.tika_pdf_scraper import pdf_parser_from_folder
 
 RPLAN_PDF_DIR = '../data/nrw/rplan/raw/pdfs'
 RPLAN_TXT_DIR = '../data/nrw/rplan/raw/text'
+RPLAN_EXTRACTION_CACHE_PATH = '../data/nrw/rplan/raw/extraction_cache.sqlite'
 
 RPLAN_OUTPUT_PATH = '../data/nrw/rplan/features/regional_plan_sections.json'
 
@@ -29,20 +31,33 @@ RPLAN_MATCH_DICT = {'Düsseldorf': 'duesseldorf-2018.pdf',
                     'Regionalverband Ruhr': 'ruhr-2021.pdf'}
 
 
-def extract_text_and_save_to_txt_files(pdf_dir_path: str, txt_dir_path: str = RPLAN_TXT_DIR):
+def extract_text_and_save_to_txt_files(pdf_dir_path: str,
+                                       txt_dir_path: str = RPLAN_TXT_DIR,
+                                       cache_path: str = RPLAN_EXTRACTION_CACHE_PATH):
     """ Extracts text from pdf files in input_path and saves it to output_path.
+
+    Pdfs that were extracted before are served from the extraction cache at cache_path, set it to None to parse
+    every pdf again.
     """
-    parsed_df = pdf_parser_from_folder(folder_path=pdf_dir_path)
+    parsed_df = pdf_parser_from_folder(folder_path=pdf_dir_path, cache_path=cache_path)
     write_df_to_text(parsed_df, txt_dir_path=txt_dir_path)
     return parsed_df
 
 
 def write_df_to_text(df, txt_dir_path):
     """ Writes content from df to txt files.
+
+    If df has page offsets, a page index is written next to each txt file, so single pages can be read with
+    page_index.read_page.
     """
-    for filename, content in zip(df['filename'], df['content']):
+    page_offsets_column = df['page_offsets'] if 'page_offsets' in df.columns else [None] * len(df)
+    for filename, content, page_offsets in zip(df['filename'], df['content'], page_offsets_column):
+        txt_path = os.path.join(txt_dir_path, filename.replace('.pdf', '.txt'))
+        if page_offsets:
+            write_text_with_page_index(txt_path, content, page_offsets)
+            continue
         # save content as txt file
-        with open(os.path.join(txt_dir_path, filename.replace('.pdf', '.txt')), 'w+') as f:
+        with open(txt_path, 'w+') as f:
             f.write(content)
 
 
@@ -2,6 +2,9 @@ import pandas as pd
 import geopandas as gpd
 import os
 
+from features.textual_features.document_texts_creation.corpus_store import read_corpus
+from features.textual_features.document_texts_creation.corpus_store import read_partitioned_corpus
+
 DOCUMENT_TEXT_FILE_PATH = 'data/nrw/bplan/raw/text/document_texts.json' 
 LAND_PARCELS_FILE_PATH = 'data/nrw/bplan/raw/links/land_parcels.geojson' 
 RPLAN_OUTPUT_PATH = "data/nrw/rplan/features/regional_plan_sections.json"
@@ -18,8 +21,13 @@ def land_parcels(input_filepath=LAND_PARCELS_FILE_PATH):
 
 def document_texts(input_filepath=DOCUMENT_TEXT_FILE_PATH, 
                    sample_n=None,
-                   usecols=None):
-    if input_filepath.endswith('.csv'):
+                   usecols=None,
+                   filters=None):
+    if os.path.isdir(input_filepath):
+        # partitioned corpus, filters on kommune and year only open the matching partitions and only the first
+        # sample_n documents are read
+        df = read_partitioned_corpus(input_filepath, filters=filters, columns=usecols, limit=sample_n)
+    elif input_filepath.endswith('.csv'):
         df = pd.read_csv(
             input_filepath,
             nrows=sample_n,
@@ -31,9 +39,13 @@ def document_texts(input_filepath=DOCUMENT_TEXT_FILE_PATH,
             df = df.head(sample_n)
         if usecols != None:
             df = df[usecols]
+    elif input_filepath.endswith('.arrow'):
+        # corpus file, only the requested rows and columns are read
+        rows = slice(0, sample_n) if sample_n != None else None
+        df = read_corpus(input_filepath, columns=usecols, rows=rows)
     else:
         raise ValueError(
-            "Unsupported file format. Only CSV and JSON files are supported.")
+            "Unsupported file format. Only CSV, JSON, Arrow corpus files and partitioned corpora are supported.")
     df = df.rename(columns={'land_parcel_id': 'Land Parcel ID'})
     return df
 
@@ -1,10 +1,14 @@
 import json
+import os
 import re
 
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from features.textual_features.document_texts_creation.corpus_store import read_corpus
+from features.textual_features.document_texts_creation.corpus_store import read_partitioned_corpus
+
 
 def open_keywords_json_as_dict(path_to_keywords: str) -> dict:
     """ Open, read and return the json with keywords into dict format.
@@ -170,31 +174,40 @@ def run_bp_keyword_detector(text_file_path: str,
                             original_files_path: str,
                             text_column: str = 'content',
                             id_column: str = 'filename',
-                            sample_n: int = None) -> 'pd.DataFrame':
+                            sample_n: int = None,
+                            filters: dict = None) -> 'pd.DataFrame':
     """Run the BP and keyword detector.
 
     Checks if the text contains the BP pattern and if the keywords are found. Also adds the categorization from the
     original dataframe.
 
     Args:
-        text_file_path (str): path to the text file
+        text_file_path (str): path to the text file, a json, an Arrow corpus file (.arrow) or the directory of a
+            partitioned corpus; from corpora only the id and text columns of the sampled rows are read
         original_files_path (str): path to the original files
         text_column (str): name of the column with the text
         id_column (str): name of the column with the unique file identifier
         sample_n (int): number of rows to sample
+        filters (dict): only for partitioned corpora, partition values of the documents to read, e.g.
+            {'kommune': 'Bonn', 'year': range(2000, 2010)}
 
     Returns:
         pd.DataFrame: dataframe with columns filename, document_category and the unique document id.
     """
     # Reading file
-    text_df = pd.read_json(text_file_path)
+    if os.path.isdir(text_file_path):
+        text_df = read_partitioned_corpus(text_file_path, filters=filters, columns=[id_column, text_column],
+                                          sample_n=sample_n or None)
+    elif text_file_path.endswith('.arrow'):
+        text_df = read_corpus(text_file_path, columns=[id_column, text_column], sample_n=sample_n or None)
+    else:
+        text_df = pd.read_json(text_file_path)
+        if sample_n:
+            text_df = text_df.sample(n=sample_n, random_state=912)
 
     # Running prepro of text column
     text_df = preprocess_text(text_df, text_column)
 
-    if sample_n:
-        text_df = text_df.sample(n=sample_n, random_state=912)
-
     # NRW geoportal dataset
     original_df = _extract_category_bp(original_files_path)
 
@@ -0,0 +1,91 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from features.textual_features.document_texts_creation.corpus_store import CorpusReader
+from features.textual_features.document_texts_creation.corpus_store import DEFAULT_COMPRESSION_LEVEL
+from features.textual_features.document_texts_creation.corpus_store import DEFAULT_DICT_SIZE
+from features.textual_features.document_texts_creation.corpus_store import write_corpus
+
+# storage variants compared by default: name, compressed, dictionary size
+DEFAULT_VARIANTS = (("uncompressed", False, 0),
+                    ("zstd", True, 0),
+                    ("zstd+dict", True, DEFAULT_DICT_SIZE))
+
+
+def benchmark_corpus_store(df: pd.DataFrame,
+                           text_column: str = 'content',
+                           id_column: str = 'filename',
+                           variants: tuple = DEFAULT_VARIANTS,
+                           compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                           n_lookups: int = 1000) -> pd.DataFrame:
+    """ Compare the storage of the document texts in a corpus file with and without compression.
+
+    For every variant the corpus is written to a temporary file, then all texts are read and decoded at once and
+    n_lookups random documents are read one by one by id.
+
+    Args:
+        df: df with one row per document, e.g. document_texts
+        text_column: column with the text, compressed in the compressed variants
+        id_column: column with the unique document id
+        variants: tuples of name, whether the text is compressed and the size of the zstd dictionary
+        compression_level: zstd compression level
+        n_lookups: number of random single-document reads
+
+    Returns:
+        pd.DataFrame: one row per variant with the file size, compression ratio, write seconds, decode throughput
+            in MB of text per second and the mean latency of a lookup by id in milliseconds
+    """
+    df = df[[id_column, text_column]]
+    text_mb = df[text_column].dropna().str.encode('utf-8').str.len().sum() / 1024 ** 2
+    lookup_ids = np.random.default_rng(912).choice(df[id_column].to_numpy(), size=n_lookups)
+
+    results = []
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        for name, compressed, dict_size in variants:
+            corpus_path = os.path.join(corpus_dir, f"{name}.arrow")
+
+            start = time.perf_counter()
+            write_corpus(df, corpus_path, id_column=id_column, compress_columns=[text_column] if compressed else None,
+                         compression_level=compression_level, dict_size=dict_size)
+            write_seconds = time.perf_counter() - start
+
+            with CorpusReader(corpus_path) as reader:
+                start = time.perf_counter()
+                reader.read(columns=[text_column])
+                decode_seconds = time.perf_counter() - start
+
+                reader.read(ids=lookup_ids[:1])  # builds the id index
+                start = time.perf_counter()
+                for document_id in lookup_ids:
+                    reader.read(columns=[text_column], ids=[document_id])
+                lookup_seconds = time.perf_counter() - start
+
+            file_mb = os.path.getsize(corpus_path) / 1024 ** 2
+            results.append({"variant": name,
+                            "text_mb": text_mb,
+                            "file_mb": file_mb,
+                            "compression_ratio": text_mb / file_mb,
+                            "write_seconds": write_seconds,
+                            "decode_mb_per_second": text_mb / decode_seconds,
+                            "lookup_ms": 1000 * lookup_seconds / n_lookups})
+
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser(description="Benchmark the compression of the corpus store.")
+    argument_parser.add_argument("json_path", help="document_texts.json or bp_text.json to benchmark on")
+    argument_parser.add_argument("--text-column", default="content")
+    argument_parser.add_argument("--id-column", default="filename")
+    argument_parser.add_argument("--compression-level", type=int, default=DEFAULT_COMPRESSION_LEVEL)
+    args = argument_parser.parse_args()
+
+    benchmark_df = benchmark_corpus_store(pd.read_json(args.json_path), text_column=args.text_column,
+                                          id_column=args.id_column, compression_level=args.compression_level)
+    logger.info(f"Benchmark results:\n{benchmark_df.to_string(index=False)}")
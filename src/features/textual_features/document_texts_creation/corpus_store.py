@@ -0,0 +1,404 @@
+import base64
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import zstandard as zstd
+from loguru import logger
+from pyarrow import ipc
+
+from features.textual_features.document_texts_creation.text_cleaning import add_cleaned_text
+
+# number of documents per record batch of the corpus file
+DEFAULT_BATCH_SIZE = 1000
+# columns a partitioned corpus is split by, in the order of the directory levels
+PARTITION_COLUMNS = ['kommune', 'year']
+# zstd level and size of the dictionary trained on the documents of compressed columns, 0 for no dictionary
+DEFAULT_COMPRESSION_LEVEL = 3
+DEFAULT_DICT_SIZE = 112 * 1024
+# number of randomly sampled documents the dictionary is trained on
+DICT_TRAINING_SAMPLES = 2000
+
+_ID_COLUMN_KEY = b"id_column"
+_JSON_COLUMNS_KEY = b"json_columns"
+_ZSTD_COLUMNS_KEY = b"zstd_columns"
+_ZSTD_DICT_KEY_PREFIX = b"zstd_dict:"
+
+
+def _is_nested(values: pd.Series) -> bool:
+    return values.map(lambda value: isinstance(value, (dict, list))).any()
+
+
+def _train_dictionary(documents: list, dict_size: int, level: int) -> bytes:
+    """ Train a zstd dictionary on a sample of the encoded documents, or return b'' if there are too few of them."""
+    if dict_size == 0:
+        return b''
+    rng = np.random.default_rng(912)
+    positions = rng.choice(len(documents), size=min(DICT_TRAINING_SAMPLES, len(documents)), replace=False)
+    try:
+        return zstd.train_dictionary(dict_size, [documents[position] for position in positions], level=level).as_bytes()
+    except zstd.ZstdError as e:
+        logger.warning(f"No zstd dictionary trained, the documents are compressed without: {e}")
+        return b''
+
+
+def _compress_column(values: pd.Series, dict_size: int, level: int) -> tuple:
+    """ Compress every document of values as an independent zstd frame.
+
+    Returns:
+        tuple: list of compressed documents (None for missing ones) and the dictionary they were compressed with
+    """
+    encoded = [None if value is None or value is pd.NA or value != value else value.encode('utf-8')
+               for value in values]
+    dict_data = _train_dictionary([document for document in encoded if document], dict_size, level)
+
+    compressor = zstd.ZstdCompressor(level=level, dict_data=zstd.ZstdCompressionDict(dict_data) if dict_data else None)
+    return [None if document is None else compressor.compress(document) for document in encoded], dict_data
+
+
+def _to_table(df: pd.DataFrame,
+              id_column: str,
+              compress_columns: list = None,
+              compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+              dict_size: int = DEFAULT_DICT_SIZE) -> pa.Table:
+    """ Convert df to an Arrow table, with the nested columns encoded as JSON strings and compress_columns
+    compressed per document."""
+    df = df.reset_index(drop=True)
+    json_columns = [column for column in df.columns if df[column].dtype == object and _is_nested(df[column])]
+    for column in json_columns:
+        df[column] = df[column].map(lambda value: None if value is None else json.dumps(value, ensure_ascii=False))
+
+    schema_metadata = {_ID_COLUMN_KEY: id_column.encode(),
+                       _JSON_COLUMNS_KEY: json.dumps(json_columns).encode(),
+                       _ZSTD_COLUMNS_KEY: json.dumps(compress_columns or []).encode()}
+    compressed = {}
+    for column in compress_columns or []:
+        compressed[column], dict_data = _compress_column(df[column], dict_size, compression_level)
+        schema_metadata[_ZSTD_DICT_KEY_PREFIX + column.encode()] = base64.b64encode(dict_data)
+
+    table = pa.Table.from_pandas(df.drop(columns=list(compressed)), preserve_index=False)
+    for column, documents in compressed.items():
+        table = table.add_column(df.columns.get_loc(column), column, pa.array(documents, type=pa.large_binary()))
+    return table.replace_schema_metadata(schema_metadata)
+
+
+class _ColumnDecoder:
+    """ Decodes the columns of a corpus as stored by _to_table: decompresses the zstd columns and parses the JSON
+    columns."""
+
+    def __init__(self, schema_metadata: dict):
+        self.json_columns = json.loads(schema_metadata.get(_JSON_COLUMNS_KEY, b'[]'))
+        self.decompressors = {}
+        for column in json.loads(schema_metadata.get(_ZSTD_COLUMNS_KEY, b'[]')):
+            dict_data = base64.b64decode(schema_metadata[_ZSTD_DICT_KEY_PREFIX + column.encode()])
+            self.decompressors[column] = zstd.ZstdDecompressor(
+                dict_data=zstd.ZstdCompressionDict(dict_data) if dict_data else None)
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        for column, decompressor in self.decompressors.items():
+            if column in df.columns:
+                df[column] = [None if document is None else decompressor.decompress(document).decode('utf-8')
+                              for document in df[column]]
+        for column in self.json_columns:
+            if column in df.columns:
+                df[column] = df[column].map(lambda value: None if value is None else json.loads(value))
+        return df
+
+
+def write_corpus(df: pd.DataFrame,
+                 corpus_path: str,
+                 id_column: str = 'filename',
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 compress_columns: list = None,
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                 dict_size: int = DEFAULT_DICT_SIZE):
+    """ Write a df of documents, e.g. document_texts, as corpus file that can be read with CorpusReader.
+
+    The corpus is an uncompressed Arrow IPC file, so it can be memory-mapped: readers only touch the pages of the
+    columns and rows they read, and processes reading the same file share them in the page cache. Columns holding
+    dicts or lists, like the Tika metadata, are stored as JSON strings and decoded again when read.
+
+    The text columns in compress_columns, e.g. ['content'], are compressed per document with zstd and a dictionary
+    trained on the corpus, which captures the boilerplate shared by the plans. Every document remains a separate
+    frame, so single documents are still read by id without decompressing any others, and readers decompress them
+    transparently.
+
+    Args:
+        df: df with one row per document
+        corpus_path: path of the corpus file, by convention ending with .arrow
+        id_column: column with the unique document id, used by CorpusReader.read(ids=...)
+        batch_size: number of documents per record batch
+        compress_columns: string columns to compress; if None, no column is compressed
+        compression_level: zstd compression level
+        dict_size: maximal size of the zstd dictionary in bytes, 0 to compress without dictionary
+    """
+    table = _to_table(df, id_column, compress_columns, compression_level, dict_size)
+    with pa.OSFile(corpus_path, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=batch_size)
+
+
+class CorpusReader:
+    """ Memory-mapped reader of a corpus file written by write_corpus.
+
+    Projection, row ranges, id lookups and sampling are applied before any text is converted to Python, so loading
+    the ids and metadata or a small sample takes milliseconds regardless of the size of the corpus.
+
+    Args:
+        corpus_path: path of the corpus file
+    """
+
+    def __init__(self, corpus_path: str):
+        self.corpus_path = corpus_path
+        self._source = pa.memory_map(corpus_path, 'r')
+        self._table = ipc.open_file(self._source).read_all()
+
+        schema_metadata = self._table.schema.metadata or {}
+        self.id_column = schema_metadata.get(_ID_COLUMN_KEY, b'filename').decode()
+        self._decode = _ColumnDecoder(schema_metadata)
+        self._id_index = None
+
+    @property
+    def columns(self) -> list:
+        return self._table.column_names
+
+    def __len__(self) -> int:
+        return self._table.num_rows
+
+    def ids(self) -> pd.Series:
+        """ Return the document ids in corpus order."""
+        return self._table.column(self.id_column).to_pandas()
+
+    def _positions_of(self, ids: list) -> np.ndarray:
+        if self._id_index is None:
+            self._id_index = pd.Index(self.ids())
+        positions = self._id_index.get_indexer(ids)
+        return positions[positions >= 0]
+
+    def read(self,
+             columns: list = None,
+             rows: slice = None,
+             ids: list = None,
+             sample_n: int = None,
+             sample_frac: float = None,
+             random_state: int = 912) -> pd.DataFrame:
+        """ Read documents from the corpus.
+
+        Args:
+            columns: columns to read; if None, all columns are read
+            rows: range of rows to read, e.g. slice(0, 100) for the first 100 documents
+            ids: ids of the documents to read, in this order; unknown ids are skipped
+            sample_n: number of randomly sampled documents
+            sample_frac: fraction of randomly sampled documents, used if sample_n is None
+            random_state: seed of the sampling
+
+        Returns:
+            pd.DataFrame: the selected documents
+        """
+        table = self._table if columns is None else self._table.select(columns)
+
+        if ids is not None:
+            table = table.take(self._positions_of(ids))
+        elif rows is not None:
+            start, stop, _ = rows.indices(table.num_rows)
+            table = table.slice(start, max(stop - start, 0))
+
+        if sample_n is None and sample_frac is not None:
+            sample_n = round(sample_frac * table.num_rows)
+        if sample_n is not None:
+            rng = np.random.default_rng(random_state)
+            positions = np.sort(rng.choice(table.num_rows, size=min(sample_n, table.num_rows), replace=False))
+            table = table.take(positions)
+
+        return self._decode(table.to_pandas())
+
+    def close(self):
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_corpus(corpus_path: str, **read_kwargs) -> pd.DataFrame:
+    """ Read documents from a corpus file, see CorpusReader.read for the arguments."""
+    with CorpusReader(corpus_path) as reader:
+        return reader.read(**read_kwargs)
+
+
+def write_partitioned_corpus(df: pd.DataFrame,
+                             dataset_path: str,
+                             partition_columns: list = PARTITION_COLUMNS,
+                             id_column: str = 'filename',
+                             batch_size: int = DEFAULT_BATCH_SIZE,
+                             compress_columns: list = None,
+                             compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                             dict_size: int = DEFAULT_DICT_SIZE):
+    """ Write a df of documents as corpus split into one corpus file per combination of the partition columns.
+
+    The files are stored in hive-style directories, e.g. dataset_path/kommune=Bonn/year=2004/part-0.arrow, so
+    read_partitioned_corpus only opens the files of the partitions that match its filters. Documents with a missing
+    partition value are stored in the __HIVE_DEFAULT_PARTITION__ directory of that level. Writing to partitions that
+    were written before adds the documents to them: the stored documents are read and written again together with
+    df, except those df has a new version of, matched by id_column.
+
+    Args:
+        df: df with one row per document and the partition columns
+        dataset_path: directory of the partitioned corpus
+        partition_columns: columns to partition by, one directory level per column
+        id_column: column with the unique document id
+        batch_size: maximal number of documents per record batch
+        compress_columns: string columns to compress, see write_corpus
+        compression_level: zstd compression level
+        dict_size: maximal size of the zstd dictionary in bytes, shared by the partitions of this call; partitions
+            written before keep their own dictionaries, see read_partitioned_corpus
+    """
+    df = _merge_with_stored_partitions(df, dataset_path, partition_columns, id_column)
+    ds.write_dataset(_to_table(df, id_column, compress_columns, compression_level, dict_size),
+                     dataset_path,
+                     format='ipc',
+                     partitioning=partition_columns,
+                     partitioning_flavor='hive',
+                     basename_template='part-{i}.arrow',
+                     max_rows_per_group=batch_size,
+                     existing_data_behavior='delete_matching')
+
+
+def _merge_with_stored_partitions(df: pd.DataFrame,
+                                  dataset_path: str,
+                                  partition_columns: list,
+                                  id_column: str) -> pd.DataFrame:
+    """ Add the documents stored in the partitions df is written to, unless df has them, to df.
+
+    The stored documents come first, in their order, so rewriting the partitions keeps their order.
+    """
+    if not os.path.isdir(dataset_path) or not os.listdir(dataset_path):
+        return df
+
+    partition_values = df[partition_columns].astype(object)
+    written_partitions = set(partition_values.where(partition_values.notna(), None).itertuples(index=False,
+                                                                                               name=None))
+    stored_dfs = []
+    for fragment in ds.dataset(dataset_path, format='ipc', partitioning='hive').get_fragments():
+        # missing values are stored in the default partition, which has no key
+        partition_keys = ds.get_partition_keys(fragment.partition_expression)
+        partition = tuple(partition_keys.get(column) for column in partition_columns)
+        if partition not in written_partitions:
+            continue
+
+        stored_df = _ColumnDecoder(fragment.physical_schema.metadata or {})(fragment.to_table().to_pandas())
+        stored_df = stored_df[~stored_df[id_column].isin(df[id_column])]
+        for column, value in zip(partition_columns, partition):
+            stored_df[column] = value
+        stored_dfs.append(stored_df)
+
+    if not stored_dfs:
+        return df
+    merged_df = pd.concat([*stored_dfs, df], ignore_index=True)
+    return merged_df[list(df.columns) + [column for column in merged_df.columns if column not in df.columns]]
+
+
+def _filter_expression(filters: dict) -> ds.Expression | None:
+    """ Convert {column: value or list of values} to a dataset filter, e.g. {'year': range(2000, 2010)}."""
+    expression = None
+    for column, values in (filters or {}).items():
+        if isinstance(values, (list, tuple, set, range)):
+            condition = ds.field(column).isin(list(values))
+        else:
+            condition = ds.field(column) == values
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_partitioned_corpus(dataset_path: str,
+                            filters: dict = None,
+                            columns: list = None,
+                            limit: int = None,
+                            sample_n: int = None,
+                            sample_frac: float = None,
+                            random_state: int = 912) -> pd.DataFrame:
+    """ Read documents from a corpus written by write_partitioned_corpus.
+
+    Filters on the partition columns prune whole partitions, i.e. the files of other municipalities or years are
+    never opened. With limit, the scan stops after the first limit documents.
+
+    Args:
+        dataset_path: directory of the partitioned corpus
+        filters: values of the documents to read per column, e.g. {'kommune': ['Bonn', 'Köln'], 'year': 2004}
+        columns: columns to read; if None, all columns including the partition columns are read
+        limit: number of documents to read, the first ones of the selected partitions
+        sample_n: number of randomly sampled documents of the selected partitions, ignored if limit is given
+        sample_frac: fraction of randomly sampled documents, used if sample_n is None
+        random_state: seed of the sampling
+
+    Returns:
+        pd.DataFrame: the selected documents
+    """
+    dataset = ds.dataset(dataset_path, format='ipc', partitioning='hive')
+    expression = _filter_expression(filters)
+    # the files are scanned one by one, as each has to be decoded with the dictionaries of its own schema: partitions
+    # written by different calls of write_partitioned_corpus were compressed with different dictionaries
+    fragments = list(dataset.get_fragments(filter=expression))
+    scanners = [ds.Scanner.from_fragment(fragment, schema=dataset.schema, columns=columns, filter=expression)
+                for fragment in fragments]
+
+    if limit is not None:
+        tables = []
+        for scanner in scanners:
+            if limit <= 0:
+                break
+            tables.append(scanner.head(limit))
+            limit -= tables[-1].num_rows
+    elif sample_n is None and sample_frac is None:
+        tables = [scanner.to_table() for scanner in scanners]
+    else:
+        # positions in the concatenation of the files, taken from each file relative to its first document
+        offsets = np.cumsum([0] + [scanner.count_rows() for scanner in scanners])
+        if sample_n is None:
+            sample_n = round(sample_frac * offsets[-1])
+        rng = np.random.default_rng(random_state)
+        positions = np.sort(rng.choice(offsets[-1], size=min(sample_n, offsets[-1]), replace=False))
+        tables = [scanner.take(positions[(positions >= start) & (positions < stop)] - start)
+                  for scanner, start, stop in zip(scanners, offsets[:-1], offsets[1:])]
+
+    if tables:
+        df = pd.concat([_ColumnDecoder(fragment.physical_schema.metadata or {})(table.to_pandas())
+                        for fragment, table in zip(fragments, tables)], ignore_index=True)
+    else:
+        empty_table = dataset.schema.empty_table()
+        df = _ColumnDecoder(dataset.schema.metadata or {})(
+            (empty_table if columns is None else empty_table.select(columns)).to_pandas())
+
+    # partition values are inferred from the directory names, integers stay integers despite missing values
+    for field in dataset.partitioning.schema:
+        if field.name in df.columns and pa.types.is_integer(field.type):
+            df[field.name] = df[field.name].astype('Int64')
+    return df
+
+
+def corpus_columns(corpus_path: str) -> list:
+    """ Return the columns of a corpus file or, for a directory, of a partitioned corpus."""
+    if os.path.isdir(corpus_path):
+        return ds.dataset(corpus_path, format='ipc', partitioning='hive').schema.names
+    with CorpusReader(corpus_path) as reader:
+        return reader.columns
+
+
+def convert_json_to_corpus(json_path: str,
+                           corpus_path: str,
+                           id_column: str = 'filename',
+                           compress_columns: list = None,
+                           text_column: str = 'content'):
+    """ Convert a document_texts.json or bp_text.json to a corpus file, see write_corpus.
+
+    The cleaned text of text_column is stored as well, see add_cleaned_text, so the keyword searches do not clean
+    the texts again; pass text_column=None to store the texts only.
+    """
+    df = pd.read_json(json_path)
+    if text_column is not None:
+        df = add_cleaned_text(df, text_column)
+    write_corpus(df, corpus_path, id_column=id_column, compress_columns=compress_columns)
@@ -1,13 +1,26 @@
 import pandas as pd
 
+from features.textual_features.document_texts_creation.corpus_store import PARTITION_COLUMNS
+from features.textual_features.document_texts_creation.corpus_store import write_partitioned_corpus
+from features.textual_features.document_texts_creation.text_cleaning import add_cleaned_text
+from features.textual_features.document_texts_creation.text_cleaning import cleaned_column_name
+
 
 def enrich_extracts_with_metadata(info_df: pd.DataFrame,
-                                  text_df: pd.DataFrame):
+                                  text_df: pd.DataFrame,
+                                  partitioned_corpus_path: str = None):
     """Function that joins BP-metadata and BP-text to produce the document_texts table.
 
+    The municipality (kommune) and the year of the plan date (datum) are added to every document. If
+    partitioned_corpus_path is given, the table is also written as corpus partitioned by municipality and year, so
+    municipality-, region- or year-scoped analyses only read the matching documents, see read_partitioned_corpus.
+    The corpus includes the cleaned text (content_cleaned), so the keyword searches do not clean the texts again,
+    and the page offsets of the texts if text_df has them, so the searches can report the pages of their hits.
+
     Args:
         info_df: df containing metadata
         text_df: df containing extracted text
+        partitioned_corpus_path: directory to write the partitioned corpus to; if None, no corpus is written
 
     Returns:
         final_df: merged df
@@ -15,16 +28,26 @@ def enrich_extracts_with_metadata(info_df: pd.DataFrame,
     # create id columns based on 'filename'
     text_df['document_id'] = text_df['filename'].str.replace(r'\.pdf$', '', regex=True)
     text_df['land_parcel_id'] = text_df['document_id'].str.extract(r'(\d+)')
-    
+
+    # year of the plan, the date is a string if the metadata was read from the parsed links csv
+    info_df = info_df.assign(year=pd.to_datetime(info_df['datum'], format='ISO8601', errors='coerce').dt.year
+                             .astype('Int64'))
+
     # merge BP-metadata into BP-text based on objectid
-    final_df = pd.merge(text_df, info_df[['objectid', 'name', 'scanurl','plantyp']],
+    final_df = pd.merge(text_df, info_df[['objectid', 'name', 'scanurl', 'plantyp', 'kommune', 'year']],
                         left_on='document_id',
                         right_on='objectid',
                         how='left')
-    
+
     # drop and rename columns
     final_df = final_df.drop(columns=['objectid']).rename(columns={'name': 'land_parcel_name',
                                                                    'scanurl': 'land_parcel_scanurl',
                                                                    'plantyp':'Document Type Code'
                                                                    })
+
+    if partitioned_corpus_path is not None:
+        write_partitioned_corpus(add_cleaned_text(final_df, 'content'), partitioned_corpus_path,
+                                 partition_columns=PARTITION_COLUMNS,
+                                 compress_columns=['content', cleaned_column_name('content')])
+
     return final_df
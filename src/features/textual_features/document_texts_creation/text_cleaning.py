@@ -0,0 +1,75 @@
+import pandas as pd
+
+# suffix of the column holding the cleaned text of a text column, e.g. content_cleaned
+CLEANED_SUFFIX = '_cleaned'
+
+# unstructured's clean_dashes replaces hyphens and en dashes by spaces
+DASHES = ('-', '–')
+
+
+def clean_text(text: str) -> str:
+    """ Clean a text for the keyword searches, equivalent to unstructured's clean(text, lowercase=True, dashes=True).
+
+    Lowercases the text, replaces dashes by spaces and strips surrounding whitespace. Replacing the dashes one after
+    the other is several times faster than the regular expression of unstructured or a translation table.
+    """
+    return _clean_unstripped(text).strip()
+
+
+def _clean_unstripped(text: str) -> str:
+    text = text.lower()
+    for dash in DASHES:
+        text = text.replace(dash, ' ')
+    return text
+
+
+def cleaned_text_offset(text: str) -> int:
+    """ Return the number of characters clean_text strips from the start of text.
+
+    Adding it to a position in the cleaned text gives the position in text, e.g. to look up the page of a hit in the
+    page offsets of the original text. Lowercasing keeps the length of German texts.
+    """
+    unstripped = _clean_unstripped(text)
+    return len(unstripped) - len(unstripped.lstrip())
+
+
+def clean_texts(texts: pd.Series) -> pd.Series:
+    """ Clean a column of texts at once, see clean_text. Missing texts become empty strings.
+
+    The texts are cleaned with Python's string methods rather than pandas' vectorized ones, as the latter lowercase
+    some characters differently when the strings are stored by pyarrow.
+    """
+    return pd.Series([clean_text(text) if isinstance(text, str) else '' for text in texts],
+                     index=texts.index, dtype=object)
+
+
+def cleaned_column_name(text_column_name: str) -> str:
+    """ Return the name of the column holding the cleaned text of text_column_name."""
+    return text_column_name + CLEANED_SUFFIX
+
+
+def add_cleaned_text(input_df: pd.DataFrame,
+                     text_column_name: str = 'content') -> pd.DataFrame:
+    """ Add the cleaned text of text_column_name as column, unless input_df has it already.
+
+    The keyword searches use the cleaned column instead of cleaning the texts again. Written with the corpus, e.g. by
+    enrich_extracts_with_metadata or convert_json_to_corpus, the texts are cleaned only once.
+
+    Args:
+        input_df: df with a text column
+        text_column_name: name of the column holding the text
+
+    Returns:
+        pd.DataFrame: input_df with the column cleaned_column_name(text_column_name)
+    """
+    if cleaned_column_name(text_column_name) in input_df.columns:
+        return input_df
+    return input_df.assign(**{cleaned_column_name(text_column_name): clean_texts(input_df[text_column_name])})
+
+
+def get_cleaned_texts(input_df: pd.DataFrame,
+                      text_column_name: str) -> pd.Series:
+    """ Return the cleaned texts of text_column_name, from the cleaned column if input_df has it."""
+    if cleaned_column_name(text_column_name) in input_df.columns:
+        return input_df[cleaned_column_name(text_column_name)]
+    return clean_texts(input_df[text_column_name])
@@ -1,8 +1,113 @@
+import re
+
+import numpy as np
 import pandas as pd
 
 from loguru import logger
-from thefuzz import fuzz
-from unstructured.cleaners.core import clean
+from rapidfuzz import fuzz
+from rapidfuzz import process
+
+from data_pipeline.pdf_scraper.page_index import page_number_at
+from features.textual_features.document_texts_creation.text_cleaning import add_cleaned_text
+from features.textual_features.document_texts_creation.text_cleaning import cleaned_text_offset
+from features.textual_features.document_texts_creation.text_cleaning import get_cleaned_texts
+
+
+# number of documents whose windows are scored in one call
+DOCUMENT_BATCH_SIZE = 64
+
+# the words of a content, as split by str.split
+_NON_WHITESPACE = re.compile(r'\S+')
+
+
+def _window_phrases(words: list,
+                    key_length: int) -> list:
+    """ Split the words of a content into consecutive phrases of key_length words (the last one may be shorter)."""
+    if key_length == 1:
+        # the phrases are the words, followed by the empty phrase after the last word
+        return words + [""]
+    return [" ".join(words[i:i + key_length]) for i in range(0, len(words) + 1, key_length)]
+
+
+def score_phrases(phrases: list,
+                  keyword: str,
+                  threshold: int,
+                  workers: int = 1) -> np.ndarray:
+    """
+    Function that scores all phrases against the keyword in one call.
+
+    The scores are those of thefuzz's fuzz.ratio, i.e. the rapidfuzz ratio rounded to an integer, but computed by a
+    single rapidfuzz cdist call instead of one call per phrase. Phrases scoring below the threshold are set to 0
+    without computing their exact score.
+
+    Args:
+        phrases: phrases to be scored
+        keyword: one or multiple word input of interest
+        threshold: for similarity search between input and keyword
+        workers: number of threads used by rapidfuzz, -1 for all cores
+
+    Returns:
+        np.ndarray: integer similarity score per phrase
+    """
+    if not phrases:
+        return np.zeros(0, dtype=int)
+    scores = process.cdist([keyword], phrases, scorer=fuzz.ratio, dtype=np.float64,
+                           score_cutoff=min(max(threshold, 0), 100), workers=workers)[0]
+    # np.round rounds halves to even like round, which fuzz.ratio uses
+    return np.round(scores).astype(int)
+
+
+def _word_pages(content: str,
+                text: str,
+                page_offsets: list) -> list:
+    """ Return the number of the page of each word of content, the cleaned text, None for texts without page
+    offsets."""
+    if not isinstance(text, str) or not pd.api.types.is_list_like(page_offsets) or len(page_offsets) == 0:
+        return [None] * len(content.split())
+    offset = cleaned_text_offset(text)
+    return [page_number_at(page_offsets, offset + word_match.start())
+            for word_match in _NON_WHITESPACE.finditer(content)]
+
+
+def _collect_best_matches(id: str,
+                          words: list,
+                          keyword: str,
+                          key_length: int,
+                          scores: np.ndarray,
+                          threshold: int,
+                          context_words: int,
+                          word_pages: list = None) -> list:
+    """ Turn the scores of the phrases of a content into the sorted best matches, see find_best_matches.
+
+    With word_pages, see _word_pages, every match also holds the page of its first word.
+    """
+    content_length = len(words)
+    best_matches = []
+
+    # only get matches above threshold
+    for phrase_index in np.flatnonzero(scores > threshold):
+        i = phrase_index * key_length
+
+        # calculate -x and +x for context words
+        start_context = max(0, i - context_words)
+        end_context = min(content_length, i + context_words + key_length)
+
+        # extract keyword and its surroundings
+        context_phrase = " ".join(words[start_context:end_context])
+
+        best_matches.append({
+            'id': id,
+            'keyword': keyword,
+            'matched_phrase': context_phrase,
+            'similarity_score': int(scores[phrase_index])
+        })
+        if word_pages is not None:
+            # the empty phrase after the last word is on the page of the last word
+            best_matches[-1]['page'] = word_pages[min(i, len(word_pages) - 1)] if word_pages else None
+
+    # sort by similarity score in descending order
+    best_matches.sort(key=lambda x: x['similarity_score'], reverse=True)
+    return best_matches
 
 
 def find_best_matches(id: str,
@@ -13,11 +118,11 @@ def find_best_matches(id: str,
     """
     Function that finds best matches for a given keyword / keyword combination in the input string.
 
-    This function utilizes the thefuzz package to find best matches for a given keyword / keyword combination in the
+    This function utilizes the rapidfuzz package to find best matches for a given keyword / keyword combination in the
     input string. It returns a list of dictionaries containing the id, keyword, matched phrase, and similarity score
     per match. The fuzz ratio is used to calculate the similarity score. It leverages the Levendstein distance to
     calculate the similarity between two strings. The score is normalized between 0 and 100, with 100 being the most
-    similar.
+    similar. All phrases of the input string are scored in one call, see score_phrases.
 
     Args:
         id: identifier of the content (e.g.,filename)
@@ -34,42 +139,14 @@ def find_best_matches(id: str,
             - similarity score per match
 
     """
-    # split content string into words, get no. of words in content string
+    # split content string into words, get no. of keywords in keyword string
     words = content.split()
-    content_length = len(words)
-
-    # get no. of keywords in keyword string
     key_length = len(keyword.split())
 
-    # init
-    best_matches = []
-
-    # iterate through text input in stepsize of key_length
-    for i in range(0, content_length + 1, key_length):
-
-        # generate phrases and get similarity between phrase + keyword
-        phrase = " ".join(words[i:i + key_length])
-        similarity_score = fuzz.ratio(phrase, keyword)
-
-        # only get matches above threshold
-        if similarity_score > threshold:
-            # calculate -x and +x for context words
-            start_context = max(0, i - context_words)
-            end_context = min(content_length, i + context_words + key_length)
-
-            # extract keyword and its surroundings
-            context_phrase = " ".join(words[start_context:end_context])
+    # generate phrases stepping through the words in stepsize of key_length and score them against the keyword
+    scores = score_phrases(_window_phrases(words, key_length), keyword, threshold)
 
-            best_matches.append({
-                'id': id,
-                'keyword': keyword,
-                'matched_phrase': context_phrase,
-                'similarity_score': similarity_score
-            })
-
-    # sort by similarity score in descending order
-    best_matches.sort(key=lambda x: x['similarity_score'], reverse=True)
-    return best_matches
+    return _collect_best_matches(id, words, keyword, key_length, scores, threshold, context_words)
 
 
 def search_df_for_best_matches(input_df: pd.DataFrame,
@@ -77,47 +154,70 @@ def search_df_for_best_matches(input_df: pd.DataFrame,
                                text_column_name: str,
                                keyword: str,
                                threshold: int = 70,
-                               context_words: int = 3) -> pd.DataFrame | None:
+                               context_words: int = 3,
+                               workers: int = 1,
+                               page_offsets_column_name: str = None) -> pd.DataFrame | None:
     """
     Function that searches df for best matches.
 
     This function iterates through the input_df, uses the id and content columns to search for the given keyword.
-    If multiple matches are found, they are aggregated into one cell (using ';;; ' as separator).
+    If multiple matches are found, they are aggregated into one cell (using ';;; ' as separator). The phrases of
+    DOCUMENT_BATCH_SIZE documents at a time are scored in one call, see score_phrases.
 
 
     Args:
         input_df: expected to have 2 columns, i.e., 'id' and 'content' (exact naming may differ)
         id_column_name: name of the identifying column (e.g., filename)
-        text_column_name: name of the column holding the relevant text
+        text_column_name: name of the column holding the relevant text; if the df has its cleaned column (see
+            add_cleaned_text), the cleaned texts are used as they are
         keyword: one or multiple word input of interest
         threshold: for similarity search between input and keyword
         context_words: get surrounding context of -x and +x words
+        workers: number of threads used for scoring, -1 for all cores
+        page_offsets_column_name: defaults to None; name of the column holding the page offsets of the texts (e.g.,
+            page_offsets). If given, the output df has a column 'pages' with the page of each match, in the order
+            of the matched phrases, None for texts without page offsets
 
     Returns:
         pd.DataFrame: df holding the best matches per id. If multiple are found,
             they are aggregated into one cell (using ';;; ' as separator).
 
     """
-    # init empty df
-    all_matches = pd.DataFrame()
+    # init empty list of matches
+    best_matches = []
+    key_length = len(keyword.split())
 
-    # extract id and content from input_df; clean content column
-    input_df = input_df[[id_column_name, text_column_name]].copy()
-    input_df.loc[:, text_column_name] = input_df[text_column_name].astype(str).apply(
-        lambda x: clean(x, lowercase=True, dashes=True))
+    # extract id and content from input_df; clean content column unless it is cleaned already
+    cleaned_texts = get_cleaned_texts(input_df, text_column_name)
+    if page_offsets_column_name is None:
+        page_info = [(None, None)] * len(input_df)
+    else:
+        page_info = list(zip(input_df[text_column_name], input_df[page_offsets_column_name]))
+    input_df = pd.DataFrame({id_column_name: input_df[id_column_name],
+                             text_column_name: cleaned_texts})
+
+    rows = list(input_df.itertuples(index=False))
+    for batch_start in range(0, len(rows), DOCUMENT_BATCH_SIZE):
+        batch = rows[batch_start:batch_start + DOCUMENT_BATCH_SIZE]
+
+        # score the phrases of all documents of the batch at once
+        batch_words = [content.split() for _, content in batch]
+        batch_phrases = [_window_phrases(words, key_length) for words in batch_words]
+        scores = score_phrases([phrase for phrases in batch_phrases for phrase in phrases], keyword, threshold,
+                               workers=workers)
 
-    for id, content in input_df.itertuples(index=False):
         # per ID, find best matches + corresponding scores for given keyword
-        best_match = find_best_matches(id=id,
-                                       content=content,
-                                       keyword=keyword,
-                                       threshold=threshold,
-                                       context_words=context_words)
-
-        best_match = pd.DataFrame(best_match)
-
-        # concat to main df, holding best matches for all IDs
-        all_matches = pd.concat([all_matches, best_match], axis=0)
+        offset = 0
+        for (id, content), words, phrases, (text, page_offsets) in zip(
+                batch, batch_words, batch_phrases, page_info[batch_start:batch_start + DOCUMENT_BATCH_SIZE]):
+            word_pages = None if page_offsets_column_name is None else _word_pages(content, text, page_offsets)
+            best_matches += _collect_best_matches(id, words, keyword, key_length,
+                                                  scores[offset:offset + len(phrases)], threshold, context_words,
+                                                  word_pages=word_pages)
+            offset += len(phrases)
+
+    # main df, holding best matches for all IDs
+    all_matches = pd.DataFrame(best_matches)
 
     if len(all_matches) < 1:
         logger.info(f"No matches for '{keyword}' at similarity threshold of {threshold} found.")
@@ -129,6 +229,10 @@ def search_df_for_best_matches(input_df: pd.DataFrame,
                                        columns='keyword',
                                        values='matched_phrase',
                                        aggfunc=lambda x: ' ;;; '.join(x))
+    if page_offsets_column_name is not None:
+        # built from the matches, as the column of all_matches turns the pages into floats if any is None
+        pages = pd.Series([match['page'] for match in best_matches], index=all_matches['id'], dtype=object)
+        wider_df['pages'] = pages.groupby(level=0).agg(list)
 
     return wider_df
 
@@ -161,6 +265,9 @@ def search_best_matches_dict(input_df: pd.DataFrame,
     """
     results = pd.DataFrame()  # store results for each key
 
+    # clean the texts once for all keywords
+    input_df = add_cleaned_text(input_df, text_column_name)
+
     for key, keywords in keyword_dict.items():
 
         combined_df = pd.DataFrame()  # store results for the current key
@@ -223,6 +330,10 @@ def search_df_for_best_matches_keyword_dict(input_df: pd.DataFrame,
                                index=input_df.index
                                )
     all_matches = all_matches.reset_index()
+
+    # clean the texts once for all keywords
+    input_df = add_cleaned_text(input_df, text_column_name)
+
     for main_keyword in keyword_dict:
 
         searchable_keywords = keyword_dict[main_keyword]["keywords"]
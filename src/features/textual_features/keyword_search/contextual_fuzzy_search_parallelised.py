@@ -1,11 +1,21 @@
 import json
 import os
+import sys
 import pandas as pd
 
 from loguru import logger
 from multiprocessing import Process
 
-from contextual_fuzzy_search import search_df_for_best_matches
+# the script is run as a file from src, see 1_execute_pipeline.ipynb, so src is added to the path for the features
+# package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+
+from features.textual_features.document_texts_creation.corpus_store import corpus_columns
+from features.textual_features.document_texts_creation.corpus_store import read_corpus
+from features.textual_features.document_texts_creation.corpus_store import read_partitioned_corpus
+from features.textual_features.document_texts_creation.text_cleaning import add_cleaned_text
+from features.textual_features.document_texts_creation.text_cleaning import cleaned_column_name
+from features.textual_features.keyword_search.contextual_fuzzy_search import search_df_for_best_matches
 
 # specify paths
 BASE_DIR = 'features/textual_features/keyword_search'
@@ -16,11 +26,28 @@ OUTPUT_FOLDER_PATH = "../data/nrw/bplan/features/keywords/fuzzy_search"
 ID_COLUMN = 'filename'
 TEXT_COLUMN = 'content'
 METADATA_COLUMNS = 'metadata'
+# page offsets of the texts, if the corpus has them the matches are reported with their pages
+PAGE_OFFSETS_COLUMN = 'page_offsets'
 THRESHOLD = 80  # for similarity in fuzzy search
 CONTEXT_WORDS = 20  # for no. of words extracted in fuzzy search
-
-input_df = pd.read_json(INPUT_FILE_PATH)
-input_df.columns = [ID_COLUMN,TEXT_COLUMN,METADATA_COLUMNS]
+# only for partitioned corpora, e.g. {'year': range(2000, 2024)} to search the plans since 2000
+PARTITION_FILTERS = None
+
+if os.path.isdir(INPUT_FILE_PATH) or INPUT_FILE_PATH.endswith('.arrow'):
+    # corpus of corpus_store, only the id, text and, if stored, cleaned text and page offsets columns are read
+    search_columns = [column for column in corpus_columns(INPUT_FILE_PATH)
+                      if column in [ID_COLUMN, TEXT_COLUMN, cleaned_column_name(TEXT_COLUMN), PAGE_OFFSETS_COLUMN]]
+    if os.path.isdir(INPUT_FILE_PATH):
+        # partitioned corpus, only the partitions matching PARTITION_FILTERS are read
+        input_df = read_partitioned_corpus(INPUT_FILE_PATH, filters=PARTITION_FILTERS, columns=search_columns)
+    else:
+        input_df = read_corpus(INPUT_FILE_PATH, columns=search_columns)
+else:
+    input_df = pd.read_json(INPUT_FILE_PATH)
+    input_df.columns = [ID_COLUMN,TEXT_COLUMN,METADATA_COLUMNS]
+
+# clean the texts once, instead of once per keyword in every process
+input_df = add_cleaned_text(input_df, TEXT_COLUMN)
 
 # define relevant keywords
 with open(os.path.join(BASE_DIR, 'keyword_dict_fuzzy.json')) as f:
@@ -53,7 +80,10 @@ def process_fuzzy_batch(input_df: pd.DataFrame,
                                            text_column_name,
                                            keyword,
                                            threshold,
-                                           context_words)
+                                           context_words,
+                                           page_offsets_column_name=(PAGE_OFFSETS_COLUMN
+                                                                     if PAGE_OFFSETS_COLUMN in input_df.columns
+                                                                     else None))
 
     result_df.to_csv(os.path.join(OUTPUT_FOLDER_PATH, keyword + ".csv"), header=True)
 
@@ -1,72 +1,64 @@
 import pandas as pd
-import re
 
-from unstructured.cleaners.core import clean
+from data_pipeline.pdf_scraper.page_index import page_number_at
+from features.textual_features.document_texts_creation.text_cleaning import get_cleaned_texts
+from features.textual_features.keyword_search.keyword_automaton import KeywordAutomaton
 
 
 def search_text_for_keywords(text: str,
-                            keyword_dict: dict) -> dict:
+                            keyword_dict: dict,
+                            window: int = None,
+                            ordered: bool = False) -> dict:
     """ Function to find one-word or multiple-word keywords in input text.
 
     This function is used to search for keywords in a text. It takes as input a text and a dictionary with keywords
     and returns a dictionary with the keywords found in the text. it is case-insensitive and uses substring matching.
+    To search many texts for the same keywords, build a KeywordAutomaton once and use its search method instead.
+
+    By default, the words of a multiple-word keyword may occur anywhere in the text. With window, they have to occur
+    within window words of each other, which avoids false positives on long plans; KeywordAutomaton.find_spans returns
+    where they occur.
 
     Args:
         text: Input string to be searched for keywords
         keyword_dict: Dictionary listing relevant keyword values per key
+        window: defaults to None; maximal number of words covered by the words of a multiple-word keyword
+        ordered: defaults to False; if True, the words of a multiple-word keyword have to occur in their order
 
     Returns:
         result: Dictionary with found keywords per input
 
     """
-    words = re.findall(r'\w+', text.lower())
-    
-    # init empty dict
-    result = {}
-
-    # iterate over dictionary to get key-value pairs
-    for key, keywords in keyword_dict.items():
-        found_keywords = []
-
-        # iterate over values (as there may be multiple per key)
-        for keyword in keywords:
-            # if one keyword consists of multiple words, split them
-            if " " in keyword:
-                combined_words = keyword.split()
-                # search for keywords
-                if all(combined_word.lower() in words for combined_word in combined_words):
-                    found_keywords.append(keyword)
-            else:
-                # search for keywords
-                if any(keyword.lower() in word for word in words):
-                    found_keywords.append(keyword)
-        
-        # store found keywords
-        if found_keywords:
-            result[key] = found_keywords
-        # assign None if no keywords were found
-        else:
-            result[key] = None
-        
-    return result
+    return KeywordAutomaton(keyword_dict, window=window, ordered=ordered).search(text)
 
 
 def search_df_for_keywords(input_df: pd.DataFrame,
                            id_column_name: str,
                            text_column_name: str,
                            keyword_dict: dict,
-                           boolean: bool = False) -> pd.DataFrame:
+                           boolean: bool = False,
+                           window: int = None,
+                           ordered: bool = False,
+                           page_offsets_column_name: str = None) -> pd.DataFrame:
     """ Function to process columns row by row, checking for all entries from keyword dict.
 
     This function is used to search for keywords in a df. It takes as input a df and a dictionary with keywords
-    and returns a df with the keywords found in the text. It leverages the search_text_for_keywords function.
+    and returns a df with the keywords found in the text. The keywords are compiled once into a KeywordAutomaton,
+    which finds all keywords of a text in a single pass over its words.
 
     Args:
         input_df: Input df to be searched for keywords
         id_column_name: Name of the identifying column (e.g., filename)
-        text_column_name: Name of the column in the input df holding the relevant text
+        text_column_name: Name of the column in the input df holding the relevant text; if the df has its cleaned
+            column (see add_cleaned_text), the cleaned texts are used as they are
         keyword_dict: Dict of relevant keywords
         boolean: defaults to False; if True, df is returned with booleans instead of strings
+        window: defaults to None; maximal number of words covered by the words of a multiple-word keyword, see
+            search_text_for_keywords
+        ordered: defaults to False; if True, the words of a multiple-word keyword have to occur in their order
+        page_offsets_column_name: defaults to None; name of the column holding the page offsets of the texts (e.g.,
+            page_offsets). If given, the output df has a column 'pages' with the sorted numbers of the pages the
+            keywords of each found key occur on, None for texts without page offsets
 
     Returns:
         df: Output df holds found keywords per key (column) and id (row)
@@ -74,17 +66,24 @@ def search_df_for_keywords(input_df: pd.DataFrame,
     """
     id_column = []
     result_data = []
+    pages_column = []
+
+    keyword_automaton = KeywordAutomaton(keyword_dict, window=window, ordered=ordered)
+    if page_offsets_column_name is not None:
+        # the spans are offsets into the original texts, which the page offsets refer to
+        for text, page_offsets in zip(input_df[text_column_name], input_df[page_offsets_column_name]):
+            pages_column.append(_pages_of_keywords(keyword_automaton, text, page_offsets))
 
-    # extract id and content from input_df; clean content column
-    input_df = input_df[[id_column_name, text_column_name]].copy()
-    input_df[text_column_name] = input_df[text_column_name].astype(str).apply(lambda x: clean(x, lowercase=True, dashes=True))
+    # extract id and content from input_df; clean content column unless it is cleaned already
+    input_df = pd.DataFrame({id_column_name: input_df[id_column_name],
+                             text_column_name: get_cleaned_texts(input_df, text_column_name)})
 
     # iterate over df and find keywords
     for id, content in input_df.itertuples(index=False):
         # store id per row
         id_column.append(id)
         # find keywords per row
-        keyword_presence = search_text_for_keywords(content, keyword_dict)
+        keyword_presence = keyword_automaton.search(content)
         result_data.append(keyword_presence)
     
     # convert to df
@@ -93,8 +92,21 @@ def search_df_for_keywords(input_df: pd.DataFrame,
 
     if boolean:
         # preserve id column; convert + concatenate boolean columns
-        boolean_df = result_df.iloc[:, 1:len(result_df)+1].notna()
+        boolean_df = result_df.iloc[:, 1:].notna()
         result_df = pd.concat([result_df.iloc[:, 0], boolean_df], axis = 1)
 
+    if page_offsets_column_name is not None:
+        result_df['pages'] = pages_column
+
     return result_df
 
+
+def _pages_of_keywords(keyword_automaton: KeywordAutomaton,
+                       text: str,
+                       page_offsets: list) -> dict | None:
+    """ Return the sorted numbers of the pages the keywords of each found key start on."""
+    if not isinstance(text, str) or not pd.api.types.is_list_like(page_offsets) or len(page_offsets) == 0:
+        return None
+    return {key: sorted({page_number_at(page_offsets, start) for _, start, _ in spans})
+            for key, spans in keyword_automaton.find_spans(text).items() if spans}
+
@@ -0,0 +1,279 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pandas as pd
+from tqdm import tqdm
+
+from features.textual_features.document_texts_creation.text_cleaning import clean_text
+from features.textual_features.keyword_search.keyword_automaton import proximity_spans
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list:
+    """ Split text into the words the keyword search works on: cleaned, which lowercases it, and split at non-word
+    characters."""
+    return _WORD.findall(clean_text(text))
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class InvertedIndex:
+    """ Persistent inverted index of a corpus, mapping each word to the documents and positions it occurs at.
+
+    The index is a SQLite database built from the cleaned texts, see tokenize. Documents are added incrementally:
+    unchanged documents are skipped and changed ones re-indexed, so the index is kept up to date by adding the
+    documents of every new download. Keyword queries are then answered by index lookups instead of scanning and
+    cleaning every document again. All methods are thread-safe.
+
+    Args:
+        path: path to the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id INTEGER PRIMARY KEY,
+                    document TEXT NOT NULL UNIQUE,
+                    content_hash TEXT NOT NULL,
+                    n_words INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS terms (
+                    term_id INTEGER PRIMARY KEY,
+                    term TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term_id INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    positions BLOB NOT NULL,
+                    PRIMARY KEY (term_id, doc_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_by_document ON postings (doc_id);
+            """)
+        self._term_ids = dict(self._connection.execute("SELECT term, term_id FROM terms"))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def documents(self) -> list:
+        """ Return the ids of the indexed documents in the order they were added."""
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT document FROM documents ORDER BY doc_id")]
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = self._connection.execute("INSERT INTO terms (term) VALUES (?)", (term,)).lastrowid
+            self._term_ids[term] = term_id
+        return term_id
+
+    @contextmanager
+    def _reload_terms_on_error(self):
+        """ Reload the term ids if a transaction fails, as the terms it inserted are rolled back."""
+        try:
+            yield
+        except Exception:
+            self._term_ids = dict(self._connection.execute("SELECT term, term_id FROM terms"))
+            raise
+
+    def _remove(self, doc_id: int):
+        self._connection.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        self._connection.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def add_documents(self,
+                      input_df: pd.DataFrame,
+                      id_column_name: str = 'filename',
+                      text_column_name: str = 'content') -> int:
+        """ Index the documents of input_df, skipping those that are indexed with the same text already.
+
+        Args:
+            input_df: df with one row per document
+            id_column_name: name of the identifying column (e.g., filename)
+            text_column_name: name of the column holding the text
+
+        Returns:
+            int: number of newly indexed or re-indexed documents
+        """
+        with self._lock:
+            indexed_hashes = dict(self._connection.execute("SELECT document, content_hash FROM documents"))
+
+        n_indexed = 0
+        for document, text in tqdm(input_df[[id_column_name, text_column_name]].itertuples(index=False),
+                                   total=len(input_df), desc="Indexing documents"):
+            text = text if isinstance(text, str) else ""
+            content_hash = _content_hash(text)
+            if indexed_hashes.get(document) == content_hash:
+                continue
+
+            positions = defaultdict(list)
+            words = tokenize(text)
+            for position, word in enumerate(words):
+                positions[word].append(position)
+
+            with self._lock, self._connection, self._reload_terms_on_error():
+                old_doc_id = self._connection.execute("SELECT doc_id FROM documents WHERE document = ?",
+                                                      (document,)).fetchone()
+                if old_doc_id is not None:
+                    self._remove(old_doc_id[0])
+                doc_id = self._connection.execute("INSERT INTO documents (document, content_hash, n_words) "
+                                                  "VALUES (?, ?, ?)", (document, content_hash, len(words))).lastrowid
+                self._connection.executemany("INSERT INTO postings (term_id, doc_id, positions) VALUES (?, ?, ?)",
+                                             [(self._term_id(word), doc_id, array('I', word_positions).tobytes())
+                                              for word, word_positions in positions.items()])
+            indexed_hashes[document] = content_hash
+            n_indexed += 1
+
+        return n_indexed
+
+    def remove_documents(self, documents: list):
+        """ Remove the documents with the given ids from the index."""
+        with self._lock, self._connection:
+            for document in documents:
+                doc_id = self._connection.execute("SELECT doc_id FROM documents WHERE document = ?",
+                                                  (document,)).fetchone()
+                if doc_id is not None:
+                    self._remove(doc_id[0])
+
+    def _postings(self, term: str) -> dict:
+        """ Return the positions of term per doc_id."""
+        with self._lock:
+            # the term ids are changed by add_documents while it holds the lock
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                return {}
+            rows = self._connection.execute("SELECT doc_id, positions FROM postings WHERE term_id = ?", (term_id,))
+            return {doc_id: array('I', positions) for doc_id, positions in rows}
+
+    def _doc_ids_to_documents(self, doc_ids) -> set:
+        with self._lock:
+            documents = dict(self._connection.execute("SELECT doc_id, document FROM documents"))
+        return {documents[doc_id] for doc_id in doc_ids}
+
+    def _doc_ids_with_word(self, word: str) -> set:
+        return set(self._postings(word))
+
+    def _doc_ids_with_substring(self, substring: str) -> set:
+        with self._lock:
+            rows = self._connection.execute("SELECT DISTINCT p.doc_id FROM terms t JOIN postings p "
+                                            "ON p.term_id = t.term_id WHERE instr(t.term, ?) > 0", (substring,))
+            return {row[0] for row in rows}
+
+    def _doc_ids_with_all_words(self, words: list) -> set:
+        doc_ids = None
+        for word in words:
+            word_doc_ids = self._doc_ids_with_word(word)
+            doc_ids = word_doc_ids if doc_ids is None else doc_ids & word_doc_ids
+            if not doc_ids:
+                return set()
+        return doc_ids
+
+    def _doc_ids_with_phrase(self, words: list) -> set:
+        if not words:
+            return set()
+        postings = [self._postings(word) for word in words]
+
+        doc_ids = set()
+        for doc_id in set.intersection(*(set(word_postings) for word_postings in postings)):
+            # positions at which the phrase starts, i.e. where the n-th word follows n positions later
+            starts = set(postings[0][doc_id])
+            for offset, word_postings in enumerate(postings[1:], start=1):
+                starts &= {position - offset for position in word_postings[doc_id]}
+            if starts:
+                doc_ids.add(doc_id)
+        return doc_ids
+
+    def search_word(self, word: str) -> set:
+        """ Return the documents containing word as a whole word."""
+        return self._doc_ids_to_documents(self._doc_ids_with_word(word.lower()))
+
+    def search_substring(self, substring: str) -> set:
+        """ Return the documents containing a word of which substring is a part."""
+        return self._doc_ids_to_documents(self._doc_ids_with_substring(substring.lower()))
+
+    def search_phrase(self, phrase: str) -> set:
+        """ Return the documents containing the words of phrase next to each other and in this order."""
+        return self._doc_ids_to_documents(self._doc_ids_with_phrase(tokenize(phrase)))
+
+    def _doc_ids_near(self, words: list, window: int, ordered: bool) -> set:
+        """ Documents containing all words within window words of each other, see proximity_spans."""
+        if not words:
+            return set()
+        postings = [self._postings(word) for word in words]
+        doc_ids = set.intersection(*(set(word_postings) for word_postings in postings))
+        return {doc_id for doc_id in doc_ids
+                if proximity_spans([word_postings[doc_id] for word_postings in postings], window=window,
+                                   ordered=ordered)}
+
+    def _doc_ids_with_keyword(self,
+                              keyword: str,
+                              window: int = None,
+                              ordered: bool = False) -> set:
+        """ Documents found by the exact keyword search, see KeywordAutomaton."""
+        if " " not in keyword:
+            return self._doc_ids_with_substring(keyword.lower())
+        words = [part.lower() for part in keyword.split()]
+        if window is None and not ordered:
+            return self._doc_ids_with_all_words(words)
+        return self._doc_ids_near(words, window, ordered)
+
+    def search_near(self,
+                    words: str,
+                    window: int,
+                    ordered: bool = False) -> set:
+        """ Return the documents containing the words of words within window words of each other."""
+        return self._doc_ids_to_documents(self._doc_ids_near(tokenize(words), window, ordered))
+
+    def search_keywords(self,
+                        keyword_dict: dict,
+                        id_column_name: str = 'filename',
+                        boolean: bool = False,
+                        window: int = None,
+                        ordered: bool = False) -> pd.DataFrame:
+        """ Search the indexed documents for the keywords of keyword_dict, like search_df_for_keywords.
+
+        Args:
+            keyword_dict: Dict of relevant keywords
+            id_column_name: name of the id column of the result
+            boolean: defaults to False; if True, df is returned with booleans instead of strings
+            window: defaults to None; maximal number of words covered by the words of a multiple-word keyword
+            ordered: defaults to False; if True, the words of a multiple-word keyword have to occur in their order
+
+        Returns:
+            df: Output df holds found keywords per key (column) and id (row), in the order the documents were added
+        """
+        keyword_doc_ids = {keyword: self._doc_ids_with_keyword(keyword, window, ordered)
+                           for keywords in keyword_dict.values() for keyword in keywords}
+        with self._lock:
+            doc_ids = list(self._connection.execute("SELECT doc_id, document FROM documents ORDER BY doc_id"))
+
+        result_df = pd.DataFrame([{key: [keyword for keyword in keywords if doc_id in keyword_doc_ids[keyword]] or None
+                                   for key, keywords in keyword_dict.items()} for doc_id, _ in doc_ids],
+                                 columns=list(keyword_dict))
+        result_df.insert(0, id_column_name, [document for _, document in doc_ids])
+
+        if boolean:
+            result_df[list(keyword_dict)] = result_df[list(keyword_dict)].notna()
+        return result_df
+
+    def close(self):
+        """ Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
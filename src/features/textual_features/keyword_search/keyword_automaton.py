@@ -0,0 +1,257 @@
+import heapq
+import re
+from collections import defaultdict
+from collections import deque
+
+# number of distinct words whose matches are memoized before the memo is cleared
+TOKEN_MEMO_SIZE = 1_000_000
+
+_WORD = re.compile(r'\w+')
+
+
+def _build_automaton(patterns: list) -> tuple:
+    """ Build the Aho-Corasick automaton of the non-empty patterns.
+
+    Returns:
+        tuple: goto transitions per state, failure link per state and the indices of the patterns ending in each
+            state, including those reached via failure links
+    """
+    goto = [{}]
+    outputs = [set()]
+    for index, pattern in enumerate(patterns):
+        state = 0
+        for char in pattern:
+            if char not in goto[state]:
+                goto.append({})
+                outputs.append(set())
+                goto[state][char] = len(goto) - 1
+            state = goto[state][char]
+        outputs[state].add(index)
+
+    # breadth-first, so the failure link of a state always points to an already completed state
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+            outputs[next_state] |= outputs[fail[next_state]]
+            queue.append(next_state)
+
+    return goto, fail, [frozenset(output) for output in outputs]
+
+
+def _ordered_spans(occurrences: list) -> list:
+    """ Earliest completion of the keyword for each occurrence of its first word, the pointers only move forward."""
+    spans = []
+    pointers = [0] * len(occurrences)
+    for first in occurrences[0]:
+        last = first
+        for word_index in range(1, len(occurrences)):
+            word_occurrences = occurrences[word_index]
+            while pointers[word_index] < len(word_occurrences) and word_occurrences[pointers[word_index]] <= last:
+                pointers[word_index] += 1
+            if pointers[word_index] == len(word_occurrences):
+                return spans
+            last = word_occurrences[pointers[word_index]]
+
+        # a later first word with the same last word is the tighter span
+        if spans and spans[-1][1] == last:
+            spans.pop()
+        spans.append((first, last))
+    return spans
+
+
+def _unordered_spans(occurrences: list) -> list:
+    """ Minimal windows over the merged occurrences that contain every word as often as the keyword does."""
+    # words repeated in the keyword have the same occurrences
+    words = list(dict.fromkeys(tuple(word_occurrences) for word_occurrences in occurrences))
+    required = [occurrences.count(list(word)) for word in words]
+    events = list(heapq.merge(*([(position, word_index) for position in word] for word_index, word in enumerate(words))))
+
+    spans = []
+    counts = [0] * len(words)
+    n_missing = len(words)
+    left = 0
+    for position, word_index in events:
+        counts[word_index] += 1
+        if counts[word_index] == required[word_index]:
+            n_missing -= 1
+        # shrink the window from the left until a word is missing again, the last window before is minimal
+        while n_missing == 0:
+            left_position, left_word_index = events[left]
+            if counts[left_word_index] == required[left_word_index]:
+                spans.append((left_position, position))
+                n_missing += 1
+            counts[left_word_index] -= 1
+            left += 1
+    return spans
+
+
+def proximity_spans(occurrences: list,
+                    window: int = None,
+                    ordered: bool = False) -> list:
+    """ Find the spans in which all words of a multi-word keyword occur close to each other.
+
+    The spans are found in a single pass over the merged occurrences, i.e. in time linear in the number of
+    occurrences of the words rather than the length of the text.
+
+    Args:
+        occurrences: sorted token positions of each word of the keyword, in the order of the words in the keyword
+        window: maximal number of tokens a span may cover, from its first to its last word; if None, any distance
+        ordered: if True, the words have to occur in the order of the keyword
+
+    Returns:
+        list: sorted (first, last) token positions of the minimal spans containing all words
+    """
+    if not occurrences or not all(occurrences):
+        return []
+
+    occurrences = [list(word_occurrences) for word_occurrences in occurrences]
+    spans = _ordered_spans(occurrences) if ordered else _unordered_spans(occurrences)
+    return [span for span in spans if window is None or span[1] - span[0] + 1 <= window]
+
+
+class KeywordAutomaton:
+    """ Multi-pattern matcher for all keywords of a keyword_dict, built once and used for every document.
+
+    The semantics are those of the keyword search: a keyword without spaces is found if it is a substring of a word of
+    the lowercased text, a keyword with spaces if each of its parts is a word of the text. All single-word keywords
+    are matched at once by an Aho-Corasick automaton. As they can only match within a word, the automaton runs over
+    each distinct word of a document rather than the whole text, and its matches are memoized per word, so words
+    recurring across the corpus are matched only once.
+
+    With window, the words of a multi-word keyword additionally have to occur within window tokens of each other,
+    and with ordered in the order of the keyword. They are matched on the token positions of the document, see
+    proximity_spans.
+
+    Args:
+        keyword_dict: dictionary listing relevant keyword values per key
+        window: maximal number of tokens covered by the words of a multi-word keyword; if None, any distance
+        ordered: if True, the words of a multi-word keyword have to occur in the order of the keyword
+    """
+
+    def __init__(self,
+                 keyword_dict: dict,
+                 window: int = None,
+                 ordered: bool = False):
+        self.keyword_dict = keyword_dict
+        self.window = window
+        self.ordered = ordered
+
+        self._patterns = sorted({keyword.lower() for keywords in keyword_dict.values() for keyword in keywords
+                                 if keyword and " " not in keyword})
+        self._goto, self._fail, self._outputs = _build_automaton(self._patterns)
+        self._token_memo = {}
+
+    def _match_token(self, token: str) -> frozenset:
+        """ Return the indices of the patterns that are substrings of token."""
+        matches = self._token_memo.get(token)
+        if matches is not None:
+            return matches
+
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        matches = set()
+        state = 0
+        for char in token:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            matches |= outputs[state]
+
+        if len(self._token_memo) >= TOKEN_MEMO_SIZE:
+            self._token_memo.clear()
+        matches = self._token_memo[token] = frozenset(matches)
+        return matches
+
+    def _find_substrings(self, words: set) -> set:
+        """ Return the single-word keywords (lowercased) that are substrings of any of words."""
+        found = set()
+        for word in words:
+            found |= self._match_token(word)
+        found_substrings = {self._patterns[index] for index in found}
+        # the empty keyword is a substring of any word
+        if words:
+            found_substrings.add("")
+        return found_substrings
+
+    def _substring_positions(self, positions: dict) -> dict:
+        """ Return the positions of the words each single-word keyword (lowercased) is a substring of."""
+        substring_positions = defaultdict(list)
+        for word, word_positions in positions.items():
+            for index in self._match_token(word):
+                substring_positions[self._patterns[index]] += word_positions
+            substring_positions[""] += word_positions
+        return {substring: sorted(word_positions) for substring, word_positions in substring_positions.items()}
+
+    def _multi_word_spans(self, keyword: str, positions: dict) -> list:
+        return proximity_spans([positions.get(part.lower(), []) for part in keyword.split()],
+                               window=self.window, ordered=self.ordered)
+
+    def search(self, text: str) -> dict:
+        """ Find the keywords in text.
+
+        Args:
+            text: Input string to be searched for keywords
+
+        Returns:
+            result: Dictionary with the found keywords per key, None for keys without found keywords
+        """
+        if self.window is not None or self.ordered:
+            spans = self.find_spans(text)
+            result = {}
+            for key, keywords in self.keyword_dict.items():
+                found = {keyword for keyword, _, _ in spans[key] or []}
+                result[key] = [keyword for keyword in keywords if keyword in found] or None
+            return result
+
+        words = set(_WORD.findall(text.lower()))
+        found_substrings = self._find_substrings(words)
+
+        result = {}
+        for key, keywords in self.keyword_dict.items():
+            found_keywords = [keyword for keyword in keywords
+                              if (all(part.lower() in words for part in keyword.split()) if " " in keyword
+                                  else keyword.lower() in found_substrings)]
+            result[key] = found_keywords or None
+
+        return result
+
+    def find_spans(self, text: str) -> dict:
+        """ Find the keywords in text together with where they occur.
+
+        The spans are character offsets into text.lower(), which has the same offsets as text for German texts, so
+        the context of a match can be sliced directly, e.g. text[start - 200:end + 200], and its page looked up with
+        page_index.page_number_at, see search_df_for_keywords. A single-word keyword spans
+        each word it is part of, a multi-word keyword each minimal stretch of text containing all of its words.
+
+        Args:
+            text: Input string to be searched for keywords
+
+        Returns:
+            result: Dictionary with a list of (keyword, start, end) per key in the order of the keywords, None for
+                keys without found keywords
+        """
+        word_matches = list(_WORD.finditer(text.lower()))
+        positions = defaultdict(list)
+        for position, word_match in enumerate(word_matches):
+            positions[word_match.group()].append(position)
+
+        substring_positions = self._substring_positions(positions)
+
+        result = {}
+        for key, keywords in self.keyword_dict.items():
+            key_spans = []
+            for keyword in keywords:
+                if " " in keyword:
+                    token_spans = self._multi_word_spans(keyword, positions)
+                else:
+                    token_spans = [(position, position) for position in substring_positions.get(keyword.lower(), [])]
+                key_spans += [(keyword, word_matches[first].start(), word_matches[last].end())
+                              for first, last in token_spans]
+            result[key] = key_spans or None
+
+        return result
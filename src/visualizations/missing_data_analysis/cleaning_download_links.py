@@ -2,6 +2,10 @@ import os
 
 import pandas as pd
 
+from data_pipeline.nrw_pdf_downloader.download_manifest import MANIFEST_FILE_NAME
+from data_pipeline.nrw_pdf_downloader.download_manifest import DownloadManifest
+from data_pipeline.nrw_pdf_downloader.failure_journal import latest_failures
+from data_pipeline.nrw_pdf_downloader.failure_journal import read_failure_journal
 from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import filtering_useful_data
 
 
@@ -26,6 +30,48 @@ def clean_processing_errors(scraped_bp_errors):
     return scraped_bp_errors
 
 
+def get_objectids_downloaded(pdf_folder_path):
+    """ Returns the objectids the download manifest of pdf_folder_path records as downloaded.
+
+    With deduplicate=True, run_pdf_downloader stores the PDFs by content hash, so the manifest is the only record of
+    which objectids were downloaded.
+
+    Args:
+        pdf_folder_path (str): path to the folder where the PDFs are saved
+
+    Returns:
+        set: objectids of the downloaded PDFs, empty if the folder has no manifest
+    """
+    if not os.path.exists(os.path.join(pdf_folder_path, MANIFEST_FILE_NAME)):
+        return set()
+
+    manifest = DownloadManifest.for_folder(pdf_folder_path)
+    try:
+        return set(manifest.hash_mapping()["objectid"])
+    finally:
+        manifest.close()
+
+
+def read_errors_from_failure_journal(journal_path):
+    """ Reads the failed downloads from the failure journal written by run_pdf_downloader.
+
+    The journal only records failures, so links that were downloaded by a later retry or run are dropped according
+    to the download manifest in the same folder, like in retry_failed_downloads.
+
+    Args:
+        journal_path (str): path to the failure_journal.csv in the pdf folder
+
+    Returns:
+        pd.DataFrame: DataFrame with the last failure per link that is still missing, with the columns "objectid",
+            "scanurl", "reason", "http_status", "attempt" and "transient"
+    """
+    failures_df = latest_failures(read_failure_journal(journal_path))
+    downloaded_ids = get_objectids_downloaded(os.path.dirname(journal_path))
+    failures_df = failures_df[~failures_df["objectid"].isin(downloaded_ids)]
+
+    return failures_df[["objectid", "scanurl", "reason", "http_status", "attempt", "transient"]]
+
+
 def cleaning_processing_links(bp_links):
     """ Processes and cleans the links to the PDFs.
 
@@ -82,7 +128,8 @@ def format_merged_errors(bp_links_with_errors, pdf_folder_path):
             "scanurl" and "objectid" and "download_status"
 
   """
-    files = get_pdfs_downloaded(pdf_folder_path)
+    # pdfs stored under their objectid and, for deduplicated downloads, the objectids in the download manifest
+    files = set(get_pdfs_downloaded(pdf_folder_path)) | get_objectids_downloaded(pdf_folder_path)
 
     # Set them as downloaded
 
@@ -115,9 +162,23 @@ def generate_clean_links(bp_links, scraped_bp_errors, pdf_folder_path):
 def export_processed_links(pdf_folder_path="../data/nrw/bplan/raw/pdfs/",
                            links_path='../data/nrw/bplan/raw/links/NRW_BP_parsed_links.csv',
                            errors_path='../data/nrw/bplan/raw/links/error_links.csv',
-                           output_path='../data/nrw/bplan/raw/links/success_links.csv'):
+                           output_path='../data/nrw/bplan/raw/links/success_links.csv',
+                           journal_path=None):
+    """ Merges the links with the download errors and writes the result to output_path.
+
+    Args:
+        pdf_folder_path (str): path to the folder where the PDFs are saved
+        links_path (str): path to the parsed links csv
+        errors_path (str): path to the error_links.csv, only used if journal_path is None
+        output_path (str): path to the output csv
+        journal_path (str): path to the failure_journal.csv of the pdf folder. If given, the errors are read from
+            the journal, including the reason, HTTP status and attempt count of the last failure per link.
+    """
     bp_links = pd.read_csv(links_path)
-    scraped_bp_errors = pd.read_csv(errors_path)
+    if journal_path is not None:
+        scraped_bp_errors = read_errors_from_failure_journal(journal_path)
+    else:
+        scraped_bp_errors = pd.read_csv(errors_path)
 
     final_data = generate_clean_links(bp_links, scraped_bp_errors, pdf_folder_path)
 
@@ -0,0 +1,77 @@
+import random
+
+import pandas as pd
+from thefuzz import fuzz
+
+from data_pipeline.pdf_scraper.page_index import join_pages
+
+from features.textual_features.keyword_search.contextual_fuzzy_search import find_best_matches
+from features.textual_features.keyword_search.contextual_fuzzy_search import score_phrases
+from features.textual_features.keyword_search.contextual_fuzzy_search import search_df_for_best_matches
+
+VOCABULARY = ["hochwasser", "hochwaser", "überschwemmungsgebiet", "überschwemmung", "gebiet", "wohngebiet",
+              "festgesetzt", "bebauungsplan", "nr.", "12", "hq100", "hq", "extrem", "wasserereignis", "a"]
+
+
+def _find_best_matches_one_by_one(id, content, keyword, threshold, context_words):
+    """ The fuzzy search before batched scoring, which called fuzz.ratio once per phrase."""
+    words = content.split()
+    key_length = len(keyword.split())
+    best_matches = []
+    for i in range(0, len(words) + 1, key_length):
+        similarity_score = fuzz.ratio(" ".join(words[i:i + key_length]), keyword)
+        if similarity_score > threshold:
+            best_matches.append({'id': id,
+                                 'keyword': keyword,
+                                 'matched_phrase': " ".join(words[max(0, i - context_words):
+                                                                  min(len(words), i + context_words + key_length)]),
+                                 'similarity_score': similarity_score})
+    best_matches.sort(key=lambda x: x['similarity_score'], reverse=True)
+    return best_matches
+
+
+def test_score_phrases_rounds_like_fuzz_ratio():
+    phrases = ["hochwaser", "hochwasser", "hq", "", "überschwemmungsgebiet", "abcd"]
+    keyword = "hochwasser"
+
+    # below the threshold scores are cut off, above it they equal fuzz.ratio
+    assert [score for score in score_phrases(phrases, keyword, threshold=0)] == \
+           [fuzz.ratio(phrase, keyword) for phrase in phrases]
+    assert list(score_phrases(phrases, keyword, threshold=90)) == [95, 100, 0, 0, 0, 0]
+    # ratios of 62.5 and 37.5 are rounded half to even like fuzz.ratio does
+    assert score_phrases(["abcdexyz"], "abcdefgh", threshold=0)[0] == fuzz.ratio("abcdexyz", "abcdefgh") == 62
+    assert score_phrases(["abcyyyyy"], "abcxxxxx", threshold=0)[0] == fuzz.ratio("abcyyyyy", "abcxxxxx") == 38
+    # the threshold is exclusive
+    assert find_best_matches("1.pdf", "abcdexyz", "abcdefgh", threshold=62, context_words=1) == []
+
+
+def test_batched_fuzzy_search_matches_scoring_one_by_one():
+    random.seed(912)
+    contents = [" ".join(random.choices(VOCABULARY, k=random.randint(0, 60))) for _ in range(150)]
+
+    for keyword in ["hochwasser", "überschwemmung gebiet", "extrem wasserereignis hq100"]:
+        for threshold in [50, 80, 88]:
+            for index, content in enumerate(contents[:30]):
+                assert find_best_matches(index, content, keyword, threshold, 3) == \
+                       _find_best_matches_one_by_one(index, content, keyword, threshold, 3)
+
+        input_df = pd.DataFrame({"filename": range(len(contents)), "content": contents})
+        expected = pd.DataFrame([match for index, content in enumerate(contents)
+                                 for match in _find_best_matches_one_by_one(index, content, keyword, 80, 3)])
+        expected = expected.pivot_table(index='id', columns='keyword', values='matched_phrase',
+                                        aggfunc=lambda x: ' ;;; '.join(x))
+        pd.testing.assert_frame_equal(search_df_for_best_matches(input_df, "filename", "content", keyword, 80, 3),
+                                      expected)
+
+
+def test_fuzzy_search_reports_pages():
+    content, page_offsets = join_pages(["Bebauungsplan Nr. 12", "- Hochwaser im Gebiet", "Kein HOCHWASSER"])
+    input_df = pd.DataFrame({"filename": ["1.pdf", "2.pdf"],
+                             "content": [content, "hochwasser"],
+                             "page_offsets": [page_offsets, None]})
+
+    result_df = search_df_for_best_matches(input_df, "filename", "content", "hochwasser", 80, 1,
+                                           page_offsets_column_name="page_offsets")
+
+    assert result_df.loc["1.pdf", "hochwasser"] == "kein hochwasser ;;; 12 hochwaser im"
+    assert result_df["pages"].tolist() == [[3, 2], [None]]
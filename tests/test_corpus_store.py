@@ -0,0 +1,141 @@
+import os
+import tempfile
+
+import pandas as pd
+
+from features.textual_features.document_texts_creation.corpus_store import CorpusReader
+from features.textual_features.document_texts_creation.corpus_store import read_corpus
+from features.textual_features.document_texts_creation.corpus_store import read_partitioned_corpus
+from features.textual_features.document_texts_creation.corpus_store import write_corpus
+from features.textual_features.document_texts_creation.corpus_store import write_partitioned_corpus
+from features.textual_features.document_texts_creation.create_document_texts import enrich_extracts_with_metadata
+
+
+def _document_df(n):
+    return pd.DataFrame({"filename": [f"{i}.pdf" for i in range(n)],
+                         "content": [f"Bebauungsplan Nr. {i}" for i in range(n)],
+                         "metadata": [{"Content-Type": "application/pdf", "xmpTPg:NPages": str(i)} for i in range(n)]})
+
+
+def test_corpus_store_reads_projection_rows_ids_and_samples():
+    document_df = _document_df(25)
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpus_path = os.path.join(corpus_dir, "document_texts.arrow")
+        write_corpus(document_df, corpus_path, batch_size=10)
+
+        # the corpus round-trips, including the metadata dicts
+        pd.testing.assert_frame_equal(read_corpus(corpus_path), document_df)
+
+        with CorpusReader(corpus_path) as reader:
+            assert len(reader) == 25
+            assert reader.columns == ["filename", "content", "metadata"]
+
+            assert list(reader.read(columns=["filename"]).columns) == ["filename"]
+            assert reader.read(rows=slice(8, 12))["filename"].tolist() == ["8.pdf", "9.pdf", "10.pdf", "11.pdf"]
+            assert reader.read(ids=["20.pdf", "3.pdf", "missing.pdf"])["content"].tolist() == \
+                   ["Bebauungsplan Nr. 20", "Bebauungsplan Nr. 3"]
+
+            sample_df = reader.read(columns=["filename", "content"], sample_n=5)
+            assert len(sample_df) == 5
+            assert sample_df["filename"].is_unique
+            pd.testing.assert_frame_equal(sample_df, reader.read(columns=["filename", "content"], sample_n=5))
+            assert len(reader.read(sample_frac=0.2)) == 5
+
+
+def test_enrich_extracts_writes_corpus_partitioned_by_kommune_and_year():
+    info_df = pd.DataFrame({"objectid": ["1", "2", "3", "4"],
+                            "name": ["Nord", "Süd", "Ost", "West"],
+                            "scanurl": ["https://example.org/1.pdf"] * 4,
+                            "plantyp": ["1"] * 4,
+                            "kommune": ["Bonn", "Bonn", "Köln", "Mülheim an der Ruhr"],
+                            "datum": ["2004-05-01T00:00:00", "2012-01-01T00:00:00", "2004-07-15T00:00:00", None]})
+    text_df = _document_df(5).drop(columns=["metadata"])
+    text_df["page_offsets"] = [[0, 10 + i] for i in range(5)]
+
+    with tempfile.TemporaryDirectory() as dataset_path:
+        document_texts = enrich_extracts_with_metadata(info_df, text_df, partitioned_corpus_path=dataset_path)
+        assert document_texts["year"].tolist()[1:] == [2004, 2012, 2004, pd.NA]
+
+        assert sorted(os.listdir(os.path.join(dataset_path, "kommune=Bonn"))) == ["year=2004", "year=2012"]
+
+        bonn_df = read_partitioned_corpus(dataset_path, filters={"kommune": "Bonn"})
+        assert bonn_df["filename"].tolist() == ["1.pdf", "2.pdf"]
+        assert bonn_df["year"].tolist() == [2004, 2012]
+        assert bonn_df["page_offsets"].tolist() == [[0, 11], [0, 12]]
+
+        year_df = read_partitioned_corpus(dataset_path, filters={"year": range(2000, 2010)}, columns=["filename"])
+        assert sorted(year_df["filename"]) == ["1.pdf", "3.pdf"]
+
+        # documents without metadata are kept in the default partition
+        assert len(read_partitioned_corpus(dataset_path)) == 5
+        assert len(read_partitioned_corpus(dataset_path, sample_n=2)) == 2
+        assert read_partitioned_corpus(dataset_path, filters={"kommune": "Bonn"}, limit=1)["filename"].tolist() == \
+               ["1.pdf"]
+
+
+def test_compressed_corpus_is_smaller_and_decoded_transparently():
+    boilerplate = "Gemäß § 9 Abs. 1 Nr. 1 BauGB in Verbindung mit § 4 BauNVO wird ein allgemeines Wohngebiet festgesetzt. "
+    document_df = _document_df(1000)
+    document_df["content"] = [boilerplate * 3 + text for text in document_df["content"]]
+    document_df.loc[5, "content"] = None
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        plain_path = os.path.join(corpus_dir, "plain.arrow")
+        compressed_path = os.path.join(corpus_dir, "compressed.arrow")
+        write_corpus(document_df, plain_path)
+        write_corpus(document_df, compressed_path, compress_columns=["content"], dict_size=16 * 1024)
+
+        assert os.path.getsize(compressed_path) < os.path.getsize(plain_path) / 2
+        pd.testing.assert_frame_equal(read_corpus(compressed_path), read_corpus(plain_path))
+        assert read_corpus(compressed_path, ids=["750.pdf"])["content"].tolist() == \
+               [boilerplate * 3 + "Bebauungsplan Nr. 750"]
+
+        document_df["kommune"] = "Bonn"
+        document_df["year"] = 2004
+        dataset_path = os.path.join(corpus_dir, "partitioned")
+        write_partitioned_corpus(document_df, dataset_path, compress_columns=["content"])
+        assert read_partitioned_corpus(dataset_path, columns=["content"])["content"].tolist() == \
+               document_df["content"].tolist()
+
+
+def test_compressed_partitions_of_separate_writes_are_read_together():
+    document_df = _document_df(200)
+    document_df["kommune"] = ["Bonn"] * 100 + ["Köln"] * 100
+    document_df["year"] = 2004
+
+    with tempfile.TemporaryDirectory() as dataset_path:
+        # every write trains its own dictionary
+        write_partitioned_corpus(document_df[:100], dataset_path, compress_columns=["content"], dict_size=1024)
+        write_partitioned_corpus(document_df[100:], dataset_path, compress_columns=["content"], dict_size=1024)
+
+        assert read_partitioned_corpus(dataset_path)["content"].tolist() == document_df["content"].tolist()
+        assert read_partitioned_corpus(dataset_path, filters={"kommune": "Köln"})["content"].tolist() == \
+               document_df["content"][100:].tolist()
+        assert read_partitioned_corpus(dataset_path, limit=150)["content"].tolist() == \
+               document_df["content"][:150].tolist()
+
+        sample_df = read_partitioned_corpus(dataset_path, sample_n=20)
+        assert sample_df["kommune"].nunique() == 2
+        assert (sample_df["content"] == "Bebauungsplan Nr. " + sample_df["filename"].str[:-4]).all()
+
+        assert read_partitioned_corpus(dataset_path, filters={"kommune": "Essen"}, columns=["filename"]).empty
+
+
+def test_partitioned_corpus_keeps_documents_of_earlier_writes():
+    document_df = _document_df(6)
+    document_df["kommune"] = ["Bonn", "Bonn", "Bonn", "Köln", None, None]
+    document_df["year"] = pd.array([2004, 2004, 2004, 2004, None, None], dtype="Int64")
+
+    with tempfile.TemporaryDirectory() as dataset_path:
+        write_partitioned_corpus(document_df.iloc[[0, 3, 4]], dataset_path, compress_columns=["content"])
+        updated_df = document_df.iloc[[0, 1, 2, 5]].copy()
+        updated_df.loc[0, "content"] = "Bebauungsplan Nr. 0, 1. Änderung"
+        write_partitioned_corpus(updated_df, dataset_path, compress_columns=["content"])
+
+        corpus_df = read_partitioned_corpus(dataset_path).set_index("filename")
+
+    assert sorted(corpus_df.index) == ["0.pdf", "1.pdf", "2.pdf", "3.pdf", "4.pdf", "5.pdf"]
+    assert corpus_df.loc["0.pdf", "content"] == "Bebauungsplan Nr. 0, 1. Änderung"
+    assert corpus_df.loc["4.pdf", "metadata"] == document_df.loc[4, "metadata"]
+    assert corpus_df["kommune"].isna().sum() == 2
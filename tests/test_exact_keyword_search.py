@@ -0,0 +1,104 @@
+import json
+import random
+import re
+
+import pandas as pd
+
+from data_pipeline.pdf_scraper.page_index import join_pages
+from features.textual_features.keyword_search.exact_keyword_search import search_df_for_keywords
+from features.textual_features.keyword_search.exact_keyword_search import search_text_for_keywords
+from features.textual_features.keyword_search.keyword_automaton import KeywordAutomaton
+from features.textual_features.keyword_search.keyword_automaton import proximity_spans
+
+KEYWORD_DICT_PATH = "src/features/textual_features/keyword_search/keyword_dict_baunvo.json"
+
+
+def _search_text_for_keywords_by_scanning(text, keyword_dict):
+    """ The keyword search before the automaton, which every keyword compared with every word."""
+    words = re.findall(r'\w+', text.lower())
+    result = {}
+    for key, keywords in keyword_dict.items():
+        found_keywords = [keyword for keyword in keywords
+                          if (all(part.lower() in words for part in keyword.split()) if " " in keyword
+                              else any(keyword.lower() in word for word in words))]
+        result[key] = found_keywords or None
+    return result
+
+
+def test_keyword_automaton_keeps_substring_and_multi_word_semantics():
+    keyword_dict = {"gebiet": ["Wohngebiet", "gebiet", "gewerbe gebiet", "Misch-gebiet"],
+                    "hochwasser": ["hochwasser", "hq100", "überschwemmung gebiet"],
+                    "none": ["nicht vorhanden"]}
+    automaton = KeywordAutomaton(keyword_dict)
+
+    assert automaton.search("Allgemeines WOHNGEBIET; Gebiet für Gewerbe. Hochwasserschutz (HQ100)") == \
+           {"gebiet": ["Wohngebiet", "gebiet", "gewerbe gebiet"], "hochwasser": ["hochwasser", "hq100"],
+            "none": None}
+    # parts of multi-word keywords have to be whole words, hyphenated keywords never match a single word
+    assert automaton.search("Gewerbegebiet, Misch-gebiet") == \
+           {"gebiet": ["gebiet"], "hochwasser": None, "none": None}
+
+
+def test_keyword_automaton_matches_scanning_search_on_random_texts():
+    with open(KEYWORD_DICT_PATH) as keyword_file:
+        keyword_dict = json.load(keyword_file)
+    vocabulary = ([keyword for keywords in keyword_dict.values() for keyword in keywords]
+                  + ["Bebauungsplan", "Gemäß", "§", "Nr.", "festgesetzt", "allgemeines", "Wohngebiet"])
+
+    random.seed(912)
+    automaton = KeywordAutomaton(keyword_dict)
+    for _ in range(200):
+        text = " ".join(random.choices(vocabulary, k=random.randint(0, 30)))
+        assert automaton.search(text) == _search_text_for_keywords_by_scanning(text, keyword_dict)
+        assert search_text_for_keywords(text, keyword_dict) == automaton.search(text)
+
+
+def test_search_df_for_keywords():
+    input_df = pd.DataFrame({"filename": ["1.pdf", "2.pdf"],
+                             "content": ["Reines Wohngebiet nach BauNVO", "Keine Festsetzungen"]})
+
+    result_df = search_df_for_keywords(input_df, "filename", "content", {"wohnen": ["wohngebiet"]}, boolean=True)
+
+    assert result_df.to_dict(orient="list") == {"filename": ["1.pdf", "2.pdf"], "wohnen": [True, False]}
+
+
+def test_search_df_for_keywords_reports_pages():
+    pages = ["Bebauungsplan Nr. 12", "Reines Wohngebiet", "Hochwasser und Mischgebiet"]
+    content, page_offsets = join_pages(pages)
+    input_df = pd.DataFrame({"filename": ["1.pdf", "2.pdf"],
+                             "content": [content, "Wohngebiet"],
+                             "page_offsets": [page_offsets, None]})
+
+    result_df = search_df_for_keywords(input_df, "filename", "content",
+                                       {"gebiet": ["wohngebiet", "mischgebiet"], "hochwasser": ["hochwasser"],
+                                        "none": ["nicht vorhanden"]},
+                                       boolean=True, page_offsets_column_name="page_offsets")
+
+    assert result_df["gebiet"].tolist() == [True, True]
+    assert result_df["pages"].tolist() == [{"gebiet": [2, 3], "hochwasser": [3]}, None]
+
+
+def test_proximity_spans_are_minimal_and_respect_window_and_order():
+    assert proximity_spans([[0, 10], [2, 11]]) == [(0, 2), (2, 10), (10, 11)]
+    assert proximity_spans([[0, 10], [2, 11]], window=3) == [(0, 2), (10, 11)]
+    assert proximity_spans([[5], [1, 9]], ordered=True) == [(5, 9)]
+    assert proximity_spans([[5], [1, 9]], window=5) == [(1, 5), (5, 9)]
+    # a word repeated in the keyword needs as many occurrences
+    assert proximity_spans([[1, 3, 8], [1, 3, 8]], window=3) == [(1, 3)]
+    assert proximity_spans([[4], []]) == []
+
+
+def test_keyword_automaton_finds_multi_word_keywords_within_window():
+    text = "Ein allgemeines Wohngebiet. Kein Hochwasser, aber viel Text dazwischen und am Ende noch ein Gebiet."
+    keyword_dict = {"wohnen": ["allgemeines wohngebiet", "gebiet allgemeines"], "hochwasser": ["hochwasser"]}
+
+    assert search_text_for_keywords(text, keyword_dict) == \
+           {"wohnen": ["allgemeines wohngebiet", "gebiet allgemeines"], "hochwasser": ["hochwasser"]}
+    assert search_text_for_keywords(text, keyword_dict, window=5) == \
+           {"wohnen": ["allgemeines wohngebiet"], "hochwasser": ["hochwasser"]}
+    assert search_text_for_keywords(text, {"wohnen": ["wohngebiet allgemeines"]}, window=5, ordered=True) == \
+           {"wohnen": None}
+
+    spans = KeywordAutomaton(keyword_dict, window=5).find_spans(text)
+    assert [text[start:end] for _, start, end in spans["wohnen"] + spans["hochwasser"]] == \
+           ["allgemeines Wohngebiet", "Hochwasser"]
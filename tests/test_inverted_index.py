@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from features.textual_features.keyword_search.exact_keyword_search import search_df_for_keywords
+from features.textual_features.keyword_search.inverted_index import InvertedIndex
+
+KEYWORD_DICT_PATH = "src/features/textual_features/keyword_search/keyword_dict_hochwasser.json"
+
+
+def _document_df():
+    return pd.DataFrame({"filename": ["1.pdf", "2.pdf", "3.pdf"],
+                         "content": ["Das Plangebiet liegt im Überschwemmungsgebiet eines 100-jährlichen Hochwassers.",
+                                     "Festgesetzt wird ein allgemeines Wohngebiet (WA) gemäß § 4 BauNVO.",
+                                     "Hochwasserschutz: Extrem-Hochwasserereignis und Starkregen."]})
+
+
+def test_inverted_index_answers_keyword_queries_like_search_df_for_keywords():
+    with open(KEYWORD_DICT_PATH) as keyword_file:
+        keyword_dict = json.load(keyword_file)
+    document_df = _document_df()
+
+    with tempfile.TemporaryDirectory() as index_dir, InvertedIndex(os.path.join(index_dir, "index.db")) as index:
+        assert index.add_documents(document_df) == 3
+
+        for boolean in (False, True):
+            pd.testing.assert_frame_equal(index.search_keywords(keyword_dict, boolean=boolean),
+                                          search_df_for_keywords(document_df, "filename", "content", keyword_dict,
+                                                                 boolean=boolean))
+
+        assert index.search_word("wohngebiet") == {"2.pdf"}
+        assert index.search_substring("hochwasser") == {"1.pdf", "3.pdf"}
+        assert index.search_phrase("allgemeines Wohngebiet") == {"2.pdf"}
+        assert index.search_phrase("Wohngebiet allgemeines") == set()
+
+        proximity_keyword_dict = {"hochwasser": ["plangebiet hochwassers", "plangebiet überschwemmungsgebiet"]}
+        pd.testing.assert_frame_equal(index.search_keywords(proximity_keyword_dict, window=5),
+                                      search_df_for_keywords(document_df, "filename", "content",
+                                                             proximity_keyword_dict, window=5))
+        assert index.search_near("wohngebiet festgesetzt", window=5) == {"2.pdf"}
+        assert index.search_near("wohngebiet festgesetzt", window=5, ordered=True) == set()
+
+
+def test_inverted_index_is_updated_incrementally():
+    document_df = _document_df()
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index_path = os.path.join(index_dir, "index.db")
+        with InvertedIndex(index_path) as index:
+            index.add_documents(document_df.iloc[:2])
+
+        document_df.loc[1, "content"] = "Festgesetzt wird ein Mischgebiet."
+        with InvertedIndex(index_path) as index:
+            # the first document is unchanged, the second is re-indexed and the third is new
+            assert index.add_documents(document_df) == 2
+            assert index.documents() == ["1.pdf", "2.pdf", "3.pdf"]
+            assert index.search_word("wohngebiet") == set()
+            assert index.search_word("mischgebiet") == {"2.pdf"}
+
+            index.remove_documents(["3.pdf"])
+            assert len(index) == 2
+            assert index.search_substring("hochwasser") == {"1.pdf"}
@@ -1,10 +1,74 @@
+import functools
+import http.server
 import os
+import socket
 import tempfile
+import threading
+import time
+import unittest.mock
 
+import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
+
+from data_pipeline.nrw_pdf_downloader.async_http import map_per_host
+from data_pipeline.nrw_pdf_downloader.content_sniffing import TrustedHostCache
+from data_pipeline.nrw_pdf_downloader.content_sniffing import is_downloadable_content
+from data_pipeline.nrw_pdf_downloader.content_store import ContentStore
+from data_pipeline.nrw_pdf_downloader.content_store import expand_to_objectids
+from data_pipeline.nrw_pdf_downloader.download_manifest import DownloadManifest
+from data_pipeline.nrw_pdf_downloader.failure_journal import RetryScheduler
+from data_pipeline.nrw_pdf_downloader.failure_journal import read_failure_journal
+from data_pipeline.nrw_pdf_downloader.geojson_parser import LINK_COLUMNS
+from data_pipeline.nrw_pdf_downloader.geojson_parser import _complete_link
+from data_pipeline.nrw_pdf_downloader.geojson_parser import _extract_download_links
 from data_pipeline.nrw_pdf_downloader.geojson_parser import parse_geojson
+from data_pipeline.nrw_pdf_downloader.geojson_parser import parse_non_downloadable_links
+from data_pipeline.nrw_pdf_downloader.geojson_parser import read_link_table
+from data_pipeline.nrw_pdf_downloader.http_cache import CacheMiss
+from data_pipeline.nrw_pdf_downloader.http_cache import HttpCache
+from data_pipeline.nrw_pdf_downloader import nrw_pdf_scraper
+from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import _write_chunks_atomically
+from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import filtering_useful_data
+from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import parse_date
+from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import parse_dates
+from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import retry_failed_downloads
 from data_pipeline.nrw_pdf_downloader.nrw_pdf_scraper import run_pdf_downloader
+from visualizations.missing_data_analysis.cleaning_download_links import format_merged_errors
+from visualizations.missing_data_analysis.cleaning_download_links import read_errors_from_failure_journal
 
 SAMPLE_TEST_DF = os.path.join(os.path.dirname(__file__), "test_data", "test_15__rows.geojson")
+TEST_PDF_FOLDER = os.path.join(os.path.dirname(__file__), "test_data", "test_pdfs", "success")
+TEST_PDF_NAME = "90876_01.pdf"
+
+
+class _LoggingHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files and records (method, status) of every request in the class attribute request_log."""
+    request_log = []
+
+    def log_request(self, code="-", size="-"):
+        self.request_log.append((self.command, int(code)))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pdf_server():
+    """Serve the test pdfs from a local http server, so the downloader can be tested offline."""
+    _LoggingHandler.request_log = []
+    handler = functools.partial(_LoggingHandler, directory=TEST_PDF_FOLDER)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def _links_df(base_url, n):
+    return pd.DataFrame({"objectid": [str(i) for i in range(n)],
+                         "scanurl": [f"{base_url}/{TEST_PDF_NAME}"] * n,
+                         "datum": ["2015-06-01T00:00:00"] * n})
 
 
 def test_parser():
@@ -22,3 +86,317 @@ def test_parser():
 
         # Check if the folder contains any files or subdirectories
         assert os.listdir(folder_output_path), f"Folder '{folder_output_path}' is empty"
+
+
+def test_concurrent_downloader(pdf_server):
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(_links_df(pdf_server, 5), folder_output_path, concurrent=True)
+
+        expected_size = os.path.getsize(os.path.join(TEST_PDF_FOLDER, TEST_PDF_NAME))
+        for object_id in range(5):
+            pdf_path = os.path.join(folder_output_path, f"{object_id}.pdf")
+            assert os.path.getsize(pdf_path) == expected_size
+
+
+def test_map_per_host_respects_host_limits():
+    in_flight = {}
+    max_in_flight = {}
+    lock = threading.Lock()
+
+    def fake_request(session, url):
+        host = url.split("/")[2]
+        with lock:
+            in_flight[host] = in_flight.get(host, 0) + 1
+            max_in_flight[host] = max(max_in_flight.get(host, 0), in_flight[host])
+        time.sleep(0.01)
+        with lock:
+            in_flight[host] -= 1
+        return url
+
+    urls = [f"https://{host}/{i}" for i in range(10) for host in ["a.de", "b.de"]]
+    results = map_per_host(fake_request, [(url, (url,)) for url in urls],
+                           host_limits={"a.de": 3}, default_limit=1, show_progress=False)
+
+    assert results == urls
+    assert max_in_flight == {"a.de": 3, "b.de": 1}
+
+
+def test_interrupted_download_leaves_no_pdf():
+    class BrokenResponse:
+        def iter_content(self, chunk_size):
+            yield b"%PDF-1.4 first chunk"
+            raise ConnectionError("connection dropped")
+
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        pdf_path = os.path.join(folder_output_path, "1.pdf")
+        with pytest.raises(ConnectionError):
+            _write_chunks_atomically(BrokenResponse().iter_content(1024), pdf_path)
+
+        assert os.listdir(folder_output_path) == []
+
+
+def test_rerun_skips_and_revalidates_completed_downloads(pdf_server):
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(_links_df(pdf_server, 2), folder_output_path)
+        manifest_df = DownloadManifest.for_folder(folder_output_path).to_df()
+        assert manifest_df["status"].tolist() == ["downloaded", "downloaded"]
+        assert manifest_df["last_modified"].notna().all()
+
+        # completed downloads are skipped without any request
+        _LoggingHandler.request_log.clear()
+        run_pdf_downloader(_links_df(pdf_server, 2), folder_output_path)
+        assert _LoggingHandler.request_log == []
+
+        # revalidation sends one conditional GET per file, the unchanged files are not transferred
+        run_pdf_downloader(_links_df(pdf_server, 2), folder_output_path, revalidate=True)
+        assert _LoggingHandler.request_log == [("GET", 304), ("GET", 304)]
+
+
+def test_sniffing_downloader_sends_no_head_requests(pdf_server):
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(_links_df(pdf_server, 3), folder_output_path, sniff=True)
+
+        assert _LoggingHandler.request_log == [("GET", 200)] * 3
+        assert {f"{i}.pdf" for i in range(3)} <= set(os.listdir(folder_output_path))
+
+
+def test_is_downloadable_content():
+    # magic bytes win over wrong headers
+    assert is_downloadable_content("text/html", b"%PDF-1.7 ...")
+    assert is_downloadable_content(None, b"\x89PNG\r\n\x1a\n...")
+    assert not is_downloadable_content("application/pdf", b"  <!DOCTYPE html><html>")
+    # unknown content falls back to the content type
+    assert is_downloadable_content("application/octet-stream", b"\x00\x01")
+    assert not is_downloadable_content("text/plain", b"\x00\x01")
+
+
+def test_trusted_host_cache():
+    cache = TrustedHostCache(trust_after=2)
+    cache.record("a.de", "pdf")
+    assert not cache.is_trusted("a.de")
+    cache.record("a.de", "pdf")
+    assert cache.is_trusted("a.de")
+    cache.record("a.de", "html")
+    assert not cache.is_trusted("a.de")
+
+
+def test_deduplicating_downloader(pdf_server):
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(_links_df(pdf_server, 3), folder_output_path, deduplicate=True)
+
+        store = ContentStore.for_folder(folder_output_path)
+        stored_files = os.listdir(store.root)
+        assert len(stored_files) == 1
+
+        hash_mapping_df = DownloadManifest.for_folder(folder_output_path).hash_mapping()
+        assert sorted(hash_mapping_df["objectid"]) == ["0", "1", "2"]
+        assert hash_mapping_df["sha256"].nunique() == 1
+
+        document_df = pd.DataFrame({"filename": stored_files, "content": ["text"]})
+        expanded_df = expand_to_objectids(document_df, hash_mapping_df)
+        assert sorted(expanded_df["filename"]) == ["0.pdf", "1.pdf", "2.pdf"]
+        assert expanded_df["content"].tolist() == ["text"] * 3
+
+
+def test_failure_journal_and_retries(pdf_server):
+    links_df = _links_df(pdf_server, 2)
+    links_df.loc[1, "scanurl"] = "http://127.0.0.1:1/unreachable.pdf"
+
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(links_df, folder_output_path, max_retries=2, retry_base_delay=0.01)
+
+        journal_df = read_failure_journal(os.path.join(folder_output_path, "failure_journal.csv"))
+        # the first attempt and two retries of the unreachable link are journaled
+        assert journal_df["objectid"].tolist() == ["1"] * 3
+        assert journal_df["attempt"].tolist() == [1, 2, 3]
+        assert journal_df["reason"].unique().tolist() == ["connection_error"]
+        assert journal_df["transient"].all()
+
+        errors_df = pd.read_csv(os.path.join(folder_output_path, "error_links.csv"), dtype=str)
+        assert errors_df["objectid"].tolist() == ["1"]
+
+        # a later run only retries the journaled failure
+        retry_failed_downloads(folder_output_path, max_retries=0)
+        assert len(read_failure_journal(os.path.join(folder_output_path, "failure_journal.csv"))) == 4
+
+
+def test_stalled_download_times_out(monkeypatch):
+    # a server that accepts the connection but never answers
+    listener = socket.create_server(("127.0.0.1", 0))
+    links_df = _links_df(f"http://127.0.0.1:{listener.getsockname()[1]}", 1)
+    monkeypatch.setattr(nrw_pdf_scraper, "DOWNLOAD_TIMEOUT", (1, 0.2))
+
+    with listener, tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(links_df, folder_output_path, sniff=True, max_retries=0)
+
+        journal_df = read_failure_journal(os.path.join(folder_output_path, "failure_journal.csv"))
+        assert journal_df["reason"].tolist() == ["timeout"]
+        assert journal_df["transient"].all()
+
+
+def test_journal_errors_exclude_links_downloaded_later(pdf_server):
+    links_df = _links_df(pdf_server, 2)
+    links_df.loc[1, "scanurl"] = "http://127.0.0.1:1/unreachable.pdf"
+
+    with tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(links_df, folder_output_path, max_retries=0, deduplicate=True)
+        journal_path = os.path.join(folder_output_path, "failure_journal.csv")
+        assert read_errors_from_failure_journal(journal_path)["objectid"].tolist() == ["1"]
+
+        # the link works again in a later run
+        links_df.loc[1, "scanurl"] = f"{pdf_server}/{TEST_PDF_NAME}"
+        run_pdf_downloader(links_df, folder_output_path, max_retries=0, deduplicate=True)
+        assert read_errors_from_failure_journal(journal_path).empty
+
+        merged_df = format_merged_errors(links_df.assign(download_status=None), folder_output_path)
+        assert merged_df["download_status"].tolist() == ["downloaded", "downloaded"]
+
+
+def test_retry_scheduler_backs_off_per_host():
+    scheduler = RetryScheduler(base_delay=10, max_delay=15)
+    scheduler.record_failure("a.de")
+    scheduler.next_pass()
+    assert 9 < scheduler.delay_for("a.de") <= 10
+    assert scheduler.delay_for("b.de") == 0
+
+    scheduler.record_failure("a.de")
+    scheduler.next_pass()
+    assert 14 < scheduler.delay_for("a.de") <= 15
+
+
+def test_extract_download_links_matches_beautiful_soup():
+    page = """<html><body>
+        <a class="x" href="https://www.o-sp.de/download/plan.pdf?id=1&amp;v=2">Plan</a>
+        <A HREF='/download/begruendung.pdf'>Begründung</A>
+        <a href=/download/unquoted.pdf>Unquoted</a>
+        <a href="https://www.o-sp.de/stadt/plan?pid=1">Landing page</a>
+        <link href="/download/stylesheet.css">
+        <a name="anchor">No href</a>
+        </body></html>"""
+    url = "https://www.o-sp.de/stadt/plan?pid=1"
+
+    soup_links = BeautifulSoup(page, "html.parser").find_all(
+        "a", href=lambda value: value and (value.startswith("https://www.o-sp.de/download/")
+                                           or value.startswith("/download/")))
+    expected = [_complete_link(link.get("href")) for link in soup_links]
+
+    assert _extract_download_links(page, url) == expected
+    assert expected[0] == "https://www.o-sp.de/download/plan.pdf?id=1&v=2"
+
+
+def test_landing_pages_are_expanded_concurrently(pdf_server):
+    gdf = pd.DataFrame({"objectid": [1, 2], "scanurl": ["https://www.o-sp.de/stadt/plan?pid=1",
+                                                       f"{pdf_server}/{TEST_PDF_NAME}"]})
+    landing_page = '<a href="/download/a.pdf">a</a><a href="/download/b.pdf">b</a>'
+
+    with unittest.mock.patch("data_pipeline.nrw_pdf_downloader.geojson_parser._get_links_or_none",
+                             lambda session, url, http_cache=None: _extract_download_links(landing_page, url)):
+        result_df = parse_non_downloadable_links(gdf)
+
+    assert result_df["objectid"].tolist() == ["1_0", "1_1", "2"]
+    assert result_df["scanurl"].tolist() == ["https://www.o-sp.de/download/a.pdf",
+                                             "https://www.o-sp.de/download/b.pdf",
+                                             f"{pdf_server}/{TEST_PDF_NAME}"]
+
+
+def test_expansion_replaces_only_the_landing_page_rows():
+    gdf = pd.DataFrame({"objectid": [3, 1, 2],
+                        "scanurl": ["https://www.o-sp.de/a/plan?pid=3", "https://www.o-sp.de/b/plan?pid=1",
+                                    "https://example.org/2.pdf"],
+                        "name": ["three", "one", "two"]})
+    links_per_url = {"https://www.o-sp.de/a/plan?pid=3": ["https://www.o-sp.de/download/3a.pdf",
+                                                          "https://www.o-sp.de/download/3b.pdf"],
+                     "https://www.o-sp.de/b/plan?pid=1": ["https://www.o-sp.de/download/1.pdf"]}
+
+    with unittest.mock.patch("data_pipeline.nrw_pdf_downloader.geojson_parser._get_links_concurrently",
+                             lambda urls, host_limits=None, http_cache=None: links_per_url):
+        result_df = parse_non_downloadable_links(gdf)
+
+    assert result_df["objectid"].tolist() == ["1_0", "2", "3_0", "3_1"]
+    assert result_df["name"].tolist() == ["one", "two", "three", "three"]
+    assert result_df["scanurl"].tolist() == ["https://www.o-sp.de/download/1.pdf", "https://example.org/2.pdf",
+                                             "https://www.o-sp.de/download/3a.pdf",
+                                             "https://www.o-sp.de/download/3b.pdf"]
+
+
+def test_http_cache_revalidates_and_serves_offline(pdf_server):
+    url = f"{pdf_server}/{TEST_PDF_NAME}"
+    with open(os.path.join(TEST_PDF_FOLDER, TEST_PDF_NAME), 'rb') as pdf_file:
+        pdf_content = pdf_file.read()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = HttpCache(cache_dir)
+        with cache.get(url) as response:
+            assert not response.from_cache
+            assert response.content == pdf_content
+        # the cached copy is revalidated and served from disk
+        with cache.get(url) as response:
+            assert response.from_cache
+            assert response.content == pdf_content
+        assert _LoggingHandler.request_log == [("GET", 200), ("GET", 304)]
+
+        offline_cache = HttpCache(cache_dir, offline=True)
+        _LoggingHandler.request_log.clear()
+        with offline_cache.get(url) as response:
+            assert response.content == pdf_content
+        with pytest.raises(CacheMiss):
+            offline_cache.get(f"{pdf_server}/missing.pdf")
+        assert _LoggingHandler.request_log == []
+
+
+def test_http_cache_evicts_least_recently_used(pdf_server):
+    url = f"{pdf_server}/{TEST_PDF_NAME}"
+    pdf_size = os.path.getsize(os.path.join(TEST_PDF_FOLDER, TEST_PDF_NAME))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = HttpCache(cache_dir, max_bytes=2 * pdf_size)
+        for query in ["a", "b", "a", "c"]:
+            cache.get(f"{url}?{query}").close()
+
+        assert cache.size() == 2 * pdf_size
+        offline_cache = HttpCache(cache_dir, offline=True)
+        offline_cache.get(f"{url}?a").close()
+        offline_cache.get(f"{url}?c").close()
+        with pytest.raises(CacheMiss):
+            offline_cache.get(f"{url}?b")
+
+
+def test_downloader_runs_offline_from_cache(pdf_server):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with tempfile.TemporaryDirectory() as folder_output_path:
+            run_pdf_downloader(_links_df(pdf_server, 2), folder_output_path, http_cache=HttpCache(cache_dir))
+
+        with tempfile.TemporaryDirectory() as folder_output_path:
+            _LoggingHandler.request_log.clear()
+            run_pdf_downloader(_links_df(pdf_server, 2), folder_output_path,
+                               http_cache=HttpCache(cache_dir, offline=True))
+
+            assert _LoggingHandler.request_log == []
+            assert {"0.pdf", "1.pdf"} <= set(os.listdir(folder_output_path))
+
+
+def test_downloader_keeps_files_the_cache_revalidates(pdf_server):
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as folder_output_path:
+        run_pdf_downloader(_links_df(pdf_server, 1), folder_output_path, http_cache=HttpCache(cache_dir))
+        inode = os.stat(os.path.join(folder_output_path, "0.pdf")).st_ino
+
+        _LoggingHandler.request_log.clear()
+        run_pdf_downloader(_links_df(pdf_server, 1), folder_output_path, revalidate=True,
+                           http_cache=HttpCache(cache_dir))
+
+        assert ("GET", 304) in _LoggingHandler.request_log
+        # the file is not written again
+        assert os.stat(os.path.join(folder_output_path, "0.pdf")).st_ino == inode
+
+
+def test_read_link_table_skips_geometry_and_parses_dates():
+    link_df = read_link_table(SAMPLE_TEST_DF)
+    assert set(link_df.columns) == set(LINK_COLUMNS)
+    assert len(link_df) == 15
+
+    string_dates = pd.Series(["2015-06-01T00:00:00", "2015-06-01", None])
+    assert parse_dates(string_dates)[0] == parse_date(string_dates[0])
+    assert parse_dates(string_dates).isna().tolist() == [False, True, True]
+
+    # geojson dates are read as datetimes already and must survive the filter
+    assert len(filtering_useful_data(link_df)) == (link_df["datum"].dt.year.between(2012, 2022)).sum()
@@ -0,0 +1,36 @@
+import random
+
+import pandas as pd
+from unstructured.cleaners.core import clean
+
+from features.textual_features.document_texts_creation.text_cleaning import add_cleaned_text
+from features.textual_features.document_texts_creation.text_cleaning import clean_text
+from features.textual_features.document_texts_creation.text_cleaning import clean_texts
+from features.textual_features.keyword_search.exact_keyword_search import search_df_for_keywords
+
+CHARACTERS = "aäBÖß Ü-–—\n\t\xa0§1.,;:İΣ"
+
+
+def test_clean_text_is_equivalent_to_unstructured_clean():
+    random.seed(912)
+    texts = ["".join(random.choices(CHARACTERS, k=random.randint(0, 40))) for _ in range(500)]
+    texts += ["Bebauungsplan Nr. 12-A – Wohngebiet ", "  -Extrem-Hochwasserereignis- "]
+
+    expected = [clean(text, lowercase=True, dashes=True) for text in texts]
+
+    assert [clean_text(text) for text in texts] == expected
+    assert clean_texts(pd.Series(texts)).tolist() == expected
+    assert clean_texts(pd.Series(["A-b", None])).tolist() == ["a b", ""]
+
+
+def test_searches_use_the_cached_cleaned_text():
+    input_df = add_cleaned_text(pd.DataFrame({"filename": ["1.pdf"], "content": ["Misch-Gebiet"]}))
+    assert input_df["content_cleaned"].tolist() == ["misch gebiet"]
+
+    assert search_df_for_keywords(input_df, "filename", "content", {"gebiet": ["misch gebiet"]},
+                                  boolean=True)["gebiet"].tolist() == [True]
+
+    # the cached column is used as it is, the raw text is not cleaned again
+    input_df["content_cleaned"] = ["kein treffer"]
+    assert search_df_for_keywords(input_df, "filename", "content", {"gebiet": ["misch gebiet"]},
+                                  boolean=True)["gebiet"].tolist() == [False]
@@ -1,15 +1,44 @@
+import http.server
+import io
 import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest.mock
 
 import pandas as pd
+import pypdf
 import pytest
 
+from data_pipeline.pdf_scraper.document_sink import read_documents
+from data_pipeline.pdf_scraper.extraction_backends import PypdfBackend
+from data_pipeline.pdf_scraper.extraction_backends import TriageBackend
+from data_pipeline.pdf_scraper.extraction_backends import get_backend
+from data_pipeline.pdf_scraper.page_index import get_page
+from data_pipeline.pdf_scraper.pdf_triage import triage_folder
+from data_pipeline.pdf_scraper.page_index import join_pages
+from data_pipeline.pdf_scraper.page_index import page_number_at
+from data_pipeline.pdf_scraper.page_index import read_page
+from data_pipeline.pdf_scraper.page_index import split_pages
+from data_pipeline.pdf_scraper.page_index import write_text_with_page_index
+from data_pipeline.pdf_scraper.page_index import xhtml_to_pages
 from data_pipeline.pdf_scraper.tika_pdf_scraper import pdf_parser_from_folder
 from data_pipeline.pdf_scraper.tika_pdf_scraper import pdf_parser_from_path
+from data_pipeline.pdf_scraper.tika_pdf_scraper import pdf_parser_to_file
+from data_pipeline.pdf_scraper.tika_server_pool import EMBEDDED_CONTENT_KEY
+from data_pipeline.pdf_scraper.tika_server_pool import MIN_TIMEOUT
+from data_pipeline.pdf_scraper.tika_server_pool import QuarantineList
+from data_pipeline.pdf_scraper.tika_server_pool import TikaServerPool
+from data_pipeline.pdf_scraper.tika_server_pool import _parse_rmeta
+from data_pipeline.pdf_scraper.tika_server_pool import adaptive_timeout
 
 # specify paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FOLDER_PATH_TO_SUCCESS = os.path.join(BASE_DIR, "test_data", "test_pdfs", "success")
 FILE_PATH_TO_SUCCESS = os.path.join(FOLDER_PATH_TO_SUCCESS, "90860_01.pdf")
+FILE_PATH_TO_TEXT_PDF = os.path.join(FOLDER_PATH_TO_SUCCESS, "90876_01.pdf")
 
 
 def test_error_pdf_parser_from_folder():
@@ -46,3 +75,390 @@ def test_pdf_parser_from_path():
 
     # assert datatypes
     assert isinstance(result_dict, dict)
+
+
+def test_parallel_pdf_parser_from_folder_keeps_file_order():
+    """Test whether the worker pool keeps several requests in flight and returns the rows in file order.
+    """
+    lock = threading.Lock()
+    in_flight = {"current": 0, "max": 0}
+    endpoints = []
+
+    def fake_from_file(filename, serverEndpoint, xmlContent, requestOptions):
+        with lock:
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+            endpoints.append(serverEndpoint)
+        # later files finish first
+        time.sleep(0.05 * (10 - int(os.path.basename(filename)[:1])))
+        with lock:
+            in_flight["current"] -= 1
+        return {"content": os.path.basename(filename), "metadata": {}}
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        for i in range(8):
+            with open(os.path.join(folder_path, f"{i}.pdf"), 'wb') as pdf_file:
+                pdf_file.write(b"%PDF-1.4\n%%EOF")
+
+        with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file):
+            result_df = pdf_parser_from_folder(folder_path=folder_path,
+                                               n_workers=4,
+                                               server_endpoints=["http://tika-1:9998", "http://tika-2:9998"])
+
+    assert (result_df["filename"] == result_df["content"]).all()
+    assert in_flight["max"] == 4
+    assert set(endpoints) == {"http://tika-1:9998", "http://tika-2:9998"}
+
+
+def test_extraction_cache_parses_only_new_or_modified_pdfs():
+    """Test whether unchanged pdfs are served from the extraction cache in a second run.
+    """
+    parsed_files = []
+
+    def fake_from_file(filename, serverEndpoint, xmlContent, requestOptions):
+        parsed_files.append(os.path.basename(filename))
+        with open(filename, 'rb') as pdf_file:
+            return {"content": pdf_file.read().decode(), "metadata": {"Content-Type": "application/pdf"}}
+
+    with tempfile.TemporaryDirectory() as folder_path, tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = os.path.join(cache_dir, "extraction_cache.sqlite")
+        for i in range(3):
+            with open(os.path.join(folder_path, f"{i}.pdf"), 'w') as pdf_file:
+                pdf_file.write(f"%PDF-1.4 {i}\n%%EOF")
+
+        with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file), \
+                unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.tika_server_version",
+                                    return_value="2.6.0"):
+            first_df = pdf_parser_from_folder(folder_path=folder_path, cache_path=cache_path)
+            with open(os.path.join(folder_path, "1.pdf"), 'w') as pdf_file:
+                pdf_file.write("%PDF-1.4 modified\n%%EOF")
+            second_df = pdf_parser_from_folder(folder_path=folder_path, cache_path=cache_path)
+
+    assert sorted(parsed_files) == ["0.pdf", "1.pdf", "1.pdf", "2.pdf"]
+    assert second_df.set_index("filename").loc["1.pdf", "content"] == "%PDF-1.4 modified\n%%EOF"
+    assert (first_df["metadata"] == second_df["metadata"]).all()
+
+
+def test_tika_backend_version_is_the_server_version():
+    """Test whether the version in the cache key is requested from the Tika server doing the parsing.
+    """
+    requested_paths = []
+
+    class VersionHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested_paths.append(self.path)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"Apache Tika 9.9.9")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), VersionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = get_backend("pypdf+tika", server_endpoint=f"http://127.0.0.1:{server.server_address[1]}")
+        assert backend.version == "pypdf-" + pypdf.__version__ + "+tika-9.9.9"
+        assert backend.version == "pypdf-" + pypdf.__version__ + "+tika-9.9.9"
+    finally:
+        server.shutdown()
+
+    # the server is asked once per backend
+    assert requested_paths == ["/version"]
+
+
+def test_pypdf_backend_falls_back_to_tika():
+    """Test whether pdfs with a text layer are parsed in-process and other files are sent to Tika.
+    """
+    backend = get_backend("pypdf+tika")
+    fake_from_file = unittest.mock.Mock(return_value={"content": "tika", "metadata": {}})
+
+    with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file):
+        parsed = backend.extract(FILE_PATH_TO_TEXT_PDF)
+        assert "Planzeichenverordnung" in parsed["content"]
+        assert parsed["metadata"]["xmpTPg:NPages"] == "1"
+        assert not fake_from_file.called
+
+        with tempfile.TemporaryDirectory() as folder_path:
+            png_path = os.path.join(folder_path, "scan.png")
+            with open(png_path, 'wb') as png_file:
+                png_file.write(b"\x89PNG\r\n\x1a\n")
+            assert backend.extract(png_path)["content"] == "tika"
+
+    with pytest.raises(ValueError):
+        get_backend("pdfminer")
+
+
+@pytest.mark.parametrize("output_name", ["documents.jsonl", "documents.parquet"])
+def test_pdf_parser_to_file_resumes_after_crash(output_name):
+    """Test whether streamed documents survive a crash and the next run only parses the missing files.
+    """
+    parsed_files = []
+
+    def fake_from_file(filename, serverEndpoint, xmlContent, requestOptions):
+        parsed_files.append(os.path.basename(filename))
+        # the process dies while the fourth file is parsed
+        if len(parsed_files) == 4:
+            raise KeyboardInterrupt
+        return {"content": os.path.basename(filename), "metadata": {"Content-Type": "application/pdf"}}
+
+    with tempfile.TemporaryDirectory() as folder_path, tempfile.TemporaryDirectory() as output_dir:
+        output_path = os.path.join(output_dir, output_name)
+        for i in range(5):
+            with open(os.path.join(folder_path, f"{i}.pdf"), 'wb') as pdf_file:
+                pdf_file.write(b"%PDF-1.4\n%%EOF")
+
+        with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file):
+            with pytest.raises(KeyboardInterrupt):
+                pdf_parser_to_file(folder_path, output_path, n_workers=1, row_group_size=2)
+            assert len(read_documents(output_path)) == 3
+
+            assert pdf_parser_to_file(folder_path, output_path, n_workers=1, row_group_size=2) == 2
+
+        documents_df = read_documents(output_path)
+
+    assert sorted(documents_df["filename"]) == [f"{i}.pdf" for i in range(5)]
+    assert (documents_df["filename"] == documents_df["content"]).all()
+    assert len(parsed_files) == 6
+
+
+def test_pdf_parser_to_file_retries_failed_files():
+    """Test whether files that failed to parse are not written to the sink and parsed again by the next run.
+    """
+    fail = {"1.pdf"}
+
+    def fake_from_file(filename, serverEndpoint, xmlContent, requestOptions):
+        if os.path.basename(filename) in fail:
+            raise TimeoutError("Tika timed out")
+        return {"content": os.path.basename(filename), "metadata": {"Content-Type": "application/pdf"}}
+
+    with tempfile.TemporaryDirectory() as folder_path, tempfile.TemporaryDirectory() as output_dir:
+        output_path = os.path.join(output_dir, "documents.jsonl")
+        for i in range(3):
+            with open(os.path.join(folder_path, f"{i}.pdf"), 'wb') as pdf_file:
+                pdf_file.write(b"%PDF-1.4\n%%EOF")
+
+        with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file):
+            assert pdf_parser_to_file(folder_path, output_path, n_workers=1) == 2
+            fail.clear()
+            assert pdf_parser_to_file(folder_path, output_path, n_workers=1) == 1
+
+        documents_df = read_documents(output_path)
+
+    assert sorted(documents_df["filename"]) == ["0.pdf", "1.pdf", "2.pdf"]
+    assert documents_df["metadata"].notna().all()
+
+
+def test_page_index():
+    """Test whether pages can be recovered from the content, the txt file and the Tika XHTML output.
+    """
+    pages = ["Seite eins", "Seite zwei mit Überschwemmungsgebiet", "", "Seite vier"]
+    content, page_offsets = join_pages(pages)
+
+    assert split_pages(content, page_offsets) == pages
+    assert get_page(content, page_offsets, 2) == pages[1]
+    assert page_number_at(page_offsets, content.index("Überschwemmungsgebiet")) == 2
+    assert page_number_at(page_offsets, len(content) - 1) == 4
+
+    with tempfile.TemporaryDirectory() as txt_dir:
+        txt_path = os.path.join(txt_dir, "plan.txt")
+        write_text_with_page_index(txt_path, content, page_offsets)
+        assert [read_page(txt_path, page_number) for page_number in range(1, 5)] == pages
+        with open(txt_path, encoding='utf-8') as txt_file:
+            assert txt_file.read() == content
+
+    xhtml = ('<html><head><title>x</title></head><body>'
+             '<div class="page"><p>Erste &amp; Seite</p>\n<p>Zeile</p></div>'
+             '<div class="page"><p>Zweite Seite</p><div class="annotation"><p>Notiz</p></div></div>'
+             '</body></html>')
+    assert xhtml_to_pages(xhtml) == ["Erste & Seite\n\nZeile", "Zweite Seite\nNotiz"]
+
+
+def test_tika_pages_have_the_words_of_the_plain_text():
+    """Test whether the tika backend keeps Tika's plain text and tika-pages splits the same words into pages.
+    """
+    plain_text = "\nErste & Seite\nZeile\n\n\nZweite Seite\n\nNotiz\n"
+    xhtml = ('<html><head><title>x</title></head><body>'
+             '<div class="page"><p>Erste &amp; Seite</p>\n<p>Zeile</p></div>\n'
+             '<div class="page"><p>Zweite Seite</p><div class="annotation"><p>Notiz</p></div></div>'
+             '</body></html>')
+
+    def fake_from_file(filename, serverEndpoint, xmlContent, requestOptions):
+        return {"content": xhtml if xmlContent else plain_text, "metadata": {"Content-Type": "application/pdf"}}
+
+    with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file):
+        plain = get_backend("tika", server_endpoint="http://tika:9998").extract(FILE_PATH_TO_TEXT_PDF)
+        paged = get_backend("tika-pages", server_endpoint="http://tika:9998").extract(FILE_PATH_TO_TEXT_PDF)
+
+    assert (plain["content"], plain["page_offsets"]) == (plain_text, None)
+    assert paged["content"].split() == plain["content"].split()
+    assert get_page(paged["content"], paged["page_offsets"], 2) == "Zweite Seite\nNotiz"
+
+
+# minimal stand-in for a Tika server process, hangs on files containing b"hang"
+FAKE_TIKA_SERVER = """
+import http.server, json, sys, time
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._answer(b"Apache Tika fake", "text/plain")
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if b"hang" in data:
+            time.sleep(60)
+        if self.path.endswith("/xml"):
+            content = "<html><body><div class='page'><p>" + data.decode() + "</p></div></body></html>"
+        else:
+            content = "\\n" + data.decode() + "\\n"
+        self._answer(json.dumps([{"X-TIKA:content": content, "Content-Type": "application/pdf"}]).encode(),
+                     "application/json")
+
+http.server.ThreadingHTTPServer(("127.0.0.1", int(sys.argv[1])), Handler).serve_forever()
+"""
+
+
+class FakeTikaServerPool(TikaServerPool):
+    def _ensure_jar(self):
+        pass
+
+    def _server_command(self, port):
+        return [sys.executable, "-c", FAKE_TIKA_SERVER, str(port)]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_tika_server_pool_restarts_hung_server_and_quarantines_file():
+    """Test whether a file that hangs the server is quarantined and the restarted server keeps parsing.
+    """
+    with tempfile.TemporaryDirectory() as folder_path:
+        for name, content in [("ok.pdf", b"Bebauungsplan"), ("hang.pdf", b"hang")]:
+            with open(os.path.join(folder_path, name), 'wb') as pdf_file:
+                pdf_file.write(content)
+
+        pool = FakeTikaServerPool(n_servers=1, base_port=_free_port(), max_attempts=1, min_timeout=1,
+                                  max_timeout=1, quarantine_path=os.path.join(folder_path, "quarantine.csv"),
+                                  log_dir=folder_path)
+        with pool:
+            backend = get_backend("tika", tika_pool=pool)
+            assert backend.extract(os.path.join(folder_path, "ok.pdf"))["content"] == "\nBebauungsplan\n"
+            parsed = get_backend("tika-pages", tika_pool=pool).extract(os.path.join(folder_path, "ok.pdf"))
+            assert (parsed["content"], parsed["page_offsets"]) == ("Bebauungsplan", [0])
+
+            hang_path = os.path.join(folder_path, "hang.pdf")
+            assert pdf_parser_from_path(hang_path, backend=backend)["metadata"] is None
+            assert pool.quarantine.to_dict() == {hang_path: "timeout"}
+
+            assert backend.extract(os.path.join(folder_path, "ok.pdf"))["content"] == "\nBebauungsplan\n"
+
+        assert QuarantineList(os.path.join(folder_path, "quarantine.csv")).contains(hang_path)
+
+
+def test_embedded_documents_are_not_split_into_pages():
+    """Test whether only the pages of the main document are counted and embedded documents are kept apart.
+    """
+    documents = [{"X-TIKA:content": '<body><div class="page"><p>Seite 1</p></div><div class="page"><p>Seite 2</p>'
+                                    '</div></body>',
+                  "Content-Type": "application/pdf"},
+                 {"X-TIKA:content": '<body><p>Anhang</p></body>', "Content-Type": "image/png"}]
+
+    parsed = _parse_rmeta(documents, pages=True)
+
+    assert split_pages(parsed["content"], parsed["page_offsets"]) == ["Seite 1", "Seite 2"]
+    assert parsed["metadata"][EMBEDDED_CONTENT_KEY] == ["Anhang"]
+    assert parsed["metadata"]["Content-Type"] == ["application/pdf", "image/png"]
+
+
+def test_tika_server_pool_restarts_idle_server_that_died():
+    """Test whether the periodic health check restarts a server that died between files.
+    """
+    with tempfile.TemporaryDirectory() as folder_path:
+        pdf_path = os.path.join(folder_path, "ok.pdf")
+        with open(pdf_path, 'wb') as pdf_file:
+            pdf_file.write(b"Bebauungsplan")
+
+        with FakeTikaServerPool(n_servers=1, base_port=_free_port(), log_dir=folder_path,
+                                health_check_interval=0.2) as pool:
+            server = pool._servers[0]
+            server.process.kill()
+
+            deadline = time.monotonic() + 30
+            while server.generation < 2 and time.monotonic() < deadline:
+                time.sleep(0.1)
+
+            assert server.generation == 2
+            # wait until the restarted server is warm
+            with server.lock:
+                pass
+            assert pool.extract(pdf_path)["content"] == "\nBebauungsplan\n"
+
+
+def test_adaptive_timeout_grows_with_pages():
+    """Test whether the timeout of a file grows with its number of pages and is capped.
+    """
+    assert adaptive_timeout(FILE_PATH_TO_TEXT_PDF) > MIN_TIMEOUT + 1
+    assert adaptive_timeout(FILE_PATH_TO_TEXT_PDF, max_timeout=5) == 5
+
+
+def test_triage_routes_files():
+    """Test whether text pdfs, scans, HTML error pages and truncated pdfs are routed before any parsing.
+    """
+    with open(FILE_PATH_TO_TEXT_PDF, 'rb') as pdf_file:
+        text_pdf = pdf_file.read()
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width=595, height=842)
+    scan_pdf = io.BytesIO()
+    writer.write(scan_pdf)
+
+    files = {"text.pdf": text_pdf,
+             "scan.pdf": scan_pdf.getvalue(),
+             "error.pdf": b"<!DOCTYPE html><html><body>404</body></html>",
+             "truncated.pdf": text_pdf[:len(text_pdf) // 2],
+             "empty.pdf": b""}
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        for name, content in files.items():
+            with open(os.path.join(folder_path, name), 'wb') as pdf_file:
+                pdf_file.write(content)
+
+        reject_list_path = os.path.join(folder_path, "rejected.csv")
+        triage_df = triage_folder(folder_path, reject_list_path=reject_list_path).set_index("filename")
+        assert sorted(pd.read_csv(reject_list_path)["filename"]) == ["empty.pdf", "error.pdf", "truncated.pdf"]
+
+        fake_from_file = unittest.mock.Mock(return_value={"content": None, "metadata": {}})
+        with unittest.mock.patch("data_pipeline.pdf_scraper.extraction_backends.parser.from_file", fake_from_file):
+            parsed_df = pdf_parser_from_folder(folder_path, n_workers=1, backend="triage").set_index("filename")
+
+    assert triage_df["route"].to_dict() == {"empty.pdf": "reject", "error.pdf": "reject", "scan.pdf": "tika",
+                                            "text.pdf": "fast", "truncated.pdf": "reject"}
+    assert triage_df.loc["error.pdf", "reason"] == "html"
+    # only the scan is sent to Tika
+    assert fake_from_file.call_count == 1
+    assert "Planzeichenverordnung" in parsed_df.loc["text.pdf", "content"]
+    assert parsed_df.loc["error.pdf", "metadata"] is None
+
+
+def test_triage_passes_files_pypdf_fails_on_to_tika():
+    """Test whether any pypdf error on a file routed to the fast backend falls back to Tika instead of failing.
+    """
+    full_backend = unittest.mock.Mock()
+    full_backend.extract.return_value = {"content": "Tika", "page_offsets": None, "metadata": {}}
+    backend = TriageBackend(PypdfBackend(), full_backend)
+
+    with unittest.mock.patch.object(PypdfBackend, "extract", side_effect=KeyError("/Root")):
+        assert backend.extract(FILE_PATH_TO_TEXT_PDF)["content"] == "Tika"
+    full_backend.extract.assert_called_once_with(FILE_PATH_TO_TEXT_PDF, None)